@@ -39,6 +39,7 @@ the data.""",
         'hr',
         'hr_holidays',
         'hr_holidays_extension',
+        'hr_schedule',
     ],
     'data': [
         'security/ir.model.access.csv',
@@ -23,6 +23,7 @@ import time
 
 from openerp.osv import fields, orm
 from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OE_DATEFORMAT
+from openerp.addons.hr_schedule.bulk import insert_rows
 
 
 class hr_accrual(orm.Model):
@@ -96,3 +97,11 @@ class hr_accrual_line(orm.Model):
     }
 
     _rec_name = 'date'
+
+    def create_bulk(self, cr, uid, vals_list, context=None):
+        """Create the accrual lines of vals_list, which have a date,
+        accrual_id, employee_id and amount, and return their ids."""
+
+        columns = ['date', 'accrual_id', 'employee_id', 'amount']
+        return insert_rows(cr, uid, 'hr_accrual_line', columns, [
+            tuple(vals[c] for c in columns) for vals in vals_list])
@@ -32,6 +32,7 @@ Keep Track of Length of Employment
     'license': 'AGPL-3',
     'depends': [
         'hr',
+        'hr_contract',
         'hr_security',
     ],
     "external_dependencies": {
@@ -27,6 +27,28 @@ from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OE_DATEFORMAT
 from openerp.tools.translate import _
 
 
+def _relativedelta_sql(query):
+    """Wrap query, which selects an id and two dates dt1 and dt2, to
+    return the id with the months and days of relativedelta(dt1, dt2)."""
+
+    return """\
+SELECT id, months, dt1 - (dt2 + months * interval '1 month')::date AS days
+FROM (
+  SELECT id, dt1, dt2,
+         m0 + CASE
+                WHEN dt1 >= dt2 AND dt1 < dt2 + m0 * interval '1 month'
+                  THEN -1
+                WHEN dt1 < dt2 AND dt1 > dt2 + m0 * interval '1 month'
+                  THEN 1
+                ELSE 0
+              END AS months
+  FROM (
+    SELECT id, dt1, dt2,
+           ((EXTRACT(YEAR FROM dt1) - EXTRACT(YEAR FROM dt2)) * 12
+            + EXTRACT(MONTH FROM dt1) - EXTRACT(MONTH FROM dt2))::int AS m0
+    FROM (%s) q) m) r""" % query
+
+
 class hr_employee(orm.Model):
 
     _inherit = 'hr.employee'
@@ -60,64 +82,93 @@ class hr_employee(orm.Model):
             months= +1) + relativedelta(days= -1)
         return last_date.day
 
+    def _service_query(self, where):
+        """Return the SQL query of the length of service of employees as of
+        the date parameter %(today)s, restricted by the where clause. Each
+        row holds the employee id, initial employment date, start of the
+        first contract, total months and days of service (summed as
+        relativedelta does) and the months of service as a float.
+        """
+
+        # Archived contracts are left out, as they are from the contracts
+        # of employees, when hr_contract_init adds the active field
+        if 'active' in self.pool.get('hr.contract')._columns:
+            contracts = "(SELECT * FROM hr_contract WHERE active)"
+        else:
+            contracts = "hr_contract"
+
+        return """\
+SELECT id, initial_employment_date, first_start, months, days,
+       months + days::float / EXTRACT(DAY FROM
+           date_trunc('month', initial) + interval '1 month'
+           - interval '1 day') AS service
+FROM (
+  SELECT e.id, e.initial_employment_date, f.first_start,
+         COALESCE(e.initial_employment_date, f.first_start) AS initial,
+         COALESCE(i.months, 0) + COALESCE(c.months, 0) AS months,
+         COALESCE(i.days, 0) + COALESCE(c.days, 0) AS days
+  FROM hr_employee e
+    JOIN (SELECT employee_id, MIN(date_start) AS first_start
+          FROM %s c
+          GROUP BY employee_id) f ON f.employee_id = e.id
+    LEFT JOIN (%s) i ON i.id = e.id
+    LEFT JOIN (SELECT id, SUM(months) AS months, SUM(days) AS days
+               FROM (%s) r
+               GROUP BY id) c ON c.id = e.id
+  WHERE %s) s""" % (
+            contracts,
+            _relativedelta_sql("""\
+SELECT e.id, f.first_start AS dt1, e.initial_employment_date AS dt2
+FROM hr_employee e
+  JOIN (SELECT employee_id, MIN(date_start) AS first_start
+        FROM """ + contracts + """ c
+        GROUP BY employee_id) f ON f.employee_id = e.id
+WHERE e.initial_employment_date IS NOT NULL"""),
+            _relativedelta_sql("""\
+SELECT employee_id AS id,
+       LEAST(COALESCE(date_end, %(today)s), %(today)s) AS dt1,
+       date_start AS dt2
+FROM """ + contracts + """ c
+WHERE date_start < %(today)s"""),
+            where)
+
     def get_months_service_to_date(
             self, cr, uid, ids, dToday=None, context=None):
-        """Returns a dictionary of floats. The key is the employee id,
-        and the value is number of months of employment.
+        """Returns a dictionary of tuples. The key is the employee id, and
+        the value is the number of months of employment (a float) and the
+        date of initial employment. All the employees are computed with a
+        single query.
         """
 
-        res = dict.fromkeys(ids, 0)
+        if isinstance(ids, (int, long)):
+            ids = [ids]
         if dToday is None:
             dToday = date.today()
-        employee_pool = self.pool['hr.employee']
-        for ee in employee_pool.browse(cr, uid, ids, context=context):
-
-            delta = relativedelta(dToday, dToday)
-            contracts = self._get_contracts_list(ee)
-            if len(contracts) == 0:
-                res[ee.id] = (0.0, False)
-                continue
 
-            dInitial = datetime.strptime(
-                contracts[0].date_start, OE_DATEFORMAT).date()
-
-            if ee.initial_employment_date:
-                dFirstContract = dInitial
-                dInitial = datetime.strptime(
-                    ee.initial_employment_date, OE_DATEFORMAT).date()
-                if dFirstContract < dInitial:
-                    raise orm.except_orm(
-                        _('Employment Date mismatch!'),
-                        _("The initial employment date cannot be after the "
-                          "first contract in the system.\n"
-                          "Employee: %s", ee.name))
-
-                delta = relativedelta(dFirstContract, dInitial)
-
-            for c in contracts:
-                dStart = datetime.strptime(c.date_start, '%Y-%m-%d').date()
-                if dStart >= dToday:
-                    continue
-
-                # If the contract doesn't have an end date, use today's date
-                # If the contract has finished consider the entire duration of
-                # the contract, otherwise consider only the months in the
-                # contract until today.
-                #
-                if c.date_end:
-                    dEnd = datetime.strptime(c.date_end, '%Y-%m-%d').date()
+        res = dict.fromkeys(ids, (0.0, False))
+        if res:
+            cr.execute(self._service_query('e.id IN %(ids)s'), {
+                'today': dToday,
+                'ids': tuple(res),
+            })
+            rows = cr.fetchall()
+            for (ee_id, dInitial, dFirstContract, months,
+                 days, service) in rows:
+                dFirstContract = datetime.strptime(
+                    dFirstContract, OE_DATEFORMAT).date()
+                if dInitial:
+                    dInitial = datetime.strptime(
+                        dInitial, OE_DATEFORMAT).date()
+                    if dFirstContract < dInitial:
+                        ee = self.browse(cr, uid, ee_id, context=context)
+                        raise orm.except_orm(
+                            _('Employment Date mismatch!'),
+                            _("The initial employment date cannot be after "
+                              "the first contract in the system.\n"
+                              "Employee: %s") % ee.name)
                 else:
-                    dEnd = dToday
-                if dEnd > dToday:
-                    dEnd = dToday
-
-                delta += relativedelta(dEnd, dStart)
-
-            # Set the number of months the employee has worked
-            date_part = float(delta.days) / float(
-                self._get_days_in_month(dInitial))
-            res[ee.id] = (
-                float((delta.years * 12) + delta.months) + date_part, dInitial)
+                    dInitial = dFirstContract
+                res[ee_id] = (service, dInitial)
 
         return res
 
@@ -131,33 +182,36 @@ class hr_employee(orm.Model):
         return res
 
     def _search_amount(self, cr, uid, obj, name, args, context):
-        ids = set()
-        for cond in args:
+        query = self._service_query('TRUE')
+        where = []
+        params = {'today': date.today()}
+        for i, cond in enumerate(args):
+            operator = cond[1]
+            if operator not in ['=', '!=', '<>', '<', '<=', '>', '>=',
+                                'in', 'not in']:
+                continue
             amount = cond[2]
-            if isinstance(cond[2], (list, tuple)):
-                if cond[1] in ['in', 'not in']:
-                    amount = tuple(cond[2])
-                else:
-                    continue
-            else:
-                if cond[1] in [
-                        '=like',
-                        'like',
-                        'not like',
-                        'ilike',
-                        'not ilike',
-                        'in',
-                        'not in',
-                        'child_of', ]:
-                    continue
-
-            cr.execute("select id from hr_employee having %s %%s" %
-                       (cond[1]), (amount,))
-            res_ids = set(id[0] for id in cr.fetchall())
-            ids = ids and (ids & res_ids) or res_ids
-        if ids:
-            return [('id', 'in', tuple(ids))]
-        return [('id', '=', '0')]
+            if operator in ['in', 'not in']:
+                if not isinstance(amount, (list, tuple)):
+                    amount = [amount]
+                amount = tuple(float(a) for a in amount) or (None,)
+            elif isinstance(amount, (list, tuple)):
+                continue
+            key = 'amount%d' % i
+            where.append('COALESCE(s.service, 0) %s %%(%s)s' % (
+                operator, key))
+            params[key] = amount
+
+        if not where:
+            return []
+
+        # Employees without contracts have no service at all
+        cr.execute("""\
+SELECT e.id
+FROM hr_employee e
+  LEFT JOIN (""" + query + """) s ON s.id = e.id
+WHERE """ + ' AND '.join(where), params)
+        return [('id', 'in', [r[0] for r in cr.fetchall()])]
 
     _columns = {
         'initial_employment_date': fields.date(
@@ -169,6 +223,7 @@ class hr_employee(orm.Model):
         'length_of_service': fields.function(
             _get_employed_months,
             type='float',
+            fnct_search=_search_amount,
             method=True,
             groups=False,
             string='Length of Service',
@@ -28,6 +28,26 @@ from openerp.osv import fields, orm
 from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT as OE_DTFORMAT
 from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OE_DFORMAT
 from openerp.tools.translate import _
+from openerp.addons.hr_schedule.bulk import execute_values
+
+
+class _EmployeePublicHolidays(object):
+
+    """Public holidays at the location of an employee, for the onchanges
+    that walk a leave one day after another. The dates of each year come
+    from the cache of hr.holidays.public.get_holidays_dates().
+    """
+
+    def __init__(self, cr, uid, holiday_obj, employee_id, context=None):
+        self.cr = cr
+        self.uid = uid
+        self.holiday_obj = holiday_obj
+        self.country_id, self.state_id = holiday_obj.get_employee_location(
+            cr, uid, employee_id, context=context)
+
+    def contains(self, d):
+        return d.strftime(OE_DFORMAT) in self.holiday_obj.get_holidays_dates(
+            self.cr, self.uid, d.year, self.country_id, self.state_id)
 
 
 class hr_holidays_status(orm.Model):
@@ -188,14 +208,16 @@ class hr_holidays(orm.Model):
             )
             utcdtStart = dtStart.astimezone(utc)
 
+        public_holidays = _EmployeePublicHolidays(
+            cr, uid, holiday_obj, employee.id, context=context)
+
         count_days = no_days
         real_days = 1
         ph_days = 0
         r_days = 0
         next_dt = dt
         while count_days > 1:
-            public_holiday = holiday_obj.is_public_holiday(
-                cr, uid, next_dt.date(), context=context)
+            public_holiday = public_holidays.contains(next_dt.date())
             public_holiday = (public_holiday and ex_ph)
             rest_day = (next_dt.weekday() in rest_days and ex_rd)
             next_dt += timedelta(days=+1)
@@ -210,11 +232,8 @@ class hr_holidays(orm.Model):
                 count_days -= 1
                 real_days += 1
         while ((next_dt.weekday() in rest_days and ex_rd)
-                or (holiday_obj.is_public_holiday(
-                    cr, uid, next_dt.date(), context=context
-                ) and ex_ph)):
-            if holiday_obj.is_public_holiday(
-                    cr, uid, next_dt.date(), context=context):
+                or (public_holidays.contains(next_dt.date()) and ex_ph)):
+            if public_holidays.contains(next_dt.date()):
                 ph_days += 1
             elif next_dt.weekday() in rest_days:
                 r_days += 1
@@ -278,10 +297,10 @@ class hr_holidays(orm.Model):
 
         dt = datetime.strptime(date_to, OE_DTFORMAT)
         return_date = dt + timedelta(days=+1)
+        public_holidays = _EmployeePublicHolidays(
+            cr, uid, holiday_obj, employee_id, context=context)
         while ((return_date.weekday() in rest_days and ex_rd)
-               or (holiday_obj.is_public_holiday(
-                   cr, uid, return_date.date(), context=context
-               ) and ex_ph)):
+               or (public_holidays.contains(return_date.date()) and ex_ph)):
             return_date += timedelta(days=1)
         res['value']['return_date'] = return_date.strftime('%B %d, %Y')
         return res
@@ -363,3 +382,38 @@ class hr_attendance(orm.Model):
         return super(hr_attendance, self).create(
             cr, uid, vals, context=context
         )
+
+    def _check_create_bulk(self, cr, uid, vals_list, context=None):
+
+        # Same check as create(), for all the punches at once
+        punches = [
+            (vals['employee_id'], vals['name'])
+            for vals in vals_list if vals.get('name', False)
+        ]
+        rows = execute_values(cr, """\
+SELECT v.employee_id, v.name
+FROM (VALUES %s)
+  AS v(employee_id, name)
+WHERE EXISTS (SELECT 1
+              FROM hr_holidays h
+              WHERE h.employee_id = v.employee_id
+                AND h.type = 'remove'
+                AND h.date_from <= v.name::timestamp
+                AND h.date_to >= v.name::timestamp
+                AND h.state NOT IN ('cancel', 'refuse'))
+ORDER BY v.name
+LIMIT 1""", punches, fetch=True)
+        if rows:
+            row = rows[0]
+            ee_data = self.pool.get('hr.employee').read(
+                cr, uid, row[0], ['name'], context=context
+            )
+            raise orm.except_orm(
+                _('Warning'),
+                _("There is already one or more leaves recorded for the "
+                  "date you have chosen:\n"
+                  "Employee: %s\n"
+                  "Date: %s" % (ee_data['name'], row[1])))
+
+        return super(hr_attendance, self)._check_create_bulk(
+            cr, uid, vals_list, context=context)
@@ -19,15 +19,39 @@
 #
 #
 
+import logging
+
+from bisect import bisect_left, bisect_right
 from pytz import timezone, utc
 from datetime import datetime, timedelta
 
 import openerp.addons.decimal_precision as dp
+from openerp import tools
 from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OE_DATEFORMAT
 from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT as OE_DATETIMEFORMAT
 from openerp.tools.translate import _
 from openerp.osv import fields, orm
 
+_logger = logging.getLogger(__name__)
+
+
+class sorted_punches(list):
+
+    """List of (action, name) attendance punches ordered by name, which
+    also holds the punch times parsed once so that the punches of a range
+    of time can be found by bisection.
+    """
+
+    def __init__(self, punches=()):
+        super(sorted_punches, self).__init__(punches)
+        self.times = [
+            datetime.strptime(name, OE_DATETIMEFORMAT) for action, name in self
+        ]
+
+    def search(self, ndtFrom, ndtTo):
+        return self[bisect_left(self.times, ndtFrom):
+                    bisect_right(self.times, ndtTo)]
+
 
 class last_X_days:
 
@@ -54,6 +78,81 @@ class last_X_days:
         return res
 
 
+class worked_days_context:
+
+    """Worked Days Computation Context
+    Resolves the policy codes, schedule template data and schedule rest
+    days needed by the worked days computation of a payslip once per
+    policy, template or schedule week, and answers the day loop from
+    memory. Keeps count of the ORM calls it made and of the ones it saved.
+    """
+
+    def __init__(self, cr, uid, pool, day_from, day_to, context=None):
+        self.cr = cr
+        self.uid = uid
+        self.pool = pool
+        self.day_from = day_from.strftime(OE_DATEFORMAT)
+        self.day_to = day_to.strftime(OE_DATEFORMAT)
+        self.context = context
+        self.orm_calls = 0
+        self.saved_calls = 0
+        self._cache = {}
+
+    def call(self, model, method, *args):
+        """Return the result of calling method of model with args,
+        calling it only the first time.
+        """
+        key = (model, method) + args
+        if key in self._cache:
+            self.saved_calls += 1
+            return self._cache[key]
+        self.orm_calls += 1
+        res = getattr(self.pool.get(model), method)(
+            self.cr, self.uid, *args, context=self.context)
+        self._cache[key] = res
+        return res
+
+    def get_rest_days(self, employee_id, dt):
+        """Same as hr.schedule.get_rest_days(), but the schedules of the
+        employee in the period are searched only once and the rest days
+        are computed only once per schedule week.
+        """
+        key = ('schedules', employee_id)
+        if key in self._cache:
+            self.saved_calls += 1
+        else:
+            self.orm_calls += 1
+            sched_obj = self.pool.get('hr.schedule')
+            sched_ids = sched_obj.search(
+                self.cr, self.uid, [
+                    ('employee_id', '=', employee_id),
+                    ('date_start', '<=', self.day_to),
+                    ('date_end', '>=', self.day_from),
+                ], context=self.context)
+            self._cache[key] = [
+                (s['id'], s['date_start'], s['date_end'])
+                for s in sched_obj.read(
+                    self.cr, self.uid, sched_ids, ['date_start', 'date_end'],
+                    context=self.context)
+            ]
+
+        day = dt.strftime(OE_DATEFORMAT)
+        sched_ids = [
+            sched_id for sched_id, date_start, date_end in self._cache[key]
+            if date_start <= day <= date_end
+        ]
+        if len(sched_ids) == 0:
+            return None
+        elif len(sched_ids) > 1:
+            raise orm.except_orm(_('Programming Error'), _(
+                'Employee has a scheduled date in more than one schedule.'))
+
+        week_start = (dt - timedelta(days=dt.weekday())).strftime(
+            OE_DATEFORMAT)
+        return self.call(
+            'hr.schedule', 'get_rest_days_by_id', sched_ids[0], week_start)
+
+
 class hr_payslip(orm.Model):
 
     _name = 'hr.payslip'
@@ -232,14 +331,13 @@ class hr_payslip(orm.Model):
             hours = 0
         return hours, push_lsd
 
-    def holidays_list_init(self, cr, uid, dFrom, dTo, context=None):
-        holiday_obj = self.pool.get('hr.holidays.public')
-        res = holiday_obj.get_holidays_list(
-            cr, uid, dFrom.year, context=context)
-        if dTo.year != dFrom.year:
-            res += holiday_obj.get_holidays_list(
-                cr, uid, dTo.year, context=context)
-        return res
+    def holidays_list_init(
+            self, cr, uid, dFrom, dTo, employee_id=None, context=None):
+        """Return the set of public holidays of the employee's location
+        between dFrom and dTo.
+        """
+        return self.pool['hr.holidays.public'].get_holidays_in_range(
+            cr, uid, dFrom, dTo, employee_id=employee_id, context=context)
 
     def holidays_list_contains(self, d, holidays_list):
         if d.strftime(OE_DATEFORMAT) in holidays_list:
@@ -383,28 +481,18 @@ class hr_payslip(orm.Model):
                  applied for the given contract between date_from and date_to
         """
 
-        sched_tpl_obj = self.pool.get('hr.schedule.template')
-        sched_obj = self.pool.get('hr.schedule')
         detail_obj = self.pool.get('hr.schedule.detail')
-        ot_obj = self.pool.get('hr.policy.ot')
-        presence_obj = self.pool.get('hr.policy.presence')
-        absence_obj = self.pool.get('hr.policy.absence')
         holiday_obj = self.pool.get('hr.holidays.public')
 
         day_from = datetime.strptime(date_from, "%Y-%m-%d").date()
         day_to = datetime.strptime(date_to, "%Y-%m-%d").date()
         nb_of_days = (day_to - day_from).days + 1
 
-        # Initialize list of public holidays. We only need to calculate it once
-        # during the lifetime of this object so attach it directly to it.
+        # Policy codes, template data and schedule rest days are resolved
+        # once and then reused for every day of the payslip.
         #
-        try:
-            public_holidays_list = self._mtm_public_holidays_list
-        except AttributeError:
-            self._mtm_public_holidays_list = self.holidays_list_init(
-                cr, uid, day_from, day_to,
-                context=context)
-            public_holidays_list = self._mtm_public_holidays_list
+        wd_ctx = worked_days_context(
+            cr, uid, self.pool, day_from, day_to, context=context)
 
         def get_ot_policies(policy_group_id, day, data):
 
@@ -423,17 +511,20 @@ class hr_payslip(orm.Model):
 
             ot_policy = self._get_ot_policy(policy_group_id, day)
             daily_ot = ot_policy and len(
-                ot_obj.daily_codes(cr, uid, ot_policy.id, context=context)
+                wd_ctx.call('hr.policy.ot', 'daily_codes', ot_policy.id)
+            ) > 0 or None
+            restday2_ot = ot_policy and len(
+                wd_ctx.call('hr.policy.ot', 'restday2_codes', ot_policy.id)
+            ) > 0 or None
+            restday_ot = ot_policy and len(
+                wd_ctx.call('hr.policy.ot', 'restday_codes', ot_policy.id)
             ) > 0 or None
-            restday2_ot = ot_policy and len(ot_obj.restday2_codes(
-                cr, uid, ot_policy.id, context=context)) > 0 or None
-            restday_ot = ot_policy and len(ot_obj.restday_codes(
-                cr, uid, ot_policy.id, context=context)) > 0 or None
             weekly_ot = ot_policy and len(
-                ot_obj.weekly_codes(cr, uid, ot_policy.id, context=context)
+                wd_ctx.call('hr.policy.ot', 'weekly_codes', ot_policy.id)
+            ) > 0 or None
+            holiday_ot = ot_policy and len(
+                wd_ctx.call('hr.policy.ot', 'holiday_codes', ot_policy.id)
             ) > 0 or None
-            holiday_ot = ot_policy and len(ot_obj.holiday_codes(
-                cr, uid, ot_policy.id, context=context)) > 0 or None
 
             data['policy'] = ot_policy
             data['daily'] = daily_ot
@@ -474,20 +565,30 @@ class hr_payslip(orm.Model):
             return data
 
         res = []
-        for contract in self.pool.get('hr.contract').browse(
-                cr, uid, contract_ids, context=context):
+        contracts = self.pool.get('hr.contract').browse(
+            cr, uid, contract_ids, context=context)
+
+        # Public holidays of the location of every employee, in one query.
+        holidays_by_employee = holiday_obj.get_employees_holidays_in_range(
+            cr, uid, list(set(c.employee_id.id for c in contracts)),
+            day_from, day_to, context=context)
+
+        for contract in contracts:
 
             wh_in_week = 0
 
+            public_holidays_list = holidays_by_employee[
+                contract.employee_id.id]
+
             # Initialize list of leaves taken by the employee during the month
             leaves_list = self.leaves_list_init(
                 cr, uid, contract.employee_id.id,
                 day_from, day_to, contract.pps_id.tz, context=context)
 
             # Get default set of rest days for this employee/contract
-            contract_rest_days = sched_tpl_obj.get_rest_days(
-                cr, uid, contract.schedule_template_id.id, context=context
-            )
+            contract_rest_days = wd_ctx.call(
+                'hr.schedule.template', 'get_rest_days',
+                contract.schedule_template_id.id)
 
             # Initialize dictionary of dates in this payslip and the hours the
             # employee was scheduled to work on each
@@ -575,8 +676,6 @@ class hr_payslip(orm.Model):
             leaves = {}
             att_obj = self.pool.get('hr.attendance')
             awol_code = False
-            import logging
-            _l = logging.getLogger(__name__)
             for day in range(0, nb_of_days):
                 dtDateTime = datetime.strptime(
                     (day_from + timedelta(days=day)).strftime('%Y-%m-%d'),
@@ -590,8 +689,9 @@ class hr_payslip(orm.Model):
                 presence_data = get_presence_policies(
                     contract.policy_group_id, dtDateTime.date(), presence_data)
                 presence_policy = presence_data['policy']
-                presence_codes = presence_policy and presence_obj.get_codes(
-                    cr, uid, presence_policy.id, context=context) or []
+                presence_codes = presence_policy and wd_ctx.call(
+                    'hr.policy.presence', 'get_codes',
+                    presence_policy.id) or []
                 presence_sequence = 2
 
                 for pcode, pname, ptype, prate, pduration in presence_codes:
@@ -619,8 +719,8 @@ class hr_payslip(orm.Model):
                 restday2_ot = ot_data['restday2']
                 restday_ot = ot_data['restday']
                 weekly_ot = ot_data['weekly']
-                ot_codes = ot_policy and ot_obj.get_codes(
-                    cr, uid, ot_policy.id, context=context) or []
+                ot_codes = ot_policy and wd_ctx.call(
+                    'hr.policy.ot', 'get_codes', ot_policy.id) or []
                 ot_sequence = 3
 
                 for otcode, otname, ottype, otrate in ot_codes:
@@ -642,8 +742,9 @@ class hr_payslip(orm.Model):
                 absence_data = get_absence_policies(
                     contract.policy_group_id, dtDateTime.date(), absence_data)
                 absence_policy = absence_data['policy']
-                absence_codes = absence_policy and absence_obj.get_codes(
-                    cr, uid, absence_policy.id, context=context) or []
+                absence_codes = absence_policy and wd_ctx.call(
+                    'hr.policy.absence', 'get_codes',
+                    absence_policy.id) or []
                 absence_sequence = 50
 
                 for abcode, abname, abtype, abrate, use_awol in absence_codes:
@@ -676,9 +777,8 @@ class hr_payslip(orm.Model):
                 #                     would have worked based on the schedule
                 #                     template attached to the contract.
                 #
-                actual_rest_days = sched_obj.get_rest_days(
-                    cr, uid, contract.employee_id.id,
-                    dtDateTime, context=context)
+                actual_rest_days = wd_ctx.get_rest_days(
+                    contract.employee_id.id, dtDateTime)
                 scheduled_hours = detail_obj.scheduled_hours_on_day_from_range(
                     dtDateTime.date(),
                     sched_hours_dict)
@@ -697,11 +797,10 @@ class hr_payslip(orm.Model):
 
                 if (scheduled_hours == 0
                         and dtDateTime.weekday() not in rest_days):
-                    scheduled_hours = sched_tpl_obj.get_hours_by_weekday(
-                        cr, uid, contract.schedule_template_id.id,
-                        dtDateTime.weekday(
-                        ),
-                        context=context)
+                    scheduled_hours = wd_ctx.call(
+                        'hr.schedule.template', 'get_hours_by_weekday',
+                        contract.schedule_template_id.id,
+                        dtDateTime.weekday())
 
                 # Actual number of hours worked on the day. Based on attendance
                 # records.
@@ -824,8 +923,9 @@ class hr_payslip(orm.Model):
                                     'number_of_hours'] += normal_hours
                                 attendances[line.code]['number_of_days'] += 1.0
                                 done = True
-                                _l.warning('nh: %s', normal_hours)
-                                _l.warning('att: %s', attendances[line.code])
+                                _logger.debug('nh: %s', normal_hours)
+                                _logger.debug(
+                                    'att: %s', attendances[line.code])
 
                     if push_lsd:
                         lsd.push(True)
@@ -875,6 +975,12 @@ class hr_payslip(orm.Model):
             leaves = [value for key, value in leaves.items()]
             attendances = [value for key, value in attendances.items()]
             res += attendances + leaves
+
+        _logger.debug(
+            'Worked days of contracts %s from %s to %s: %d policy/schedule '
+            'ORM calls made, %d saved by the computation context',
+            contract_ids, date_from, date_to, wd_ctx.orm_calls,
+            wd_ctx.saved_calls)
         return res
 
     def _partial_period_factor(self, payslip, contract):
@@ -966,6 +1072,11 @@ class hr_payslip(orm.Model):
             def __getattr__(self, attr):
                 return attr in self.dict and self.dict.__getitem__(attr) or 0.0
 
+        # Shared by the pay slips computed together, and loaded for all of
+        # them by the first sum() of a rule
+        history = self.get_payslip_history(
+            cr, uid, [payslip_id], context=context)
+
         class InputLine(BrowsableObject):
 
             """a class that will be used into the python code, mainly
@@ -975,16 +1086,8 @@ class hr_payslip(orm.Model):
             def sum(self, code, from_date, to_date=None):
                 if to_date is None:
                     to_date = datetime.now().strftime('%Y-%m-%d')
-                self.cr.execute("""\
-SELECT sum(amount) as sum
-FROM hr_payslip as hp, hr_payslip_input as pi
-WHERE hp.employee_id = %s
-  AND hp.state = 'done'
-  AND hp.date_from >= %s
-  AND hp.date_to <= %s
-  AND hp.id = pi.payslip_id
-  AND pi.code = %s""", (self.employee_id, from_date, to_date, code))
-                res = self.cr.fetchone()[0]
+                res = history.get(
+                    'inputs', self.employee_id, code, from_date, to_date)[0]
                 return res or 0.0
 
         class WorkedDays(BrowsableObject):
@@ -996,17 +1099,8 @@ WHERE hp.employee_id = %s
             def _sum(self, code, from_date, to_date=None):
                 if to_date is None:
                     to_date = datetime.now().strftime('%Y-%m-%d')
-                self.cr.execute("""\
-SELECT sum(number_of_days) as number_of_days,
-       sum(number_of_hours) as number_of_hours
-FROM hr_payslip as hp, hr_payslip_worked_days as pi
-WHERE hp.employee_id = %s
-  AND hp.state = 'done'
-  AND hp.date_from >= %s
-  AND hp.date_to <= %s
-  AND hp.id = pi.payslip_id
-  AND pi.code = %s""", (self.employee_id, from_date, to_date, code))
-                return self.cr.fetchone()
+                return history.get(
+                    'worked_days', self.employee_id, code, from_date, to_date)
 
             def sum(self, code, from_date, to_date=None):
                 res = self._sum(code, from_date, to_date)
@@ -1025,18 +1119,8 @@ WHERE hp.employee_id = %s
             def sum(self, code, from_date, to_date=None):
                 if to_date is None:
                     to_date = datetime.now().strftime('%Y-%m-%d')
-                self.cr.execute("""\
-SELECT sum(
-    case when hp.credit_note = False then (pl.total) else (-pl.total) end
-)
-FROM hr_payslip as hp, hr_payslip_line as pl
-WHERE hp.employee_id = %s
-  AND hp.state = 'done'
-  AND hp.date_from >= %s
-  AND hp.date_to <= %s
-  AND hp.id = pl.slip_id
-  AND pl.code = %s""", (self.employee_id, from_date, to_date, code))
-                res = self.cr.fetchone()
+                res = history.get(
+                    'lines', self.employee_id, code, from_date, to_date)
                 return res and res[0] or 0.0
 
         # we keep a dict with the result because a value can be overwritten by
@@ -1044,7 +1128,6 @@ WHERE hp.employee_id = %s
         result_dict = {}
         rules = {}
         categories_dict = {}
-        blacklist = []
         payslip_obj = self.pool.get('hr.payslip')
         obj_rule = self.pool.get('hr.salary.rule')
         payslip = payslip_obj.browse(cr, uid, payslip_id, context=context)
@@ -1077,14 +1160,14 @@ WHERE hp.employee_id = %s
         # well
         structure_ids = self.pool.get('hr.contract').get_all_structures(
             cr, uid, contract_ids, context=context)
-        # get the rules of the structure and their children
-        rule_ids = self.pool.get('hr.payroll.structure').get_all_rules(
-            cr, uid, structure_ids, context=context)
-        # run the rules by sequence
-        sorted_rule_ids = [
-            id for id, sequence in sorted(rule_ids, key=lambda x:x[1])]
-
-        rule_pool = self.pool['hr.salary.rule']
+        # get the rules of the structures and their children by sequence,
+        # along with the rules each one blacklists when it does not apply
+        rule_plan = obj_rule.get_rule_plan(cr, uid, tuple(structure_ids))
+        sorted_rule_ids = [rule_id for rule_id, descendants in rule_plan]
+        rule_descendants = dict(rule_plan)
+        sorted_rules = obj_rule.browse(
+            cr, uid, sorted_rule_ids, context=context)
+        blacklist = set()
 
         for contract in self.pool.get('hr.contract').browse(
                 cr, uid, contract_ids, context=context):
@@ -1105,8 +1188,7 @@ WHERE hp.employee_id = %s
                     'utils': utils_obj,
                 }
             )
-            for rule in obj_rule.browse(
-                    cr, uid, sorted_rule_ids, context=context):
+            for rule in sorted_rules:
                 key = rule.code + '-' + str(contract.id)
                 localdict['result'] = None
                 localdict['result_qty'] = 1.0
@@ -1158,11 +1240,7 @@ WHERE hp.employee_id = %s
                     }
                 else:
                     # blacklist this rule and its children
-                    blacklist += [
-                        id for id, seq in rule_pool._recursive_search_of_rules(
-                            cr, uid, [rule], context=context
-                        )
-                    ]
+                    blacklist.update(rule_descendants[rule.id])
 
         result = [value for code, value in result_dict.items()]
         return result
@@ -1233,11 +1311,14 @@ class hr_attendance(orm.Model):
         for a in self.browse(cr, uid, ids, context=context):
             res.append((a.action, a.name))
 
-        return res
+        return sorted_punches(res)
 
     def punches_list_search(
             self, cr, uid, ndtFrom, ndtTo, punches_list, context=None):
 
+        if isinstance(punches_list, sorted_punches):
+            return punches_list.search(ndtFrom, ndtTo)
+
         res = []
         for action, name in punches_list:
             ndtName = datetime.strptime(name, OE_DATETIMEFORMAT)
@@ -1346,9 +1427,9 @@ class hr_attendance(orm.Model):
                     context=context
                 )
                 if len(my_list4) > 0:
-                    if my_list4[-1].action == 'sign_out':
+                    if my_list4[-1][0] == 'sign_out':
                         ndtSout = datetime.strptime(
-                            my_list4[-1].name, OE_DATETIMEFORMAT)
+                            my_list4[-1][1], OE_DATETIMEFORMAT)
                         if ndtSin <= ndtSout + timedelta(
                                 minutes=pps_template.ot_max_rollover_gap):
                             sin = sin[1:]
@@ -1656,6 +1737,72 @@ class hr_salary_rule(orm.Model):
         ),
     }
 
+    @tools.ormcache(skiparg=3)
+    def get_rule_plan(self, cr, uid, structure_ids):
+        """Return the rules of the structures in structure_ids (a tuple, in
+        the order given by hr.contract.get_all_structures()) and their
+        children, sorted by sequence, as a tuple of (rule id, ids of the
+        rule and its children) pairs. The second item is what gets
+        blacklisted when the rule does not apply.
+
+        Only the plan is cached: the code of the rules is left to
+        safe_eval(), which checks and compiles its source at each call and
+        refuses precompiled code objects.
+        """
+
+        rule_ids = self.pool['hr.payroll.structure'].get_all_rules(
+            cr, uid, list(structure_ids))
+        res = []
+        for rule_id, sequence in sorted(rule_ids, key=lambda x: x[1]):
+            rule = self.browse(cr, uid, rule_id)
+            res.append((rule_id, frozenset(
+                id for id, seq in self._recursive_search_of_rules(
+                    cr, uid, [rule])
+            )))
+        return tuple(res)
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(hr_salary_rule, self).create(
+            cr, uid, vals, context=context)
+        self.clear_caches()
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(hr_salary_rule, self).write(
+            cr, uid, ids, vals, context=context)
+        self.clear_caches()
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(hr_salary_rule, self).unlink(
+            cr, uid, ids, context=context)
+        self.clear_caches()
+        return res
+
+
+class hr_payroll_structure(orm.Model):
+
+    _name = 'hr.payroll.structure'
+    _inherit = 'hr.payroll.structure'
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(hr_payroll_structure, self).create(
+            cr, uid, vals, context=context)
+        self.pool['hr.salary.rule'].clear_caches()
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(hr_payroll_structure, self).write(
+            cr, uid, ids, vals, context=context)
+        self.pool['hr.salary.rule'].clear_caches()
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(hr_payroll_structure, self).unlink(
+            cr, uid, ids, context=context)
+        self.pool['hr.salary.rule'].clear_caches()
+        return res
+
 
 class hr_payslip_worked_days(orm.Model):
 
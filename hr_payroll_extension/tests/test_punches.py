@@ -0,0 +1,124 @@
+# -*- coding:utf-8 -*-
+#
+#
+#    Copyright (C) 2013 Michael Telahun Makonnen <mmakonnen@gmail.com>.
+#    All Rights Reserved.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from datetime import date, timedelta
+
+from openerp.osv import orm
+from openerp.tests import common
+
+from openerp.addons.hr_payroll_extension.hr_payroll import sorted_punches
+
+
+class pps_template(object):
+
+    """The rollover rules of a pay period schedule"""
+
+    tz = 'UTC'
+    ot_max_rollover_hours = 5
+    ot_max_rollover_gap = 60
+
+
+class test_punches(common.TransactionCase):
+
+    def setUp(self):
+        super(test_punches, self).setUp()
+        self.attendance_model = self.registry('hr.attendance')
+        self.context = self.registry('res.users').context_get(
+            self.cr, self.uid)
+        self.employee_id = self.registry('hr.employee').create(
+            self.cr, self.uid, {'name': 'Employee 1'}, context=self.context)
+
+    def get_normalized_punches(self, dDay, punches_list):
+        try:
+            return self.attendance_model._get_normalized_punches(
+                self.cr, self.uid, self.employee_id, pps_template, dDay,
+                punches_list, context=self.context)
+        except orm.except_orm as e:
+            return e.value
+
+    def get_days(self, punches, dFrom, dTo):
+        """Return the normalized punches of each day from dFrom to dTo,
+        after checking that the bisection of sorted_punches gives the same
+        result as the linear scan of a plain list of punches.
+        """
+        res = []
+        dDay = dFrom
+        while dDay <= dTo:
+            expected = self.get_normalized_punches(dDay, list(punches))
+            self.assertEqual(
+                self.get_normalized_punches(dDay, sorted_punches(punches)),
+                expected, dDay)
+            res.append(expected)
+            dDay += timedelta(days=1)
+        return res
+
+    def test_chained_sessions(self):
+        # Double shifts on three days, each within the rollover gap of the
+        # previous one
+        res = self.get_days([
+            ('sign_in', '2015-01-05 20:00:00'),
+            ('sign_out', '2015-01-06 04:00:00'),
+            ('sign_in', '2015-01-06 04:30:00'),
+            ('sign_out', '2015-01-06 20:00:00'),
+            ('sign_in', '2015-01-06 20:30:00'),
+            ('sign_out', '2015-01-07 04:00:00'),
+            ('sign_in', '2015-01-07 04:30:00'),
+            ('sign_out', '2015-01-07 12:00:00'),
+        ], date(2015, 1, 4), date(2015, 1, 8))
+        self.assertEqual(res[0], ([], []))
+        self.assertEqual(res[3], (['2015-01-07 04:30:00'],
+                                  ['2015-01-07 12:00:00']))
+        self.assertEqual(res[4], ([], []))
+
+    def test_rollover(self):
+        # The hours worked past 05:00 are counted on the next day
+        self.assertEqual(self.get_days([
+            ('sign_in', '2015-01-05 18:00:00'),
+            ('sign_out', '2015-01-06 07:00:00'),
+            ('sign_in', '2015-01-06 08:00:00'),
+            ('sign_out', '2015-01-06 16:00:00'),
+        ], date(2015, 1, 5), date(2015, 1, 7)), [
+            (['2015-01-05 18:00:00'], ['2015-01-06 05:00:00']),
+            (['2015-01-06 05:00:00', '2015-01-06 08:00:00'],
+             ['2015-01-06 07:00:00', '2015-01-06 16:00:00']),
+            ([], []),
+        ])
+
+    def test_next_day_session(self):
+        # A session starting after midnight within the rollover gap is
+        # counted whole on the previous day
+        self.assertEqual(self.get_days([
+            ('sign_in', '2015-01-05 15:00:00'),
+            ('sign_out', '2015-01-05 23:40:00'),
+            ('sign_in', '2015-01-06 00:10:00'),
+            ('sign_out', '2015-01-06 06:00:00'),
+        ], date(2015, 1, 5), date(2015, 1, 6)), [
+            (['2015-01-05 15:00:00', '2015-01-06 00:10:00'],
+             ['2015-01-05 23:40:00', '2015-01-06 06:00:00']),
+            ([], []),
+        ])
+
+    def test_missing_sign_out(self):
+        self.get_days([
+            ('sign_in', '2015-01-05 08:00:00'),
+            ('sign_out', '2015-01-05 12:00:00'),
+            ('sign_in', '2015-01-05 13:00:00'),
+        ], date(2015, 1, 4), date(2015, 1, 6))
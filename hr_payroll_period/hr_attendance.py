@@ -21,6 +21,7 @@
 
 from openerp.osv import fields, orm
 from openerp.tools.translate import _
+from openerp.addons.hr_schedule.bulk import execute_values
 
 
 class hr_attendance(orm.Model):
@@ -41,27 +42,17 @@ class hr_attendance(orm.Model):
 
     def is_locked(self, cr, uid, employee_id, utcdt_str, context=None):
 
-        res = False
-        pp_obj = self.pool.get('hr.payroll.period')
-        ee_data = self.pool.get('hr.employee').read(
-            cr, uid, employee_id,
-            ['contract_ids'], context=context)
-        pp_ids = pp_obj.search(cr, uid, [
-            ('state', 'in', [
-                'locked', 'generate', 'payment', 'closed']),
-            '&', ('date_start', '<=', utcdt_str),
-            ('date_end', '>=', utcdt_str),
-        ], context=context)
-        for pp in pp_obj.browse(cr, uid, pp_ids, context=context):
-            pp_contract_ids = [c.id for c in pp.schedule_id.contract_ids]
-            for c_id in ee_data['contract_ids']:
-                if c_id in pp_contract_ids:
-                    res = True
-                    break
-            if res is True:
-                break
-
-        return res
+        cr.execute("""\
+SELECT EXISTS (SELECT 1
+               FROM hr_contract c
+                 JOIN hr_payroll_period p ON p.schedule_id = c.pps_id
+               WHERE c.employee_id = %s
+                 AND c.active
+                 AND p.state IN ('locked', 'generate', 'payment', 'closed')
+                 AND p.date_start <= %s::timestamp
+                 AND p.date_end >= %s::timestamp)""",
+                   (employee_id, utcdt_str, utcdt_str))
+        return cr.fetchone()[0]
 
     def create(self, cr, uid, vals, context=None):
 
@@ -77,8 +68,58 @@ class hr_attendance(orm.Model):
                   "Employee: %s\n"
                   "Time: %s") % (ee_data['name'], vals['name']))
 
-        return super(hr_attendance, self).create(
+        res = super(hr_attendance, self).create(
             cr, uid, vals, context=context)
+        self.pool.get('hr.payroll.period').invalidate_missing_punches(
+            cr, uid, [vals['name']], context=context)
+        return res
+
+    def _check_create_bulk(self, cr, uid, vals_list, context=None):
+
+        # Same check as is_locked() in create(), for all the punches at once
+        punches = [(vals['employee_id'], vals['name']) for vals in vals_list]
+        rows = execute_values(cr, """\
+SELECT v.employee_id, v.name
+FROM (VALUES %s)
+  AS v(employee_id, name)
+WHERE EXISTS (SELECT 1
+              FROM hr_contract c
+                JOIN hr_payroll_period p ON p.schedule_id = c.pps_id
+              WHERE c.employee_id = v.employee_id
+                AND c.active
+                AND p.state IN ('locked', 'generate', 'payment', 'closed')
+                AND p.date_start <= v.name::timestamp
+                AND p.date_end >= v.name::timestamp)
+ORDER BY v.name
+LIMIT 1""", punches, fetch=True)
+        if rows:
+            row = rows[0]
+            ee_data = self.pool.get(
+                'hr.employee').read(cr, uid, row[0], ['name'],
+                                    context=context)
+            raise orm.except_orm(
+                _('The period is Locked!'),
+                _("You may not add an attendance record to a locked "
+                  "period.\n"
+                  "Employee: %s\n"
+                  "Time: %s") % (ee_data['name'], row[1]))
+
+        return super(hr_attendance, self)._check_create_bulk(
+            cr, uid, vals_list, context=context)
+
+    def create_bulk(self, cr, uid, vals_list, context=None):
+
+        res = super(hr_attendance, self).create_bulk(
+            cr, uid, vals_list, context=context)
+        self.pool.get('hr.payroll.period').invalidate_missing_punches(
+            cr, uid, [vals.get('name') for vals in vals_list],
+            context=context)
+        return res
+
+    def _get_punch_names(self, cr, ids):
+        cr.execute('SELECT name FROM hr_attendance WHERE id IN %s',
+                   (tuple(ids),))
+        return [r[0] for r in cr.fetchall()]
 
     def unlink(self, cr, uid, ids, context=None):
         if isinstance(ids, (int, long)):
@@ -94,7 +135,12 @@ class hr_attendance(orm.Model):
                         punch.state, punch.employee_id.name, punch.name,
                         punch.action))
 
-        return super(hr_attendance, self).unlink(cr, uid, ids, context=context)
+        names = ids and self._get_punch_names(cr, ids) or []
+        res = super(hr_attendance, self).unlink(
+            cr, uid, ids, context=context)
+        self.pool.get('hr.payroll.period').invalidate_missing_punches(
+            cr, uid, names, context=context)
+        return res
 
     def write(self, cr, uid, ids, vals, context=None):
 
@@ -116,5 +162,15 @@ class hr_attendance(orm.Model):
                         punch.state, punch.employee_id.name, punch.name,
                         punch.action))
 
-        return super(hr_attendance, self).write(
+        # Only the time, action or employee of a punch matter to the
+        # missing punches of the periods
+        names = []
+        if ids and ('name' in vals or 'action' in vals
+                    or 'employee_id' in vals):
+            names = self._get_punch_names(cr, ids) + [vals.get('name')]
+
+        res = super(hr_attendance, self).write(
             cr, uid, ids, vals, context=context)
+        self.pool.get('hr.payroll.period').invalidate_missing_punches(
+            cr, uid, names, context=context)
+        return res
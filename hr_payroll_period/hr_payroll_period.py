@@ -20,6 +20,9 @@
 #
 
 import calendar
+import json
+import math
+import time
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from pytz import common_timezones, timezone, utc
@@ -28,10 +31,27 @@ from openerp import netsvc
 from openerp.tools.safe_eval import safe_eval as eval
 from openerp.tools.translate import _
 from openerp.osv import fields, orm
+from openerp.addons.hr_schedule.bulk import (
+    execute_values, insert_rows, signal_workflow_bulk)
 
 import logging
 _logger = logging.getLogger(__name__)
 
+# Sections of the period-end dashboard snapshot of a payroll period, see
+# hr.payroll.period.get_dashboard()
+DASHBOARD_SECTIONS = ('alerts', 'exceptions', 'change', 'amendments',
+                      'holidays')
+
+# Bank notes (in birr) and coins (in cents) of the cash breakdown of the
+# net pay
+BIRR_DENOMINATIONS = (
+    ('br100', 100), ('br50', 50), ('br10', 10), ('br5', 5), ('br1', 1),
+)
+CENT_DENOMINATIONS = (
+    ('cent50', 50), ('cent25', 25), ('cent10', 10), ('cent05', 5),
+    ('cent01', 1),
+)
+
 # Obtained from: http://goo.gl/klh8p
 #
 
@@ -44,6 +64,131 @@ def add_months(sourcedate, months):
     return datetime(year, month, day)
 
 
+class payslip_history(object):
+
+    """Totals of the done pay slips of employees, as summed by the
+    inputs.sum(), worked_days.sum() and payslip.sum() helpers available to
+    salary rules. Totals over the ranges rules usually ask for (year to
+    date, quarter to date and previous month of each pay slip) are loaded
+    with one grouped query per kind of line, for all the pay slips given,
+    the first time a total is asked for; other ranges are queried when
+    first asked for.
+    """
+
+    # kind -> (totals selected, join, code column, number of totals)
+    _queries = {
+        'inputs': (
+            "SUM(pi.amount)",
+            "hr_payslip_input pi ON pi.payslip_id = hp.id",
+            "pi.code",
+            1,
+        ),
+        'worked_days': (
+            "SUM(pi.number_of_days), SUM(pi.number_of_hours)",
+            "hr_payslip_worked_days pi ON pi.payslip_id = hp.id",
+            "pi.code",
+            2,
+        ),
+        'lines': (
+            "SUM(CASE WHEN hp.credit_note THEN -pl.total ELSE pl.total END)",
+            "hr_payslip_line pl ON pl.slip_id = hp.id",
+            "pl.code",
+            1,
+        ),
+    }
+
+    def __init__(self, cr, slip_ids=()):
+        self.cr = cr
+        self.slip_ids = frozenset(slip_ids)
+        # Pay slips whose usual ranges are still to be loaded
+        self._pending = list(self.slip_ids)
+        # kind -> (employee_id, date_from, date_to) -> code -> totals
+        self._totals = dict((kind, {}) for kind in self._queries)
+        # (employee_id, date_from, date_to) for which all codes are loaded
+        self._loaded = set()
+
+    @staticmethod
+    def _usual_ranges(date_from, date_to):
+        d = datetime.strptime(date_from[:10], '%Y-%m-%d').date()
+        quarter_start = d.replace(month=(d.month - 1) // 3 * 3 + 1, day=1)
+        prev_month_end = d.replace(day=1) - timedelta(days=1)
+        return [
+            (d.strftime('%Y-01-01'), date_to[:10]),
+            (quarter_start.strftime('%Y-%m-%d'), date_to[:10]),
+            (prev_month_end.strftime('%Y-%m-01'),
+             prev_month_end.strftime('%Y-%m-%d')),
+        ]
+
+    def preload(self, slips):
+        """Load the usual ranges of slips, a list of (employee id,
+        date_from, date_to) tuples."""
+
+        rows = set()
+        for employee_id, date_from, date_to in slips:
+            for date_range in self._usual_ranges(date_from, date_to):
+                key = (employee_id,) + date_range
+                if key not in self._loaded:
+                    rows.add(key)
+        if not rows:
+            return
+        rows = list(rows)
+        for kind, (select, join, code, arity) in self._queries.iteritems():
+            totals = self._totals[kind]
+            for key in rows:
+                totals[key] = {}
+            for row in execute_values(self.cr, """\
+SELECT r.employee_id, r.date_from, r.date_to,
+       """ + code + """, """ + select + """
+FROM (VALUES %s)
+    AS r (employee_id, date_from, date_to)
+  JOIN hr_payslip hp ON hp.employee_id = r.employee_id
+    AND hp.state = 'done'
+    AND hp.date_from >= r.date_from::date
+    AND hp.date_to <= r.date_to::date
+  JOIN """ + join + """
+GROUP BY r.employee_id, r.date_from, r.date_to, """ + code, rows,
+                                      fetch=True):
+                totals[row[:3]][row[3]] = row[4:]
+        self._loaded.update(rows)
+
+    def _load_pending(self):
+        slip_ids, self._pending = self._pending, []
+        self.cr.execute("""\
+SELECT employee_id, date_from, date_to
+FROM hr_payslip
+WHERE id IN %s""", (tuple(slip_ids),))
+        self.preload([
+            (employee_id, str(date_from), str(date_to))
+            for employee_id, date_from, date_to in self.cr.fetchall()
+        ])
+
+    def get(self, kind, employee_id, code, from_date, to_date):
+        """Return the totals (a tuple, of None when there is nothing to sum)
+        of the lines of a kind with a code on the done pay slips of an
+        employee between two dates."""
+
+        if self._pending:
+            self._load_pending()
+        key = (employee_id, str(from_date)[:10], str(to_date)[:10])
+        totals = self._totals[kind].setdefault(key, {})
+        if code not in totals:
+            select, join, code_column, arity = self._queries[kind]
+            if key in self._loaded:
+                return (None,) * arity
+            self.cr.execute("""\
+SELECT """ + select + """
+FROM hr_payslip hp
+  JOIN """ + join + """
+WHERE hp.employee_id = %s
+  AND hp.state = 'done'
+  AND hp.date_from >= %s
+  AND hp.date_to <= %s
+  AND """ + code_column + """ = %s""",
+                            (employee_id, from_date, to_date, code))
+            totals[code] = self.cr.fetchone()
+        return totals[code]
+
+
 class hr_payroll_period(orm.Model):
 
     _name = 'hr.payroll.period'
@@ -54,12 +199,26 @@ class hr_payroll_period(orm.Model):
         'name': fields.char('Description', size=256, required=True),
         'schedule_id': fields.many2one(
             'hr.payroll.period.schedule', 'Payroll Period Schedule',
-            required=True),
+            required=True, select=True),
         'date_start': fields.datetime('Start Date', required=True),
         'date_end': fields.datetime('End Date', required=True),
         'register_id': fields.many2one(
             'hr.payroll.register', 'Payroll Register', readonly=True,
             states={'generate': [('readonly', False)]}),
+        'lock_duration': fields.float(
+            'Lock/Unlock Time (seconds)', readonly=True,
+            help="Time taken by the last locking or unlocking of the "
+                 "attendance records, schedules and leaves of the period."),
+        'missing_punches_cache': fields.text(
+            'Missing Punches', readonly=True,
+            help="Ids of the attendance records of the period with a "
+                 "missing sign-in or sign-out, kept until attendance "
+                 "records of the period change."),
+        'dashboard_cache': fields.text(
+            'Dashboard Snapshot', readonly=True,
+            help="Statistics shown by the end of period wizard, kept by "
+                 "section until the records they are computed from "
+                 "change."),
         'state': fields.selection([('open', 'Open'),
                                    ('ended', 'End of Period Processing'),
                                    ('locked', 'Locked'),
@@ -105,6 +264,276 @@ class hr_payroll_period(orm.Model):
 
         return False
 
+    def get_missing_punch_ids(self, cr, uid, period_id, context=None):
+        """Return the ids of the attendance records of the employees of a
+        period that lack the sign-in before or the sign-out after them. The
+        result is kept on the period until its attendance records change.
+        """
+
+        cr.execute("""\
+SELECT missing_punches_cache
+FROM hr_payroll_period
+WHERE id = %s""", (period_id,))
+        row = cr.fetchone()
+        if row and row[0] is not None:
+            return [int(i) for i in row[0].split(',') if i]
+
+        period = self.browse(cr, uid, period_id, context=context)
+        employee_ids = list(set(
+            c.employee_id.id for c in period.schedule_id.contract_ids))
+        res = []
+        if employee_ids:
+            # Each employee's punches must alternate sign-in, sign-out,
+            # starting with a sign-in and ending with a sign-out
+            cr.execute("""\
+SELECT id
+FROM (SELECT a.id, a.action,
+             lag(a.action) OVER w AS prev_action,
+             lead(a.action) OVER w AS next_action
+      FROM hr_attendance a
+      WHERE a.employee_id IN %s
+        AND a.name >= %s
+        AND a.name <= %s
+      WINDOW w AS (PARTITION BY a.employee_id ORDER BY a.name, a.id)) p
+WHERE (prev_action IS NULL AND action != 'sign_in')
+   OR (prev_action IS NOT NULL AND action = 'sign_out'
+       AND prev_action != 'sign_in')
+   OR (next_action = 'sign_in' AND action != 'sign_out')
+   OR (next_action IS NULL AND action != 'sign_out')
+ORDER BY id""", (tuple(employee_ids), period.date_start, period.date_end))
+            res = [r[0] for r in cr.fetchall()]
+
+        cr.execute("""\
+UPDATE hr_payroll_period
+SET missing_punches_cache = %s
+WHERE id = %s""", (','.join(str(i) for i in res), period_id))
+        return res
+
+    def invalidate_missing_punches(self, cr, uid, names, context=None):
+        """Forget the missing punches of the periods containing any of the
+        attendance times in names."""
+
+        names = [n for n in names if n]
+        if not names:
+            return
+        cr.execute("""\
+UPDATE hr_payroll_period
+SET missing_punches_cache = NULL
+WHERE missing_punches_cache IS NOT NULL
+  AND date_start <= %s
+  AND date_end >= %s""", (max(names), min(names)))
+
+    def clear_missing_punches(self, cr, uid, ids, context=None):
+        """Forget the missing punches of the periods in ids."""
+
+        if not ids:
+            return
+        cr.execute("""\
+UPDATE hr_payroll_period
+SET missing_punches_cache = NULL
+WHERE missing_punches_cache IS NOT NULL
+  AND id IN %s""", (tuple(ids),))
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        res = super(hr_payroll_period, self).write(
+            cr, uid, ids, vals, context=context)
+        if 'date_start' in vals or 'date_end' in vals \
+                or 'schedule_id' in vals:
+            self.clear_missing_punches(cr, uid, ids, context=context)
+            self.invalidate_dashboard(
+                cr, uid, ids, DASHBOARD_SECTIONS, context=context)
+        elif 'register_id' in vals:
+            self.invalidate_dashboard(
+                cr, uid, ids, ['exceptions', 'change'], context=context)
+        return res
+
+    def get_dashboard(self, cr, uid, period_id, context=None):
+        """Return the statistics of a period shown by the end of period
+        wizard, as a dictionary with an entry for each of
+        DASHBOARD_SECTIONS:
+
+            alerts: number of attendance alerts by severity
+            exceptions: number of pay slip exceptions by severity
+            change: number of bank notes and coins needed to pay the
+                    net salaries in cash, by denomination
+            amendments: ids of the amendments of the period by state
+                        (draft and validate only)
+            holidays: ids of the public holidays within the period
+
+        The snapshot is kept on the period. Only the sections dropped by
+        invalidate_dashboard() since the last call are computed again.
+        """
+
+        cr.execute("""\
+SELECT dashboard_cache
+FROM hr_payroll_period
+WHERE id = %s""", (period_id,))
+        row = cr.fetchone()
+        res = row and row[0] and json.loads(row[0]) or {}
+
+        missing = [s for s in DASHBOARD_SECTIONS if s not in res]
+        if missing:
+            period = self.browse(cr, uid, period_id, context=context)
+            for section in missing:
+                res[section] = getattr(self, '_dashboard_' + section)(
+                    cr, uid, period, context=context)
+            cr.execute("""\
+UPDATE hr_payroll_period
+SET dashboard_cache = %s
+WHERE id = %s""", (json.dumps(res), period_id))
+
+        return res
+
+    def _dashboard_alerts(self, cr, uid, period, context=None):
+
+        cr.execute("""\
+SELECT a.severity, count(*)
+FROM hr_schedule_alert a
+WHERE a.name >= %s
+  AND a.name <= %s
+  AND a.employee_id IN (SELECT c.employee_id
+                        FROM hr_contract c
+                        WHERE c.pps_id = %s
+                          AND c.active)
+GROUP BY a.severity""", (period.date_start, period.date_end,
+                         period.schedule_id.id))
+        return dict(cr.fetchall())
+
+    def _dashboard_exceptions(self, cr, uid, period, context=None):
+
+        if not period.register_id:
+            return {}
+        cr.execute("""\
+SELECT e.severity, count(*)
+FROM hr_payslip_exception e
+JOIN hr_payslip s ON s.id = e.slip_id
+JOIN hr_payslip_run r ON r.id = s.payslip_run_id
+WHERE r.register_id = %s
+GROUP BY e.severity""", (period.register_id.id,))
+        return dict(cr.fetchall())
+
+    def _dashboard_change(self, cr, uid, period, context=None):
+
+        res = dict(
+            (name, 0)
+            for name, value in BIRR_DENOMINATIONS + CENT_DENOMINATIONS)
+        if not period.register_id:
+            return res
+        cr.execute("""\
+SELECT l.total
+FROM hr_payslip_line l
+JOIN hr_salary_rule sr ON sr.id = l.salary_rule_id
+JOIN hr_payslip s ON s.id = l.slip_id
+JOIN hr_payslip_run r ON r.id = s.payslip_run_id
+WHERE r.register_id = %s
+  AND l.active
+  AND sr.code = 'NET'""", (period.register_id.id,))
+        for (net,) in cr.fetchall():
+            cents, birrs = math.modf(net or 0.0)
+            for amount, denominations in (
+                    (int(birrs), BIRR_DENOMINATIONS),
+                    (int(round(cents * 100.0)), CENT_DENOMINATIONS)):
+                for name, value in denominations:
+                    if amount >= value:
+                        res[name] += amount / value
+                        amount %= value
+        return res
+
+    def _dashboard_amendments(self, cr, uid, period, context=None):
+
+        res = {'draft': [], 'validate': []}
+        cr.execute("""\
+SELECT id, state
+FROM hr_payslip_amendment
+WHERE pay_period_id = %s
+  AND state IN ('draft', 'validate')
+ORDER BY id""", (period.id,))
+        for amendment_id, state in cr.fetchall():
+            res[state].append(amendment_id)
+        return res
+
+    def _dashboard_holidays(self, cr, uid, period, context=None):
+
+        start = datetime.strptime(
+            period.date_start, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d')
+        end = datetime.strptime(
+            period.date_end, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d')
+        return self.pool.get('hr.holidays.public.line').search(
+            cr, uid, [
+                ('date', '>=', start),
+                ('date', '<=', end),
+            ], context=context)
+
+    def invalidate_dashboard(self, cr, uid, ids, sections, context=None):
+        """Drop sections of the dashboard snapshot of the periods in ids,
+        or of every period if ids is None, so that they are computed again
+        by the next get_dashboard()."""
+
+        if ids is not None and not ids:
+            return
+        # Only the periods with any of the sections are updated, so that
+        # changes to records whose sections are already dropped do not
+        # lock the period
+        query = """\
+SELECT id, dashboard_cache
+FROM hr_payroll_period
+WHERE dashboard_cache LIKE ANY (%s)"""
+        params = (['%%"%s":%%' % section for section in sections],)
+        if ids is not None:
+            query += "\n  AND id IN %s"
+            params += (tuple(ids),)
+        cr.execute(query, params)
+        for period_id, cache in cr.fetchall():
+            snapshot = json.loads(cache)
+            if not any(section in snapshot for section in sections):
+                continue
+            for section in sections:
+                snapshot.pop(section, None)
+            cr.execute("""\
+UPDATE hr_payroll_period
+SET dashboard_cache = %s
+WHERE id = %s
+  AND dashboard_cache = %s""", (
+                snapshot and json.dumps(snapshot) or None, period_id, cache))
+            if not cr.rowcount:
+                # The snapshot changed meanwhile, drop all of it
+                cr.execute("""\
+UPDATE hr_payroll_period
+SET dashboard_cache = NULL
+WHERE id = %s
+  AND dashboard_cache IS NOT NULL""", (period_id,))
+
+    def get_period_ids_by_times(self, cr, uid, names, context=None):
+        """Return the ids of the periods containing any of the times in
+        names."""
+
+        names = [n for n in names if n]
+        if not names:
+            return []
+        cr.execute("""\
+SELECT id
+FROM hr_payroll_period
+WHERE date_start <= %s
+  AND date_end >= %s""", (max(names), min(names)))
+        return [r[0] for r in cr.fetchall()]
+
+    def get_period_ids_by_slips(self, cr, uid, slip_ids, context=None):
+        """Return the ids of the periods whose registers contain any of the
+        pay slips in slip_ids."""
+
+        if not slip_ids:
+            return []
+        cr.execute("""\
+SELECT DISTINCT p.id
+FROM hr_payroll_period p
+JOIN hr_payslip_run r ON r.register_id = p.register_id
+JOIN hr_payslip s ON s.payslip_run_id = r.id
+WHERE s.id IN %s""", (tuple(slip_ids),))
+        return [r[0] for r in cr.fetchall()]
+
     def is_ended(self, cr, uid, period_id, context=None):
 
         #
@@ -151,135 +580,116 @@ class hr_payroll_period(orm.Model):
             wf_service.trg_validate(
                 uid, 'hr.payroll.period', pid, 'end_period', cr)
 
-    def set_state_ended(self, cr, uid, ids, context=None):
+    def _set_records_lock(self, cr, uid, period, lock, context=None):
+        """Lock (or unlock) the attendance records, schedule details and
+        leaves of the employees of a period that fall within it.
+
+        The records are found with one search each. Unless the
+        hr_payroll_period.bulk_lock parameter is set to 0 their workflows
+        are moved, and their states written, in bulk rather than with one
+        workflow signal per record.
+        """
 
         #
         # TODO - Someone who cares about DST should update this code
         # to handle it.
         #
 
-        wf_service = netsvc.LocalService('workflow')
         attendance_obj = self.pool.get('hr.attendance')
         detail_obj = self.pool.get('hr.schedule.detail')
         holiday_obj = self.pool.get('hr.holidays')
+        signal = lock and 'signal_lock' or 'signal_unlock'
+        bulk = self.pool.get('ir.config_parameter').get_param(
+            cr, uid, 'hr_payroll_period.bulk_lock', default='1',
+            context=context) not in ('0', 'False', 'false')
+
+        employee_ids = list(set(
+            c.employee_id.id for c in period.schedule_id.contract_ids))
+        if not employee_ids:
+            return
+
+        # Lock sign-in and sign-out attendance records
+        punch_ids = attendance_obj.search(cr, uid, [
+            ('employee_id', 'in', employee_ids),
+            ('name', '>=', period.date_start),
+            ('name', '<=', period.date_end),
+        ], order='name', context=context)
+
+        # Lock schedules
+        detail_ids = detail_obj.search(cr, uid, [
+            ('schedule_id.employee_id', 'in', employee_ids),
+            ('date_start', '>=', period.date_start),
+            ('date_start', '<=', period.date_end),
+        ], order='date_start', context=context)
+
+        # Lock holidays/leaves that end in the current period
+        holiday_ids = holiday_obj.search(cr, uid, [
+            ('employee_id', 'in', employee_ids),
+            ('date_to', '>=', period.date_start),
+            ('date_to', '<=', period.date_end),
+        ], context=context)
+
+        wkf_service = netsvc.LocalService('workflow')
+        if bulk:
+            moved_ids = signal_workflow_bulk(
+                cr, uid, 'hr.attendance', punch_ids, signal)
+            if moved_ids:
+                attendance_obj.write(
+                    cr, uid, moved_ids,
+                    {'state': lock and 'locked' or 'draft'}, context=context)
+
+            moved_ids = signal_workflow_bulk(
+                cr, uid, 'hr.schedule.detail', detail_ids, signal)
+            if moved_ids:
+                detail_obj.write(
+                    cr, uid, moved_ids,
+                    {'state': lock and 'locked' or 'unlocked'},
+                    context=context)
+                # The schedules follow their details once all of them are
+                # locked, or as soon as one of them is unlocked
+                cr.execute("""\
+SELECT DISTINCT schedule_id
+FROM hr_schedule_detail
+WHERE id = ANY(%s)""", (moved_ids,))
+                for (schedule_id,) in cr.fetchall():
+                    wkf_service.trg_validate(
+                        uid, 'hr.schedule', schedule_id, signal, cr)
+        else:
+            for pid in punch_ids:
+                wkf_service.trg_validate(
+                    uid, 'hr.attendance', pid, signal, cr)
+            for did in detail_ids:
+                wkf_service.trg_validate(
+                    uid, 'hr.schedule.detail', did, signal, cr)
+
+        if holiday_ids:
+            holiday_obj.write(
+                cr, uid, holiday_ids,
+                {'payroll_period_state': lock and 'locked' or 'unlocked'},
+                context=context)
+
+    def set_state_ended(self, cr, uid, ids, context=None):
+
         for period in self.browse(cr, uid, ids, context=context):
-            utc_tz = timezone('UTC')
-            dt = datetime.strptime(period.date_start, '%Y-%m-%d %H:%M:%S')
-            utcDtStart = utc_tz.localize(dt, is_dst=False)
-            dt = datetime.strptime(period.date_end, '%Y-%m-%d %H:%M:%S')
-            utcDtEnd = utc_tz.localize(dt, is_dst=False)
+            vals = {'state': 'ended'}
             if period.state in ['locked', 'generate']:
-                for contract in period.schedule_id.contract_ids:
-                    employee = contract.employee_id
-
-                    # Unlock attendance
-                    punch_ids = attendance_obj.search(cr, uid, [
-                        ('employee_id', '=', employee.id),
-                        '&',
-                        ('name', '>=', utcDtStart.strftime(
-                            '%Y-%m-%d %H:%M:%S')),
-                        ('name', '<=', utcDtEnd.strftime(
-                            '%Y-%m-%d %H:%M:%S')),
-                    ], order='name', context=context)
-                    [wf_service.trg_validate(
-                        uid, 'hr.attendance', pid, 'signal_unlock', cr)
-                     for pid in punch_ids]
-
-                    # Unlock schedules
-                    detail_ids = detail_obj.search(cr, uid, [
-                        ('schedule_id.employee_id', '=', employee.id),
-                        '&',
-                        ('date_start', '>=', utcDtStart.strftime(
-                            '%Y-%m-%d %H:%M:%S')),
-                        ('date_start', '<=', utcDtEnd.strftime(
-                            '%Y-%m-%d %H:%M:%S')),
-                    ], order='date_start', context=context)
-                    [wf_service.trg_validate(
-                        uid, 'hr.schedule.detail', did, 'signal_unlock', cr)
-                     for did in detail_ids]
-
-                    # Unlock holidays/leaves that end in the current period
-                    holiday_ids = holiday_obj.search(cr, uid, [
-                        ('employee_id', '=', employee.id),
-                        '&',
-                        ('date_to', '>=', utcDtStart.strftime(
-                            '%Y-%m-%d %H:%M:%S')),
-                        ('date_to', '<=', utcDtEnd.strftime(
-                            '%Y-%m-%d %H:%M:%S')),
-                    ],
-                        context=context)
-                    for hid in holiday_ids:
-                        holiday_obj.write(
-                            cr, uid, [hid], {
-                                'payroll_period_state': 'unlocked'},
-                            context=context)
-
-            self.write(cr, uid, period.id, {'state': 'ended'}, context=context)
+                start = time.time()
+                self._set_records_lock(
+                    cr, uid, period, False, context=context)
+                vals['lock_duration'] = time.time() - start
+            self.write(cr, uid, period.id, vals, context=context)
 
         return True
 
     def set_state_locked(self, cr, uid, ids, context=None):
 
-        #
-        # TODO - Someone who cares about DST should update this code
-        # to handle it.
-        #
-
-        wkf_service = netsvc.LocalService('workflow')
-        attendance_obj = self.pool.get('hr.attendance')
-        detail_obj = self.pool.get('hr.schedule.detail')
-        holiday_obj = self.pool.get('hr.holidays')
         for period in self.browse(cr, uid, ids, context=context):
-            utc_tz = timezone('UTC')
-            dt = datetime.strptime(period.date_start, '%Y-%m-%d %H:%M:%S')
-            utcDtStart = utc_tz.localize(dt, is_dst=False)
-            dt = datetime.strptime(period.date_end, '%Y-%m-%d %H:%M:%S')
-            utcDtEnd = utc_tz.localize(dt, is_dst=False)
-            for contract in period.schedule_id.contract_ids:
-                employee = contract.employee_id
-
-                # Lock sign-in and sign-out attendance records
-                punch_ids = attendance_obj.search(cr, uid, [
-                    ('employee_id', '=', employee.id),
-                    '&',
-                    ('name', '>=', utcDtStart.strftime('%Y-%m-%d %H:%M:%S')),
-                    ('name', '<=', utcDtEnd.strftime(
-                        '%Y-%m-%d %H:%M:%S')),
-                ], order='name', context=context)
-                for pid in punch_ids:
-                    wkf_service.trg_validate(
-                        uid, 'hr.attendance', pid, 'signal_lock', cr)
-
-                # Lock schedules
-                detail_ids = detail_obj.search(cr, uid, [
-                    ('schedule_id.employee_id', '=', employee.id),
-                    '&',
-                    ('date_start', '>=', utcDtStart.strftime(
-                        '%Y-%m-%d %H:%M:%S')),
-                    ('date_start', '<=', utcDtEnd.strftime(
-                        '%Y-%m-%d %H:%M:%S')),
-                ], order='date_start', context=context)
-                for did in detail_ids:
-                    wkf_service.trg_validate(
-                        uid, 'hr.schedule.detail', did, 'signal_lock', cr)
-
-                # Lock holidays/leaves that end in the current period
-                holiday_ids = holiday_obj.search(cr, uid, [
-                    ('employee_id', '=', employee.id),
-                    '&',
-                    ('date_to', '>=', utcDtStart.strftime(
-                        '%Y-%m-%d %H:%M:%S')),
-                    ('date_to', '<=', utcDtEnd.strftime(
-                        '%Y-%m-%d %H:%M:%S')),
-                ],
-                    context=context)
-                for hid in holiday_ids:
-                    holiday_obj.write(
-                        cr, uid, [hid], {'payroll_period_state': 'locked'},
-                        context=context)
-
+            start = time.time()
+            self._set_records_lock(cr, uid, period, True, context=context)
             self.write(cr, uid, period.id, {
-                       'state': 'locked'}, context=context)
+                'state': 'locked',
+                'lock_duration': time.time() - start,
+            }, context=context)
 
         return True
 
@@ -555,7 +965,7 @@ class hr_contract(orm.Model):
     _columns = {
         'pps_id': fields.many2one(
             'hr.payroll.period.schedule', 'Payroll Period Schedule',
-            required=True),
+            required=True, select=True),
     }
 
     def _get_pay_sched(self, cr, uid, context=None):
@@ -570,6 +980,50 @@ class hr_contract(orm.Model):
         'pps_id': _get_pay_sched,
     }
 
+    def _invalidate_dashboard(self, cr, uid, ids, context=None):
+        # The attendance alerts and missing punches of a period are those
+        # of the employees with an active contract on its schedule
+        cr.execute("""\
+SELECT DISTINCT p.id
+FROM hr_payroll_period p
+JOIN hr_contract c ON c.pps_id = p.schedule_id
+WHERE c.id IN %s""", (tuple(ids),))
+        period_ids = [r[0] for r in cr.fetchall()]
+        period_obj = self.pool.get('hr.payroll.period')
+        period_obj.clear_missing_punches(
+            cr, uid, period_ids, context=context)
+        period_obj.invalidate_dashboard(
+            cr, uid, period_ids, ['alerts'], context=context)
+
+    def create(self, cr, uid, vals, context=None):
+
+        res = super(hr_contract, self).create(cr, uid, vals, context=context)
+        self._invalidate_dashboard(cr, uid, [res], context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not ids or not set(['pps_id', 'employee_id', 'active']) & set(
+                vals):
+            return super(hr_contract, self).write(
+                cr, uid, ids, vals, context=context)
+
+        self._invalidate_dashboard(cr, uid, ids, context=context)
+        res = super(hr_contract, self).write(
+            cr, uid, ids, vals, context=context)
+        self._invalidate_dashboard(cr, uid, ids, context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if ids:
+            self._invalidate_dashboard(cr, uid, ids, context=context)
+        return super(hr_contract, self).unlink(cr, uid, ids, context=context)
+
 
 class hr_payslip(orm.Model):
 
@@ -581,9 +1035,95 @@ class hr_payslip(orm.Model):
                                          'Exceptions', readonly=True),
     }
 
+    # Histories of the pay slips being computed, by cursor. The lines of
+    # the pay slips are computed one at a time by hr_payroll, and share the
+    # history of all the pay slips computed with them.
+    _computing_histories = {}
+
+    def get_payslip_history(self, cr, uid, ids, context=None):
+        """Return the payslip_history of the pay slips in ids: the one
+        shared by the pay slips being computed if they are among them, or
+        else a new one for ids. Nothing is loaded until a total is asked
+        for."""
+
+        history = self._computing_histories.get(cr)
+        if history is not None and history.slip_ids.issuperset(ids):
+            return history
+        return payslip_history(cr, ids)
+
     def compute_sheet(self, cr, uid, ids, context=None):
 
-        super(hr_payslip, self).compute_sheet(cr, uid, ids, context=context)
+        if context is None:
+            context = {}
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        previous = self._computing_histories.get(cr)
+        self._computing_histories[cr] = payslip_history(cr, ids)
+        try:
+            super(hr_payslip, self).compute_sheet(
+                cr, uid, ids, context=context)
+            self.check_exceptions(cr, uid, ids, context=context)
+        finally:
+            if previous is None:
+                del self._computing_histories[cr]
+            else:
+                self._computing_histories[cr] = previous
+        # Registers computing their pay slips in chunks refresh the
+        # dashboard of their period once at the end
+        if not context.get('defer_period_dashboard'):
+            period_obj = self.pool.get('hr.payroll.period')
+            period_obj.invalidate_dashboard(
+                cr, uid,
+                period_obj.get_period_ids_by_slips(
+                    cr, uid, ids, context=context),
+                ['exceptions', 'change'], context=context)
+        return True
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if 'payslip_run_id' not in vals:
+            return super(hr_payslip, self).write(
+                cr, uid, ids, vals, context=context)
+
+        period_obj = self.pool.get('hr.payroll.period')
+        period_ids = period_obj.get_period_ids_by_slips(
+            cr, uid, ids, context=context)
+        res = super(hr_payslip, self).write(
+            cr, uid, ids, vals, context=context)
+        period_ids += period_obj.get_period_ids_by_slips(
+            cr, uid, ids, context=context)
+        period_obj.invalidate_dashboard(
+            cr, uid, list(set(period_ids)), ['exceptions', 'change'],
+            context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        period_obj = self.pool.get('hr.payroll.period')
+        period_ids = period_obj.get_period_ids_by_slips(
+            cr, uid, ids, context=context)
+        res = super(hr_payslip, self).unlink(cr, uid, ids, context=context)
+        period_obj.invalidate_dashboard(
+            cr, uid, period_ids, ['exceptions', 'change'], context=context)
+        return res
+
+    def check_exceptions(self, cr, uid, ids, context=None):
+        """Evaluate the active payroll exception rules against the computed
+        pay slips in ids and record the exceptions raised."""
+
+        if context is None:
+            context = {}
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not ids:
+            return True
+        # The exception rules of all the pay slips share the history of
+        # their employees
+        history = self.get_payslip_history(cr, uid, ids, context=context)
 
         class BrowsableObject(object):
 
@@ -605,14 +1145,8 @@ class hr_payslip(orm.Model):
             def sum(self, code, from_date, to_date=None):
                 if to_date is None:
                     to_date = datetime.now().strftime('%Y-%m-%d')
-                self.cr.execute(
-                    "SELECT sum(amount) as sum"
-                    "FROM hr_payslip as hp, hr_payslip_input as pi "
-                    "WHERE hp.employee_id = %s AND hp.state = 'done' "
-                    "AND hp.date_from >= %s AND hp.date_to <= %s "
-                    "AND hp.id = pi.payslip_id AND pi.code = %s",
-                    (self.employee_id, from_date, to_date, code))
-                res = self.cr.fetchone()[0]
+                res = history.get(
+                    'inputs', self.employee_id, code, from_date, to_date)[0]
                 return res or 0.0
 
         class WorkedDays(BrowsableObject):
@@ -623,15 +1157,8 @@ class hr_payslip(orm.Model):
             def _sum(self, code, from_date, to_date=None):
                 if to_date is None:
                     to_date = datetime.now().strftime('%Y-%m-%d')
-                self.cr.execute(
-                    "SELECT sum(number_of_days) as number_of_days, "
-                    "sum(number_of_hours) as number_of_hours"
-                    "FROM hr_payslip as hp, hr_payslip_worked_days as pi "
-                    "WHERE hp.employee_id = %s AND hp.state = 'done'"
-                    "AND hp.date_from >= %s AND hp.date_to <= %s "
-                    "AND hp.id = pi.payslip_id AND pi.code = %s",
-                    (self.employee_id, from_date, to_date, code))
-                return self.cr.fetchone()
+                return history.get(
+                    'worked_days', self.employee_id, code, from_date, to_date)
 
             def sum(self, code, from_date, to_date=None):
                 res = self._sum(code, from_date, to_date)
@@ -649,85 +1176,86 @@ class hr_payslip(orm.Model):
             def sum(self, code, from_date, to_date=None):
                 if to_date is None:
                     to_date = datetime.now().strftime('%Y-%m-%d')
-                self.cr.execute(
-                    "SELECT sum(case when hp.credit_note = False then "
-                    "(pl.total) else (-pl.total) end)"
-                    "FROM hr_payslip as hp, hr_payslip_line as pl "
-                    "WHERE hp.employee_id = %s AND hp.state = 'done' "
-                    "AND hp.date_from >= %s AND hp.date_to <= %s "
-                    "AND hp.id = pl.slip_id AND pl.code = %s",
-                    (self.employee_id, from_date, to_date, code))
-                res = self.cr.fetchone()
+                res = history.get(
+                    'lines', self.employee_id, code, from_date, to_date)
                 return res and res[0] or 0.0
 
         rule_obj = self.pool.get('hr.payslip.exception.rule')
-        rule_ids = rule_obj.search(
-            cr, uid, [('active', '=', True)], context=context)
-        rule_seq = []
-        for i in rule_ids:
-            data = rule_obj.read(cr, uid, i, ['sequence'], context=context)
-            rule_seq.append((i, data['sequence']))
-        sorted_rule_ids = [
-            id for id, sequence in sorted(rule_seq, key=lambda x:x[1])]
+        rules = rule_obj.get_active_rules(cr, uid, context=context)
+        if not rules:
+            return True
 
+        # The lines, worked days and inputs of all the pay slips, by code.
+        # The first line of a code (by sequence) is the one that counts for
+        # the categories, the last worked day or input line of a code wins.
+        cr.execute("""\
+SELECT DISTINCT ON (slip_id, code) slip_id, code, id
+FROM hr_payslip_line
+WHERE slip_id IN %s
+ORDER BY slip_id, code, sequence, id""", (tuple(ids),))
+        categories = dict((i, {}) for i in ids)
+        line_rows = cr.fetchall()
+        lines = dict((l.id, l) for l in self.pool['hr.payslip.line'].browse(
+            cr, uid, [r[2] for r in line_rows], context=context))
+        for slip_id, code, line_id in line_rows:
+            categories[slip_id][code] = lines[line_id]
+
+        def _lines_by_code(model, table):
+            res = dict((i, {}) for i in ids)
+            cr.execute("""\
+SELECT payslip_id, code, id
+FROM """ + table + """
+WHERE payslip_id IN %s
+ORDER BY payslip_id, sequence, id""", (tuple(ids),))
+            rows = cr.fetchall()
+            records = dict((l.id, l) for l in self.pool[model].browse(
+                cr, uid, [r[2] for r in rows], context=context))
+            for slip_id, code, line_id in rows:
+                res[slip_id][code] = records[line_id]
+            return res
+
+        worked_days = _lines_by_code(
+            'hr.payslip.worked_days', 'hr_payslip_worked_days')
+        inputs = _lines_by_code('hr.payslip.input', 'hr_payslip_input')
+
+        exceptions = []
         for payslip in self.browse(cr, uid, ids, context=context):
-            payslip_obj = Payslips(
-                self.pool, cr, uid, payslip.employee_id.id, payslip)
-
-            codes = []
-            categories = {}
-            for line in payslip.details_by_salary_rule_category:
-                if line.code not in codes:
-                    categories[line.code] = line
-                    codes.append(line.code)
-            categories_obj = BrowsableObject(
-                self.pool, cr, uid, payslip.employee_id.id, categories)
-
-            worked_days = {}
-            for line in payslip.worked_days_line_ids:
-                worked_days[line.code] = line
-            worked_days_obj = WorkedDays(
-                self.pool, cr, uid, payslip.employee_id.id, worked_days)
-
-            inputs = {}
-            for line in payslip.input_line_ids:
-                inputs[line.code] = line
-            input_obj = InputLine(
-                self.pool, cr, uid, payslip.employee_id.id, inputs)
-
+            employee_id = payslip.employee_id.id
             temp_dict = {}
             utils_dict = self.get_utilities_dict(
                 cr, uid, payslip.contract_id, payslip, context=context)
             for k, v in utils_dict.iteritems():
-                k_obj = BrowsableObject(
-                    self.pool, cr, uid, payslip.employee_id.id, v)
-                temp_dict.update({k: k_obj})
-            utils_obj = BrowsableObject(
-                self.pool, cr, uid, payslip.employee_id.id, temp_dict)
+                temp_dict[k] = BrowsableObject(
+                    self.pool, cr, uid, employee_id, v)
 
             localdict = {
-                'categories': categories_obj,
-                'payslip': payslip_obj,
-                'worked_days': worked_days_obj,
-                'inputs': input_obj,
-                'utils': utils_obj,
+                'categories': BrowsableObject(
+                    self.pool, cr, uid, employee_id,
+                    categories[payslip.id]),
+                'payslip': Payslips(
+                    self.pool, cr, uid, employee_id, payslip),
+                'worked_days': WorkedDays(
+                    self.pool, cr, uid, employee_id,
+                    worked_days[payslip.id]),
+                'inputs': InputLine(
+                    self.pool, cr, uid, employee_id, inputs[payslip.id]),
+                'utils': BrowsableObject(
+                    self.pool, cr, uid, employee_id, temp_dict),
                 'result': None,
             }
 
-            for rule in rule_obj.browse(
-                cr, uid, sorted_rule_ids, context=context
-            ):
-                if rule_obj.satisfy_condition(
-                    cr, uid, rule.id, localdict, context=context
-                ):
-                    val = {
-                        'name': rule.name,
+            for rule in rules:
+                if rule_obj.satisfy_rule_condition(
+                        cr, uid, rule, localdict, context=context):
+                    exceptions.append({
+                        'name': rule['name'],
                         'slip_id': payslip.id,
-                        'rule_id': rule.id,
-                    }
-                    self.pool.get('hr.payslip.exception').create(
-                        cr, uid, val, context=context)
+                        'rule_id': rule['id'],
+                        'severity': rule['severity'],
+                    })
 
+        self.pool['hr.payslip.exception'].create_bulk(
+            cr, uid, exceptions, context=context)
         return True
 
 
@@ -748,6 +1276,15 @@ class hr_payslip_exception(orm.Model):
             readonly=True),
     }
 
+    def create_bulk(self, cr, uid, vals_list, context=None):
+        """Create the exceptions raised by check_exceptions() and return
+        their ids."""
+
+        columns = ['name', 'slip_id', 'rule_id', 'severity']
+        return insert_rows(cr, uid, 'hr_payslip_exception', columns, [
+            tuple(vals[c] for c in columns) for vals in vals_list])
+
+
 # This is almost 100% lifted from hr_payroll/hr.salary.rule
 # I omitted the parts I don't use.
 #
@@ -816,28 +1353,53 @@ class hr_payslip_exception_rule(orm.Model):
 result = categories.GROSS.amount > categories.NET.amount''',
     }
 
-    def satisfy_condition(self, cr, uid, rule_id, localdict, context=None):
+    def get_active_rules(self, cr, uid, context=None):
+        """Return the active rules, by sequence, as dicts with the fields
+        needed to evaluate them."""
+
+        rule_ids = self.search(
+            cr, uid, [('active', '=', True)], context=context)
+        rules = self.read(cr, uid, rule_ids, [
+            'name', 'code', 'sequence', 'severity', 'condition_select',
+            'condition_python',
+        ], context=context)
+        return sorted(rules, key=lambda x: x['sequence'])
+
+    def satisfy_rule_condition(self, cr, uid, rule, localdict,
+                               context=None):
         """
-        @param rule_id: id of hr.payslip.exception.rule to be tested
-        @param contract_id: id of hr.contract to be tested
+        @param rule: rule as returned by get_active_rules()
         @return: returns True if the given rule match the condition for the
-        given contract.
+        pay slip of localdict.
         Return False otherwise.
         """
-        rule = self.browse(cr, uid, rule_id, context=context)
 
-        if rule.condition_select == 'none':
+        if rule['condition_select'] == 'none':
             return True
         else:  # python code
             try:
-                eval(rule.condition_python,
+                eval(rule['condition_python'],
                      localdict, mode='exec', nocopy=True)
                 return 'result' in localdict and localdict['result'] or False
-            except:
+            except Exception:
                 raise orm.except_orm(
                     _('Error!'),
                     _('Wrong python condition defined for payroll exception '
-                      'rule %s (%s).') % (rule.name, rule.code))
+                      'rule %s (%s).') % (rule['name'], rule['code']))
+
+    def satisfy_condition(self, cr, uid, rule_id, localdict, context=None):
+        """
+        @param rule_id: id of hr.payslip.exception.rule to be tested
+        @param contract_id: id of hr.contract to be tested
+        @return: returns True if the given rule match the condition for the
+        given contract.
+        Return False otherwise.
+        """
+        rule = self.read(cr, uid, rule_id, [
+            'name', 'code', 'condition_select', 'condition_python',
+        ], context=context)
+        return self.satisfy_rule_condition(
+            cr, uid, rule, localdict, context=context)
 
 
 class hr_payslip_amendment(orm.Model):
@@ -859,6 +1421,198 @@ class hr_payslip_amendment(orm.Model):
         ),
     }
 
+    def _invalidate_dashboard(self, cr, uid, ids, context=None):
+        cr.execute('SELECT DISTINCT pay_period_id FROM hr_payslip_amendment '
+                   'WHERE id IN %s AND pay_period_id IS NOT NULL',
+                   (tuple(ids),))
+        self.pool.get('hr.payroll.period').invalidate_dashboard(
+            cr, uid, [r[0] for r in cr.fetchall()], ['amendments'],
+            context=context)
+
+    def create(self, cr, uid, vals, context=None):
+
+        res = super(hr_payslip_amendment, self).create(
+            cr, uid, vals, context=context)
+        self._invalidate_dashboard(cr, uid, [res], context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not ids or ('state' not in vals and 'pay_period_id' not in vals):
+            return super(hr_payslip_amendment, self).write(
+                cr, uid, ids, vals, context=context)
+
+        self._invalidate_dashboard(cr, uid, ids, context=context)
+        res = super(hr_payslip_amendment, self).write(
+            cr, uid, ids, vals, context=context)
+        self._invalidate_dashboard(cr, uid, ids, context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if ids:
+            self._invalidate_dashboard(cr, uid, ids, context=context)
+        return super(hr_payslip_amendment, self).unlink(
+            cr, uid, ids, context=context)
+
+
+class hr_payslip_run(orm.Model):
+
+    _name = 'hr.payslip.run'
+    _inherit = 'hr.payslip.run'
+
+    def _get_period_ids(self, cr, uid, ids, context=None):
+        cr.execute("""\
+SELECT DISTINCT p.id
+FROM hr_payroll_period p
+JOIN hr_payslip_run r ON r.register_id = p.register_id
+WHERE r.id IN %s""", (tuple(ids),))
+        return [r[0] for r in cr.fetchall()]
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not ids or 'register_id' not in vals:
+            return super(hr_payslip_run, self).write(
+                cr, uid, ids, vals, context=context)
+
+        period_ids = self._get_period_ids(cr, uid, ids, context=context)
+        res = super(hr_payslip_run, self).write(
+            cr, uid, ids, vals, context=context)
+        period_ids += self._get_period_ids(cr, uid, ids, context=context)
+        self.pool.get('hr.payroll.period').invalidate_dashboard(
+            cr, uid, list(set(period_ids)), ['exceptions', 'change'],
+            context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        period_ids = ids and self._get_period_ids(
+            cr, uid, ids, context=context) or []
+        res = super(hr_payslip_run, self).unlink(
+            cr, uid, ids, context=context)
+        self.pool.get('hr.payroll.period').invalidate_dashboard(
+            cr, uid, period_ids, ['exceptions', 'change'], context=context)
+        return res
+
+
+class hr_payroll_register(orm.Model):
+
+    _name = 'hr.payroll.register'
+    _inherit = 'hr.payroll.register'
+
+    def _compute_slips_chunk(self, cr, uid, register_id, slip_ids,
+                             context=None):
+
+        if context is None:
+            context = {}
+        # Keep each pay slip of the chunk from updating the dashboard of
+        # the period
+        res = super(hr_payroll_register, self)._compute_slips_chunk(
+            cr, uid, register_id, slip_ids,
+            context=dict(context, defer_period_dashboard=True))
+        period_obj = self.pool.get('hr.payroll.period')
+        period_obj.invalidate_dashboard(
+            cr, uid,
+            period_obj.search(
+                cr, uid, [('register_id', '=', register_id)],
+                context=context),
+            ['exceptions', 'change'], context=context)
+        return res
+
+
+class hr_schedule_alert(orm.Model):
+
+    _name = 'hr.schedule.alert'
+    _inherit = 'hr.schedule.alert'
+
+    def _invalidate_dashboard(self, cr, uid, names, context=None):
+        period_obj = self.pool.get('hr.payroll.period')
+        period_obj.invalidate_dashboard(
+            cr, uid,
+            period_obj.get_period_ids_by_times(cr, uid, names,
+                                               context=context),
+            ['alerts'], context=context)
+
+    def _get_alert_names(self, cr, ids):
+        cr.execute('SELECT name FROM hr_schedule_alert WHERE id IN %s',
+                   (tuple(ids),))
+        return [r[0] for r in cr.fetchall()]
+
+    def _create_alerts_bulk(self, cr, uid, alerts, context=None):
+
+        res = super(hr_schedule_alert, self)._create_alerts_bulk(
+            cr, uid, alerts, context=context)
+        self._invalidate_dashboard(
+            cr, uid, [a[0] for a in alerts], context=context)
+        return res
+
+    def create(self, cr, uid, vals, context=None):
+
+        res = super(hr_schedule_alert, self).create(
+            cr, uid, vals, context=context)
+        self._invalidate_dashboard(
+            cr, uid, self._get_alert_names(cr, [res]), context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        res = super(hr_schedule_alert, self).write(
+            cr, uid, ids, vals, context=context)
+        if ids and set(['name', 'rule_id', 'punch_id',
+                        'sched_detail_id']) & set(vals):
+            self._invalidate_dashboard(
+                cr, uid, self._get_alert_names(cr, ids) + [vals.get('name')],
+                context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        names = ids and self._get_alert_names(cr, ids) or []
+        res = super(hr_schedule_alert, self).unlink(
+            cr, uid, ids, context=context)
+        self._invalidate_dashboard(cr, uid, names, context=context)
+        return res
+
+
+class hr_holidays_public_line(orm.Model):
+
+    _name = 'hr.holidays.public.line'
+    _inherit = 'hr.holidays.public.line'
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(hr_holidays_public_line, self).create(
+            cr, uid, vals, context=context)
+        self.pool['hr.payroll.period'].invalidate_dashboard(
+            cr, uid, None, ['holidays'], context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(hr_holidays_public_line, self).write(
+            cr, uid, ids, vals, context=context)
+        if 'date' in vals:
+            self.pool['hr.payroll.period'].invalidate_dashboard(
+                cr, uid, None, ['holidays'], context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(hr_holidays_public_line, self).unlink(
+            cr, uid, ids, context=context)
+        self.pool['hr.payroll.period'].invalidate_dashboard(
+            cr, uid, None, ['holidays'], context=context)
+        return res
+
 
 class hr_holidays_status(orm.Model):
 
@@ -20,13 +20,11 @@
 #
 
 import logging
-import math
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from pytz import timezone
 
 from openerp import netsvc
-from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT as OEDATETIME_FORMAT
 from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OEDATE_FORMAT
 from openerp.tools.translate import _
 from openerp.osv import fields, orm
@@ -34,26 +32,15 @@ from openerp.osv import fields, orm
 
 _logger = logging.getLogger(__name__)
 
+# Default number of pay slips whose values are computed and created together
+PAYSLIP_CHUNK_SIZE = 100
+
 
 class payroll_period_end_1(orm.TransientModel):
 
     _name = 'hr.payroll.period.end.1'
     _description = 'End of Payroll Period Wizard Step 1'
 
-    _change_res = {
-        'br100': 0,
-        'br50': 0,
-        'br10': 0,
-        'br5': 0,
-        'br1': 0,
-        'cent50': 0,
-        'cent25': 0,
-        'cent10': 0,
-        'cent05': 0,
-        'cent01': 0,
-        'done': False,
-    }
-
     _columns = {
         'period_id': fields.integer(
             'Period ID',
@@ -109,6 +96,11 @@ class payroll_period_end_1(orm.TransientModel):
             'Can Unlock Period?',
             readonly=True,
         ),
+        'lock_duration': fields.char(
+            'Last Lock/Unlock Time',
+            size=64,
+            readonly=True,
+        ),
         'payslips': fields.boolean(
             'Have Pay Slips Been Generated?',
             readonly=True,
@@ -117,6 +109,11 @@ class payroll_period_end_1(orm.TransientModel):
             'Pay Slip Generated?',
             readonly=True,
         ),
+        'ps_progress': fields.char(
+            'Pay Slips Computed',
+            size=64,
+            readonly=True,
+        ),
         'payment_started': fields.boolean(
             'Payment Started?',
             readonly=True,
@@ -205,30 +202,39 @@ class payroll_period_end_1(orm.TransientModel):
                 cr, uid, period_id, context=context)
         return flag
 
-    def _alerts_count(self, cr, uid, severity, context=None):
-
-        alert_obj = self.pool.get('hr.schedule.alert')
+    def default_get(self, cr, uid, fields_list, context=None):
 
         if context is None:
             context = {}
+        # Share the statistics of the period with all the defaults
         period_id = context.get('active_id', False)
+        if period_id and 'period_dashboard' not in context:
+            context = dict(
+                context,
+                period_dashboard=self.pool.get(
+                    'hr.payroll.period').get_dashboard(
+                        cr, uid, period_id, context=context))
+        return super(payroll_period_end_1, self).default_get(
+            cr, uid, fields_list, context=context)
 
-        alert_ids = []
-        if period_id:
-            period = self.pool.get('hr.payroll.period').browse(
+    def _get_dashboard(self, cr, uid, context=None):
+
+        if context is None:
+            context = {}
+        res = context.get('period_dashboard')
+        if res is None:
+            period_id = context.get('active_id', False)
+            if not period_id:
+                return {}
+            res = self.pool.get('hr.payroll.period').get_dashboard(
                 cr, uid, period_id, context=context)
-            if period:
-                employee_ids = []
-                [employee_ids.append(c.employee_id.id)
-                 for c in period.schedule_id.contract_ids]
-                alert_ids = alert_obj.search(
-                    cr, uid, ['&', ('name', '>=', period.date_start),
-                              ('name', '<=', period.date_end),
-                              ('severity', '=', severity),
-                              ('employee_id', 'in', employee_ids),
-                              ],
-                    context=context)
-        return len(alert_ids)
+        return res
+
+    def _alerts_count(self, cr, uid, severity, context=None):
+
+        alerts = self._get_dashboard(cr, uid, context=context).get(
+            'alerts', {})
+        return alerts.get(severity, 0)
 
     def _critical_alerts(self, cr, uid, context=None):
         return self._alerts_count(cr, uid, 'critical', context)
@@ -243,28 +249,10 @@ class payroll_period_end_1(orm.TransientModel):
         return self._alerts_count(cr, uid, 'low', context)
 
     def _pex_count(self, cr, uid, severity, context=None):
-        ex_obj = self.pool.get('hr.payslip.exception')
-        run_obj = self.pool.get('hr.payslip.run')
-
-        if context is None:
-            context = {}
-        period_id = context.get('active_id', False)
 
-        ex_ids = []
-        slip_ids = []
-        if period_id:
-            period = self.pool.get('hr.payroll.period').browse(
-                cr, uid, period_id, context=context)
-            if period and period.register_id:
-                for run_id in period.register_id.run_ids:
-                    data = run_obj.read(
-                        cr, uid, run_id.id, ['slip_ids'], context=context)
-                    [slip_ids.append(i) for i in data['slip_ids']]
-                ex_ids = ex_obj.search(cr, uid, [('severity', '=', severity),
-                                                 ('slip_id', 'in', slip_ids),
-                                                 ],
-                                       context=context)
-        return len(ex_ids)
+        exceptions = self._get_dashboard(cr, uid, context=context).get(
+            'exceptions', {})
+        return exceptions.get(severity, 0)
 
     def _pex_critical(self, cr, uid, context=None):
         return self._pex_count(cr, uid, 'critical', context)
@@ -285,55 +273,13 @@ class payroll_period_end_1(orm.TransientModel):
 
     def _missing_punches(self, cr, uid, context=None):
 
-        #
-        # TODO - Someone who cares about DST should update this code to handle
-        #  it.
-        #
-
-        missing_punch_ids = []
         if context is None:
             context = {}
         period_id = context.get('active_id', False)
-        if period_id:
-            period = self.pool.get('hr.payroll.period').browse(
-                cr, uid, period_id, context=context)
-            if period:
-                attendance_obj = self.pool.get('hr.attendance')
-                utc_tz = timezone('UTC')
-                dt = datetime.strptime(period.date_start, '%Y-%m-%d %H:%M:%S')
-                utcDtStart = utc_tz.localize(dt, is_dst=False)
-                dt = datetime.strptime(period.date_end, '%Y-%m-%d %H:%M:%S')
-                utcDtEnd = utc_tz.localize(dt, is_dst=False)
-                for contract in period.schedule_id.contract_ids:
-                    employee = contract.employee_id
-                    punch_ids = attendance_obj.search(cr, uid, [
-                        ('employee_id', '=', employee.id),
-                        '&',
-                        ('name', '>=', utcDtStart.strftime(
-                            '%Y-%m-%d %H:%M:S')),
-                        ('name', '<=', utcDtEnd.strftime(
-                            '%Y-%m-%d %H:%M:S')),
-                    ], order='name', context=context)
-                    prevPunch = False
-                    if len(punch_ids) > 0:
-                        punches = attendance_obj.browse(
-                            cr, uid, punch_ids, context=context)
-                        for punch in punches:
-                            if not prevPunch:
-                                # First Punch must be a sign-in
-                                if punch.action != 'sign_in':
-                                    missing_punch_ids.append(punch.id)
-                            elif punch.action == 'sign_in':
-                                if prevPunch.action != 'sign_out':
-                                    missing_punch_ids.append(prevPunch.id)
-                            elif punch.action == 'sign_out':
-                                if prevPunch.action != 'sign_in':
-                                    missing_punch_ids.append(punch.id)
-                            prevPunch = punch
-                        # The last punch should be a sign out
-                        if prevPunch and prevPunch.action != 'sign_out':
-                            missing_punch_ids.append(prevPunch.id)
-        return missing_punch_ids
+        if not period_id:
+            return []
+        return self.pool.get('hr.payroll.period').get_missing_punch_ids(
+            cr, uid, period_id, context=context)
 
     def _get_locked(self, cr, uid, context=None):
 
@@ -362,6 +308,20 @@ class payroll_period_end_1(orm.TransientModel):
 
         return flag
 
+    def _get_lock_duration(self, cr, uid, context=None):
+
+        res = False
+        if context is None:
+            context = {}
+        period_id = context.get('active_id', False)
+        if period_id:
+            data = self.pool.get('hr.payroll.period').read(
+                cr, uid, period_id, ['lock_duration'], context=context)
+            if data.get('lock_duration'):
+                res = _('%.1f seconds') % data['lock_duration']
+
+        return res
+
     def _get_payslips(self, cr, uid, context=None):
 
         flag = False
@@ -392,6 +352,21 @@ class payroll_period_end_1(orm.TransientModel):
 
         return flag
 
+    def _get_ps_progress(self, cr, uid, context=None):
+
+        res = False
+        if context is None:
+            context = {}
+        period_id = context.get('active_id', False)
+        if period_id:
+            period = self.pool.get('hr.payroll.period').browse(
+                cr, uid, period_id, context=context)
+            if period.register_id and period.register_id.slips_total:
+                res = _('%d of %d') % (period.register_id.slips_computed,
+                                       period.register_id.slips_total)
+
+        return res
+
     def _get_payment_started(self, cr, uid, context=None):
 
         flag = False
@@ -408,10 +383,7 @@ class payroll_period_end_1(orm.TransientModel):
 
     def _get_change(self, cr, uid, context=None):
 
-        if self._change_res['done']:
-            return self._change_res
-
-        self._change_res = {
+        res = {
             'br100': 0,
             'br50': 0,
             'br10': 0,
@@ -422,70 +394,10 @@ class payroll_period_end_1(orm.TransientModel):
             'cent10': 0,
             'cent05': 0,
             'cent01': 0,
-            'done': False,
         }
-
-        net_lines = []
-        if context is None:
-            context = {}
-        period_id = context.get('active_id', False)
-        if period_id:
-            data = self.pool.get('hr.payroll.period').read(
-                cr, uid, period_id, ['register_id'], context=context
-            )
-            if data['register_id']:
-                data = self.pool.get(
-                    'hr.payroll.register').read(
-                    cr, uid, data['register_id'][0], ['run_ids'],
-                    context=context
-                )
-                if data['run_ids']:
-                    ps_runs = self.pool.get(
-                        'hr.payslip.run').browse(cr, uid, data['run_ids'],
-                                                 context=context)
-                    for psr in ps_runs:
-                        for slip in psr.slip_ids:
-                            for line in slip.line_ids:
-                                if line.salary_rule_id.code == 'NET':
-                                    net_lines.append(line.total)
-        if len(net_lines) > 0:
-            for net in net_lines:
-                cents, birrs = math.modf(net)
-
-                birrs = int(birrs)
-                cents = int(round(cents, 2) * 100.0)
-                if birrs >= 100:
-                    self._change_res['br100'] += birrs / 100
-                    birrs %= 100
-                if birrs >= 50:
-                    self._change_res['br50'] += birrs / 50
-                    birrs %= 50
-                if birrs >= 10:
-                    self._change_res['br10'] += birrs / 10
-                    birrs %= 10
-                if birrs >= 5:
-                    self._change_res['br5'] += birrs / 5
-                    birrs %= 5
-                if birrs >= 1:
-                    self._change_res['br1'] += birrs
-
-                if cents >= 50:
-                    self._change_res['cent50'] += cents / 50
-                    cents %= 50
-                if cents >= 25:
-                    self._change_res['cent25'] += cents / 25
-                    cents %= 25
-                if cents >= 10:
-                    self._change_res['cent10'] += cents / 10
-                    cents %= 10
-                if cents >= 5:
-                    self._change_res['cent05'] += cents / 5
-                    cents %= 5
-                if cents >= 1:
-                    self._change_res['cent01'] += cents
-            self._change_res['done'] = True
-
-        return self._change_res
+        res.update(self._get_dashboard(cr, uid, context=context).get(
+            'change', {}))
+        return res
 
     def _get_br100(self, cr, uid, context=None):
 
@@ -529,17 +441,18 @@ class payroll_period_end_1(orm.TransientModel):
 
     def _get_change_total(self, cr, uid, context=None):
 
-        birr = self._change_res['br100'] * 100
-        birr += self._change_res['br50'] * 50
-        birr += self._change_res['br10'] * 10
-        birr += self._change_res['br5'] * 5
-        birr += self._change_res['br1']
+        change = self._get_change(cr, uid, context=context)
+        birr = change['br100'] * 100
+        birr += change['br50'] * 50
+        birr += change['br10'] * 10
+        birr += change['br5'] * 5
+        birr += change['br1']
 
-        cents = self._change_res['cent50'] * 50
-        cents += self._change_res['cent25'] * 25
-        cents += self._change_res['cent10'] * 10
-        cents += self._change_res['cent05'] * 5
-        cents += self._change_res['cent01']
+        cents = change['cent50'] * 50
+        cents += change['cent25'] * 25
+        cents += change['cent10'] * 10
+        cents += change['cent05'] * 5
+        cents += change['cent01']
 
         birr += cents / 100
         cents %= 100
@@ -562,66 +475,20 @@ class payroll_period_end_1(orm.TransientModel):
 
     def _get_public_holidays(self, cr, uid, context=None):
 
-        holiday_ids = []
-        if context is None:
-            context = {}
-        period_id = context.get('active_id', False)
-        if not period_id:
-            return holiday_ids
-
-        data = self.pool.get('hr.payroll.period').read(
-            cr, uid, period_id, ['date_start', 'date_end'], context=context
-        )
-        start = datetime.strptime(
-            data['date_start'], OEDATETIME_FORMAT).date().strftime(
-                OEDATE_FORMAT)
-        end = datetime.strptime(
-            data['date_end'], OEDATETIME_FORMAT).date().strftime(OEDATE_FORMAT)
-        holiday_ids = self.pool.get('hr.holidays.public.line').search(
-            cr, uid, [
-                '&',
-                ('date', '>=', start),
-                ('date', '<=', end),
-            ], context=context
-        )
-
-        return holiday_ids
+        return self._get_dashboard(cr, uid, context=context).get(
+            'holidays', [])
 
     def _get_confirmed_amendments(self, cr, uid, context=None):
 
-        psa_ids = []
-        if context is None:
-            context = {}
-        period_id = context.get('active_id', False)
-        if not period_id:
-            return psa_ids
-
-        psa_ids = self.pool.get(
-            'hr.payslip.amendment').search(
-                cr, uid, [
-                    ('pay_period_id', '=', period_id),
-                    ('state', 'in', ['validate']),
-                ], context=context
-        )
-        return psa_ids
+        amendments = self._get_dashboard(cr, uid, context=context).get(
+            'amendments', {})
+        return amendments.get('validate', [])
 
     def _get_draft_amendments(self, cr, uid, context=None):
 
-        psa_ids = []
-        if context is None:
-            context = {}
-        period_id = context.get('active_id', False)
-        if not period_id:
-            return psa_ids
-
-        psa_ids = self.pool.get(
-            'hr.payslip.amendment').search(
-                cr, uid, [
-                    ('pay_period_id', '=', period_id),
-                    ('state', 'in', ['draft']),
-                ], context=context
-        )
-        return psa_ids
+        amendments = self._get_dashboard(cr, uid, context=context).get(
+            'amendments', {})
+        return amendments.get('draft', [])
 
     _defaults = {
         'period_id': _get_period_id,
@@ -637,7 +504,9 @@ class payroll_period_end_1(orm.TransientModel):
         'pex_low': _pex_low,
         'locked': _get_locked,
         'can_unlock': _get_can_unlock,
+        'lock_duration': _get_lock_duration,
         'ps_generated': _get_ps_generated,
+        'ps_progress': _get_ps_progress,
         'payslips': _get_payslips,
         'payment_started': _get_payment_started,
         'closed': _get_closed,
@@ -898,6 +767,11 @@ class payroll_period_end_1(orm.TransientModel):
                 cr, uid, p_data['schedule_id'][0],
                 ['contract_ids', 'tz'], context=context)
 
+        # Attach payroll register to this pay period before creating its
+        # pay slips.
+        period_obj.write(cr, uid, period_id, {
+                         'register_id': register_id}, context=context)
+
         # Create payslips for employees, in all departments,
         # that have a contract in this
         # pay period's schedule
@@ -905,13 +779,6 @@ class payroll_period_end_1(orm.TransientModel):
             cr, uid, register_id, department_ids, s_data['contract_ids'],
             s_data['tz'], context=context)
 
-        # Attach payroll register to this pay period
-        period_obj.write(cr, uid, period_id, {
-                         'register_id': register_id}, context=context)
-
-        # Trigger re-calculation of exact change
-        self._change_res['done'] = False
-
         # Mark the pay period as being in the payroll generation stage
         netsvc.LocalService('workflow').trg_validate(
             uid, 'hr.payroll.period', period_id, 'generate_payslips', cr)
@@ -925,9 +792,60 @@ class payroll_period_end_1(orm.TransientModel):
             'context': context
         }
 
+    def _get_department_contracts(
+            self, cr, uid, dept_ids, contract_ids, context=None):
+        """Return a dictionary of the contracts (among contract_ids) of each
+        department in dept_ids, by employee. A contract belongs to the
+        department of the contract, of its employee, of its job and of
+        its end job.
+        """
+
+        contract_obj = self.pool.get('hr.contract')
+        c_data = contract_obj.read(
+            cr, uid, contract_ids,
+            ['employee_id', 'department_id', 'job_id', 'end_job_id'],
+            context=context)
+
+        ee_ids = list(set(d['employee_id'][0] for d in c_data))
+        ee_depts = dict(
+            (d['id'], d['department_id'] and d['department_id'][0])
+            for d in self.pool.get('hr.employee').read(
+                cr, uid, ee_ids, ['department_id'], context=context))
+        job_ids = set()
+        for data in c_data:
+            for f in ['job_id', 'end_job_id']:
+                if data[f]:
+                    job_ids.add(data[f][0])
+        job_depts = dict(
+            (d['id'], d['department_id'] and d['department_id'][0])
+            for d in self.pool.get('hr.job').read(
+                cr, uid, list(job_ids), ['department_id'], context=context))
+
+        res = dict((dept_id, {}) for dept_id in dept_ids)
+        for data in c_data:
+            ee_id = data['employee_id'][0]
+            c_depts = set([
+                data['department_id'] and data['department_id'][0],
+                ee_depts.get(ee_id),
+                data['job_id'] and job_depts.get(data['job_id'][0]),
+                data['end_job_id'] and job_depts.get(data['end_job_id'][0]),
+            ])
+            for dept_id in c_depts:
+                if dept_id in res:
+                    res[dept_id].setdefault(ee_id, []).append(data['id'])
+        return res
+
     def create_payslip_runs(
         self, cr, uid, register_id, dept_ids, contract_ids, tz, context=None
     ):
+        """Create a pay slip batch (run) for each department, with a pay slip
+        for each employee that has a contract in the pay period schedule.
+        The pay slips are created in chunks, in the transaction of the
+        wizard, and then computed by the register. The progress of the
+        creation is logged; the register records the pay slips computed,
+        which shows while it runs only when they are computed by its cron
+        (see hr_payroll_register.compute_workers).
+        """
 
         contract_obj = self.pool.get('hr.contract')
         dept_obj = self.pool.get('hr.department')
@@ -937,6 +855,10 @@ class payroll_period_end_1(orm.TransientModel):
         reg_obj = self.pool.get('hr.payroll.register')
         pr = reg_obj.browse(cr, uid, register_id, context=context)
 
+        chunk_size = int(self.pool.get('ir.config_parameter').get_param(
+            cr, uid, 'hr_payroll_period.payslip_chunk_size',
+            default=PAYSLIP_CHUNK_SIZE, context=context))
+
         # DateTime in db is store as naive UTC. Convert it to explicit UTC
         # and then convert
         # that into the time zone of the pay period schedule.
@@ -952,59 +874,53 @@ class payroll_period_end_1(orm.TransientModel):
         loclDTEnd = utcDTEnd.astimezone(local_tz)
         date_end = loclDTEnd.strftime('%Y-%m-%d')
 
-        # Get Pay Slip Amendments, Employee ID, and the amount of the amendment
+        # Get Pay Slip Amendments amounts by employee and input code. The
+        # first amendment for an input wins.
         #
-        psa_codes = []
+        amendments = {}
         psa_ids = self._get_confirmed_amendments(cr, uid, context)
         for psa in self.pool.get('hr.payslip.amendment').browse(
             cr, uid, psa_ids, context=context
         ):
-            psa_codes.append(
-                (psa.employee_id.id, psa.input_id.code, psa.amount))
+            amendments.setdefault(
+                (psa.employee_id.id, psa.input_id.code), psa.amount)
+
+        # Contracts of the pay period schedule in each department
+        #
+        dept_contracts = self._get_department_contracts(
+            cr, uid, dept_ids, contract_ids, context=context)
+        all_ee_ids = set()
+        for contracts_dict in dept_contracts.itervalues():
+            all_ee_ids.update(contracts_dict)
+        if not all_ee_ids:
+            return
 
-        # Keep track of employees that have already been included
-        seen_ee_ids = []
+        # Alphabetize
+        sorted_ee_ids = ee_obj.search(
+            cr, uid, [('id', 'in', list(all_ee_ids))], context=context)
 
-        # Create payslip batch (run) for each department
+        # All the contracts of the employees, in the same order as the
+        # employees' contract_ids
         #
+        ee_contracts = dict((ee_id, []) for ee_id in sorted_ee_ids)
+        c_ids = contract_obj.search(
+            cr, uid, [('employee_id', 'in', sorted_ee_ids)], context=context)
+        for data in contract_obj.read(
+                cr, uid, c_ids, ['employee_id', 'date_start', 'date_end'],
+                context=context):
+            ee_contracts[data['employee_id'][0]].append(data)
+
+        # Create payslip batch (run) for each department, and make a list
+        # of the pay slips to create for each employee in each department
+        # that has a contract in the pay period schedule of this pay period
+        #
+        seen_ee_ids = set()
+        slips = []
         for dept in dept_obj.browse(cr, uid, dept_ids, context=context):
-            ee_ids = []
-            contracts_dict = {}
-            c_ids = contract_obj.search(cr, uid, [
-                ('id', 'in', contract_ids),
-                '|',
-                ('department_id.id', '=', dept.id),
-                ('employee_id.department_id.id', '=', dept.id)
-            ], context=context)
-            c2_ids = contract_obj.search(
-                cr, uid, [
-                    ('id', 'in', contract_ids),
-                    '|',
-                    ('job_id.department_id.id', '=', dept.id),
-                    ('end_job_id.department_id.id', '=', dept.id),
-                ], context=context)
-            for i in c2_ids:
-                if i not in c_ids:
-                    c_ids.append(i)
-
-            c_data = contract_obj.read(
-                cr, uid, c_ids, ['employee_id'], context=context)
-            for data in c_data:
-                if contracts_dict.get(data['employee_id'][0], False):
-                    contracts_dict[data['employee_id'][0]].append(data['id'])
-                else:
-                    contracts_dict.update(
-                        {data['employee_id'][0]: [data['id']]})
-                if data['employee_id'][0] not in ee_ids:
-                    ee_ids.append(data['employee_id'][0])
-
-            if len(ee_ids) == 0:
+            contracts_dict = dept_contracts[dept.id]
+            if not contracts_dict:
                 continue
 
-            # Alphabetize
-            ee_ids = ee_obj.search(
-                cr, uid, [('id', 'in', ee_ids)], context=context)
-
             run_res = {
                 'name': dept.complete_name,
                 'date_start': date_start,
@@ -1013,32 +929,28 @@ class payroll_period_end_1(orm.TransientModel):
             }
             run_id = run_obj.create(cr, uid, run_res, context=context)
 
-            # Create a pay slip for each employee in each department that has
-            # a contract in the pay period schedule of this pay period
-            #
-            slip_ids = []
-            for ee in ee_obj.browse(cr, uid, ee_ids, context=context):
+            for ee_id in sorted_ee_ids:
 
-                if ee.id in seen_ee_ids:
+                if ee_id not in contracts_dict or ee_id in seen_ee_ids:
                     continue
 
                 found_contract = False
-                for contract in ee.contract_ids:
+                for contract in ee_contracts[ee_id]:
 
                     # Does employee have a contract in this pay period?
                     #
                     dContractStart = datetime.strptime(
-                        contract.date_start, OEDATE_FORMAT).date()
+                        contract['date_start'], OEDATE_FORMAT).date()
                     dContractEnd = loclDTEnd.date()
-                    if contract.date_end:
+                    if contract['date_end']:
                         dContractEnd = datetime.strptime(
-                            contract.date_end, OEDATE_FORMAT).date()
+                            contract['date_end'], OEDATE_FORMAT).date()
                     if (
                         dContractStart > loclDTEnd.date()
                         or dContractEnd < loclDTStart.date()
                     ):
                         continue
-                    elif contract.id in contracts_dict[ee.id]:
+                    elif contract['id'] in contracts_dict[ee_id]:
                         found_contract = contract
                         break
                 if not found_contract:
@@ -1050,59 +962,61 @@ class payroll_period_end_1(orm.TransientModel):
                 #
                 temp_date_start = date_start
                 temp_date_end = date_end
-                if dContractStart > datetime.strptime(
-                    date_start, OEDATE_FORMAT
-                ).date():
+                if dContractStart > loclDTStart.date():
                     temp_date_start = dContractStart.strftime(OEDATE_FORMAT)
                 if (
-                    found_contract.date_end
-                    and dContractEnd < datetime.strptime(
-                        date_end, OEDATE_FORMAT).date()
+                    found_contract['date_end']
+                    and dContractEnd < loclDTEnd.date()
                 ):
                     temp_date_end = dContractEnd.strftime(OEDATE_FORMAT)
 
-                slip_data = slip_obj.onchange_employee_id(
-                    cr, uid, [],
-                    temp_date_start, temp_date_end,
-                    ee.id, contract_id=False,
-                    context=context)
+                slips.append((run_id, ee_id, temp_date_start, temp_date_end))
+                seen_ee_ids.add(ee_id)
+
+        reg_obj.write(cr, uid, register_id, {
+            'slips_total': len(slips),
+            'slips_computed': 0,
+            'compute_errors': False,
+        }, context=context)
+
+        for i in xrange(0, len(slips), chunk_size):
+            chunk = slips[i:i + chunk_size]
+            slips_values = slip_obj.get_payslips_values(
+                cr, uid, [(ee_id, ds, de) for run_id, ee_id, ds, de in chunk],
+                context=context)
+
+            for (run_id, ee_id, ds, de), vals in zip(chunk, slips_values):
 
                 # Make modifications to rule inputs
                 #
-                for line in slip_data['value'].get('input_line_ids', False):
+                for line in vals['input_line_ids']:
 
                     # Pay Slip Amendment modifications
-                    for eid, code, amount in psa_codes:
-                        if eid == ee.id and line['code'] == code:
-                            line['amount'] = amount
-                            break
+                    if (ee_id, line['code']) in amendments:
+                        line['amount'] = amendments[(ee_id, line['code'])]
 
                 res = {
-                    'employee_id': ee.id,
-                    'name': slip_data['value'].get('name', False),
-                    'struct_id': slip_data['value'].get('struct_id', False),
-                    'contract_id': slip_data['value'].get(
-                        'contract_id', False),
+                    'employee_id': ee_id,
+                    'name': vals['name'],
+                    'struct_id': vals['struct_id'],
+                    'contract_id': vals['contract_id'],
                     'payslip_run_id': run_id,
                     'input_line_ids': [
-                        (0, 0, x) for x in slip_data['value'].get(
-                            'input_line_ids', False)
+                        (0, 0, x) for x in vals['input_line_ids']
                     ],
                     'worked_days_line_ids': [
-                        (0, 0, x)
-                        for x
-                        in slip_data['value'].get(
-                            'worked_days_line_ids', False)
+                        (0, 0, x) for x in vals['worked_days_line_ids']
                     ],
                     'date_from': date_start,
                     'date_to': date_end
                 }
-                slip_ids.append(slip_obj.create(cr, uid, res, context=context))
+                slip_obj.create(cr, uid, res, context=context)
 
-                seen_ee_ids.append(ee.id)
+            _logger.info('Payroll register %s: created %d of %d pay slips',
+                         register_id, i + len(chunk), len(slips))
 
-            # Calculate payroll for all the pay slips in this batch (run)
-            slip_obj.compute_sheet(cr, uid, slip_ids, context=context)
+        # Calculate payroll for all the pay slips of the register
+        reg_obj.compute_slips(cr, uid, [register_id], context=context)
 
         return
 
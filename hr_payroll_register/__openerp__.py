@@ -36,6 +36,8 @@ Payroll Register
     ],
     'data': [
         'security/ir.model.access.csv',
+        'data/hr_payroll_register_data.xml',
+        'hr_payroll_register_cron.xml',
         'wizard/hr_payroll_register_run_view.xml',
         'hr_payroll_register_report.xml',
         'hr_payroll_register_view.xml',
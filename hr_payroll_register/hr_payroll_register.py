@@ -20,9 +20,140 @@
 #
 
 from datetime import datetime
+import logging
+
+from openerp import api, tools
 from openerp.tools.translate import _
 from openerp.osv import fields, orm
 
+_logger = logging.getLogger(__name__)
+
+# Default number of pay slips per chunk in register computations
+COMPUTE_CHUNK_SIZE = 50
+
+# Number of times a queued chunk of pay slips is computed before it is
+# given up
+COMPUTE_CHUNK_MAX_ATTEMPTS = 3
+
+
+class hr_payslip(orm.Model):
+
+    _name = 'hr.payslip'
+    _inherit = 'hr.payslip'
+
+    def _get_employees_contracts(
+            self, cr, uid, employee_ids, date_from, date_to, context=None):
+        """Return the ids of the contracts get_contract() finds for each of
+        employee_ids, as a dictionary keyed by employee, with one search.
+        """
+
+        contract_obj = self.pool.get('hr.contract')
+        clause_1 = ['&', ('date_end', '<=', date_to),
+                    ('date_end', '>=', date_from)]
+        clause_2 = ['&', ('date_start', '<=', date_to),
+                    ('date_start', '>=', date_from)]
+        clause_3 = ['&', ('date_start', '<=', date_from),
+                    '|', ('date_end', '=', False),
+                    ('date_end', '>=', date_to)]
+        contract_ids = contract_obj.search(
+            cr, uid,
+            [('employee_id', 'in', employee_ids), '|', '|'] +
+            clause_1 + clause_2 + clause_3,
+            context=context)
+
+        res = {}
+        for data in contract_obj.read(
+                cr, uid, contract_ids, ['employee_id'], context=context):
+            res.setdefault(data['employee_id'][0], []).append(data['id'])
+        return res
+
+    def get_payslips_values(self, cr, uid, slips, context=None):
+        """Return the values onchange_employee_id() fills in for each of
+        slips, a list of (employee id, date_from, date_to) tuples, in the
+        same order. The contracts and worked days are computed once for
+        all the employees with the same dates, and the inputs once per
+        set of salary structures.
+        """
+
+        contract_obj = self.pool.get('hr.contract')
+        employees = dict(
+            (ee.id, ee) for ee in self.pool.get('hr.employee').browse(
+                cr, uid, list(set(s[0] for s in slips)), context=context))
+
+        dates = {}
+        for i, (ee_id, date_from, date_to) in enumerate(slips):
+            dates.setdefault((date_from, date_to), []).append(i)
+
+        res = [None] * len(slips)
+        inputs_cache = {}
+        for (date_from, date_to), indexes in dates.iteritems():
+            ee_contracts = self._get_employees_contracts(
+                cr, uid, [slips[i][0] for i in indexes], date_from, date_to,
+                context=context)
+            structs = {}
+            for contract in contract_obj.browse(
+                    cr, uid, [c_id for c_ids in ee_contracts.itervalues()
+                              for c_id in c_ids],
+                    context=context):
+                structs[contract.id] = contract.struct_id.id
+
+            # Worked days of all the contracts, split back per contract
+            wd_contract_ids = []
+            for c_ids in ee_contracts.itervalues():
+                if structs[c_ids[0]]:
+                    wd_contract_ids += c_ids
+            worked_days = {}
+            if wd_contract_ids:
+                for line in self.get_worked_day_lines(
+                        cr, uid, wd_contract_ids, date_from, date_to,
+                        context=context):
+                    worked_days.setdefault(
+                        line['contract_id'], []).append(line)
+
+            ttyme = datetime.strptime(date_from, '%Y-%m-%d')
+            for i in indexes:
+                ee = employees[slips[i][0]]
+                vals = {
+                    'name': _('Salary Slip of %s for %s') % (
+                        ee.name, tools.ustr(ttyme.strftime('%B-%Y'))),
+                    'contract_id': False,
+                    'struct_id': False,
+                    'worked_days_line_ids': [],
+                    'input_line_ids': [],
+                }
+                res[i] = vals
+                c_ids = ee_contracts.get(ee.id)
+                if not c_ids:
+                    continue
+                vals['contract_id'] = c_ids[0]
+                if not structs[c_ids[0]]:
+                    continue
+                vals['struct_id'] = structs[c_ids[0]]
+                for c_id in c_ids:
+                    vals['worked_days_line_ids'] += worked_days.get(c_id, [])
+
+                # The inputs only depend on the structures of the contracts
+                key = (date_from, date_to,
+                       frozenset(structs[c_id] for c_id in c_ids))
+                if key not in inputs_cache:
+                    lines = self.get_inputs(
+                        cr, uid, c_ids, date_from, date_to, context=context)
+                    # Every contract gets the inputs of the structures
+                    # of all the contracts, keep the ones of the first
+                    by_contract = {}
+                    for line in lines:
+                        by_contract.setdefault(
+                            line['contract_id'], []).append(
+                                (line['name'], line['code']))
+                    inputs_cache[key] = by_contract.get(c_ids[0], [])
+                vals['input_line_ids'] = [
+                    {'name': name, 'code': code, 'contract_id': c_id}
+                    for c_id in c_ids
+                    for name, code in inputs_cache[key]
+                ]
+
+        return res
+
 
 class hr_payroll_run(orm.Model):
 
@@ -57,6 +188,12 @@ class hr_payroll_register(orm.Model):
             states={'draft': [('readonly', False)]}
         ),
         'company_id': fields.many2one('res.company', 'Company'),
+        'slips_total': fields.integer(
+            'Pay Slips to Compute', readonly=True),
+        'slips_computed': fields.integer(
+            'Pay Slips Computed', readonly=True),
+        'compute_errors': fields.text(
+            'Computation Errors', readonly=True),
     }
 
     _sql_constraints = [
@@ -93,3 +230,261 @@ class hr_payroll_register(orm.Model):
             cr, uid, [('register_id', 'in', ids)], context=context)
         pool.unlink(cr, uid, ids, context=context)
         return True
+
+    def _compute_slips_chunk(self, cr, uid, register_id, slip_ids,
+                             context=None):
+        """Compute the pay slips of a chunk in the current transaction. If
+        the chunk fails, its slips are computed one by one, each under a
+        savepoint, so that only the failing ones are left out. Returns a
+        list of (slip id, error message) for them.
+        """
+
+        slip_obj = self.pool.get('hr.payslip')
+        try:
+            with cr.savepoint():
+                slip_obj.compute_sheet(cr, uid, slip_ids, context=context)
+            return []
+        except Exception:
+            _logger.exception(
+                'Failed to compute pay slips %s, retrying them one by one',
+                slip_ids)
+
+        errors = []
+        for slip_id in slip_ids:
+            try:
+                with cr.savepoint():
+                    slip_obj.compute_sheet(
+                        cr, uid, [slip_id], context=context)
+            except Exception as e:
+                errors.append((slip_id, tools.ustr(e)))
+        return errors
+
+    def _record_computed_slips(self, cr, uid, register_id, count, errors,
+                               context=None):
+        """Add count to the pay slips computed by a register, and errors to
+        its computation errors. Chunks computed concurrently only add to
+        the register's figures.
+        """
+
+        msg = None
+        if errors:
+            names = dict(self.pool.get('hr.payslip').name_get(
+                cr, uid, [slip_id for slip_id, e in errors],
+                context=context))
+            msg = '\n'.join('%s: %s' % (names.get(slip_id, slip_id), e)
+                            for slip_id, e in errors)
+            _logger.warning('Payroll register %s: %d pay slips could not be '
+                            'computed', register_id, len(errors))
+        cr.execute("""\
+UPDATE hr_payroll_register
+SET slips_computed = COALESCE(slips_computed, 0) + %s,
+    compute_errors = CASE WHEN %s IS NULL THEN compute_errors
+                          WHEN compute_errors IS NULL THEN %s
+                          ELSE compute_errors || E'\\n' || %s
+                     END
+WHERE id = %s""", (count, msg, msg, msg, register_id))
+
+    def compute_slips(self, cr, uid, ids, slip_ids=None, chunk_size=None,
+                      workers=None, context=None):
+        """Compute the pay slips of the registers (or only slip_ids) in
+        chunks, in the order of the runs and pay slips. Slips that fail
+        are left out and listed in the register's computation errors,
+        without rolling back the others.
+
+        With a single worker the chunks are computed in the current
+        transaction, and the errors are returned. With more than one, the
+        chunks are queued as hr.payroll.register.chunk records: once the
+        current transaction is committed, the Compute Payroll Registers
+        crons compute them in parallel cron workers, each chunk with a
+        cursor of its own.
+        """
+
+        param_obj = self.pool.get('ir.config_parameter')
+        slip_obj = self.pool.get('hr.payslip')
+        chunk_obj = self.pool.get('hr.payroll.register.chunk')
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if chunk_size is None:
+            chunk_size = int(param_obj.get_param(
+                cr, uid, 'hr_payroll_register.compute_chunk_size',
+                default=COMPUTE_CHUNK_SIZE, context=context))
+        if workers is None:
+            workers = int(param_obj.get_param(
+                cr, uid, 'hr_payroll_register.compute_workers',
+                default=1, context=context))
+        chunk_size = max(chunk_size, 1)
+
+        errors = []
+        for register_id in ids:
+            domain = [('payslip_run_id.register_id', '=', register_id)]
+            if slip_ids is not None:
+                domain.append(('id', 'in', slip_ids))
+            register_slip_ids = slip_obj.search(
+                cr, uid, domain, order='payslip_run_id, id', context=context)
+            chunks = [
+                register_slip_ids[i:i + chunk_size]
+                for i in xrange(0, len(register_slip_ids), chunk_size)
+            ]
+
+            self.write(cr, uid, [register_id], {
+                'slips_total': len(register_slip_ids),
+                'slips_computed': 0,
+                'compute_errors': False,
+            }, context=context)
+
+            if workers > 1 and len(chunks) > 1:
+                for sequence, chunk in enumerate(chunks):
+                    chunk_obj.create(cr, uid, {
+                        'register_id': register_id,
+                        'sequence': sequence + 1,
+                        'slip_ids': [(6, 0, chunk)],
+                    }, context=context)
+                continue
+
+            for chunk in chunks:
+                chunk_errors = self._compute_slips_chunk(
+                    cr, uid, register_id, chunk, context=context)
+                self._record_computed_slips(
+                    cr, uid, register_id, len(chunk) - len(chunk_errors),
+                    chunk_errors, context=context)
+                errors += chunk_errors
+
+        return errors
+
+    def _claim_compute_chunk(self, cr, uid, tried_ids, context=None):
+        """Lock the next queued chunk that no other worker is computing and
+        that is not in tried_ids, and return its id, or None if there is
+        none left.
+        """
+
+        cr.execute("""\
+SELECT id
+FROM hr_payroll_register_chunk
+WHERE state IN ('pending', 'failed')
+  AND NOT id = ANY(%s)
+ORDER BY register_id, sequence
+LIMIT 1
+FOR UPDATE SKIP LOCKED""", (list(tried_ids),))
+        row = cr.fetchone()
+        return row and row[0] or None
+
+    def _run_compute_chunk(self, cr, uid, chunk_id, context=None):
+        """Compute a claimed chunk in the transaction of cr and commit it.
+        If the transaction fails, it is rolled back and the chunk is tried
+        again by the next runs of the cron, up to
+        COMPUTE_CHUNK_MAX_ATTEMPTS times.
+        """
+
+        chunk_obj = self.pool.get('hr.payroll.register.chunk')
+
+        try:
+            chunk = chunk_obj.browse(cr, uid, chunk_id, context=context)
+            register_id = chunk.register_id.id
+            slip_ids = [slip.id for slip in chunk.slip_ids]
+            chunk_errors = self._compute_slips_chunk(
+                cr, uid, register_id, slip_ids, context=context)
+            self._record_computed_slips(
+                cr, uid, register_id, len(slip_ids) - len(chunk_errors),
+                chunk_errors, context=context)
+            chunk_obj.write(cr, uid, chunk_id, {
+                'state': 'done',
+                'message': False,
+            }, context=context)
+            cr.commit()
+        except Exception as e:
+            cr.rollback()
+            _logger.exception('Payroll register: chunk %s failed', chunk_id)
+            attempts = chunk_obj.read(
+                cr, uid, chunk_id, ['attempts'],
+                context=context)['attempts'] + 1
+            chunk_obj.write(cr, uid, chunk_id, {
+                'attempts': attempts,
+                'state': (attempts >= COMPUTE_CHUNK_MAX_ATTEMPTS
+                          and 'error' or 'failed'),
+                'message': tools.ustr(e),
+            }, context=context)
+            cr.commit()
+
+    def process_compute_chunks(self, cr, uid, context=None):
+        """Compute the queued chunks of pay slips, in order, until none is
+        left. Called from the scheduler.
+
+        Each chunk is claimed with a row lock that other workers skip, and
+        computed and committed with a cursor of its own, so that the
+        Compute Payroll Registers crons share the queue. They run in
+        parallel in as many processes as the server has cron workers
+        (max_cron_threads, with --workers set for multi-processing).
+        """
+
+        # Chunks that fail are left to the next run of the cron, not taken
+        # again by this one
+        tried_ids = set()
+        while True:
+            with api.Environment.manage():
+                new_cr = self.pool.cursor()
+                try:
+                    chunk_id = self._claim_compute_chunk(
+                        new_cr, uid, tried_ids, context=context)
+                    if chunk_id is None:
+                        break
+                    tried_ids.add(chunk_id)
+                    self._run_compute_chunk(
+                        new_cr, uid, chunk_id, context=context)
+                finally:
+                    new_cr.close()
+
+        return True
+
+
+class hr_payroll_register_chunk(orm.Model):
+
+    _name = 'hr.payroll.register.chunk'
+    _description = 'Payroll Register Computation Chunk'
+    _order = 'register_id, sequence'
+
+    _columns = {
+        'register_id': fields.many2one(
+            'hr.payroll.register',
+            'Register',
+            required=True,
+            ondelete='cascade',
+            readonly=True,
+        ),
+        'sequence': fields.integer(
+            'Sequence',
+            required=True,
+            readonly=True,
+        ),
+        'slip_ids': fields.many2many(
+            'hr.payslip',
+            'hr_payroll_register_chunk_payslip_rel',
+            'chunk_id',
+            'slip_id',
+            'Pay Slips',
+            readonly=True,
+        ),
+        'attempts': fields.integer(
+            'Failed Attempts',
+            readonly=True,
+        ),
+        'message': fields.text(
+            'Error',
+            readonly=True,
+        ),
+        'state': fields.selection(
+            [
+                ('pending', 'Pending'),
+                ('done', 'Done'),
+                ('failed', 'Failed'),
+                ('error', 'Given Up'),
+            ],
+            'State',
+            required=True,
+            readonly=True,
+        ),
+    }
+    _defaults = {
+        'state': 'pending',
+        'attempts': 0,
+    }
@@ -24,9 +24,113 @@
 import time
 from datetime import datetime
 
+from collections import OrderedDict
+
 from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OE_DATEFORMAT
 from report import report_sxw
 
+# Report columns filled by the salary rule categories and pay slip lines
+# with these codes
+SUMMARY_COLUMNS = {
+    'BASIC': 'salary',
+    'OT': 'ot',
+    'TRA': 'transportation',
+    'TRVA': 'transportation',
+    'ALW': 'allowances',
+    'TXBL': 'taxable_gross',
+    'GROSS': 'gross',
+    'FITCALC': 'fit',
+    'PENFEE': 'ee_pension',
+    'DED': 'deductions',
+    'DEDTOTAL': 'deductions_total',
+    'NET': 'net',
+    'ER': 'er_contributions',
+}
+PAYSLIP_COLUMNS = dict(
+    SUMMARY_COLUMNS,
+    BONUS='bonus',
+    PI='bonus',
+    BUNCH='bonus',
+    LVANNUAL='LVANNUAL',
+)
+
+# Columns only filled by top-level categories
+ROOT_COLUMNS = ('salary',)
+
+
+class payslip_line_totals(object):
+    """Totals of the report columns of pay slips, computed from one
+    grouped query on their lines.
+
+    columns maps the codes of salary rule categories and pay slip lines to
+    the report column they fill. As in the Pay Slip Details Report, each
+    category of a pay slip (in the order of its first line) fills its
+    column and those of its parent categories with the total of its own
+    lines, then its lines fill their columns. The last value of a column
+    wins.
+    """
+
+    def __init__(self, cr, slip_ids, columns, root_columns=()):
+
+        self.columns = set(columns.itervalues())
+        self.values = {}
+        self.contract_ids = {}
+        if not slip_ids:
+            return
+
+        # The columns filled by each category, resolved once from the
+        # category tree
+        cr.execute('SELECT id, parent_id, code FROM hr_salary_rule_category')
+        categories = dict((r[0], (r[1], r[2])) for r in cr.fetchall())
+        category_columns = {}
+        for category_id in categories:
+            codes = []
+            parent_id = category_id
+            while parent_id and len(codes) <= len(categories):
+                parent_id, code = categories[parent_id]
+                codes.insert(0, code)
+            category_columns[category_id] = [
+                columns[code] for level, code in enumerate(codes)
+                if code in columns
+                and (level == 0 or columns[code] not in root_columns)
+            ]
+        line_columns = dict(
+            (code, column) for code, column in columns.iteritems()
+            if column not in root_columns)
+
+        cr.execute("""\
+SELECT slip_id, category_id, code, contract_id, sum(total),
+       min(sequence) AS sequence
+FROM hr_payslip_line
+WHERE slip_id IN %s
+GROUP BY slip_id, category_id, code, contract_id
+ORDER BY slip_id, sequence""", (tuple(slip_ids),))
+        lines = {}
+        for slip_id, category_id, code, contract_id, total, sequence \
+                in cr.fetchall():
+            lines.setdefault(slip_id, OrderedDict()).setdefault(
+                category_id, []).append((code, total or 0.0))
+            contract_ids = self.contract_ids.setdefault(slip_id, [])
+            if contract_id and contract_id not in contract_ids:
+                contract_ids.append(contract_id)
+
+        for slip_id, slip_lines in lines.iteritems():
+            values = self.values[slip_id] = {}
+            for category_id, category_lines in slip_lines.iteritems():
+                category_total = sum(total for code, total in category_lines)
+                for column in category_columns.get(category_id, []):
+                    values[column] = category_total
+                for code, total in category_lines:
+                    if code in line_columns:
+                        values[line_columns[code]] = total
+
+    def get(self, slip_id):
+        """Return the values of all the columns for a pay slip."""
+
+        res = dict.fromkeys(self.columns, 0)
+        res.update(self.values.get(slip_id, {}))
+        return res
+
 
 class report_payroll_summary(report_sxw.rml_parse):
 
@@ -67,14 +171,30 @@ class report_payroll_summary(report_sxw.rml_parse):
 
     def get_details_by_run(self, runs):
 
+        slip_ids = {}
+        if runs:
+            self.cr.execute(
+                'SELECT payslip_run_id, id FROM hr_payslip '
+                'WHERE payslip_run_id IN %s', (tuple(r.id for r in runs),))
+            for run_id, slip_id in self.cr.fetchall():
+                slip_ids.setdefault(run_id, []).append(slip_id)
+        lines = payslip_line_totals(
+            self.cr, [i for ids in slip_ids.itervalues() for i in ids],
+            SUMMARY_COLUMNS, ROOT_COLUMNS)
+
         res = []
         for run in runs:
-            subtotal = self.get_subtotal_by_payslip(run.slip_ids)
+            subtotal = self.get_subtotal_by_payslip(
+                slip_ids.get(run.id, []), lines)
             subtotal['name'] = run.name
             res.append(subtotal)
         return res
 
-    def get_subtotal_by_payslip(self, payslips):
+    def get_subtotal_by_payslip(self, slip_ids, lines=None):
+
+        if lines is None:
+            lines = payslip_line_totals(
+                self.cr, slip_ids, SUMMARY_COLUMNS, ROOT_COLUMNS)
 
         subtotal = {
             'name': '',
@@ -92,9 +212,8 @@ class report_payroll_summary(report_sxw.rml_parse):
             'net': 0,
             'er_contributions': 0,
         }
-        for slip in payslips:
-            tmp = self.get_details_by_rule_category(
-                slip.details_by_salary_rule_category)
+        for slip_id in slip_ids:
+            tmp = self.get_details_by_slip(lines, slip_id)
 
             # Increase subtotal
             #
@@ -113,133 +232,34 @@ class report_payroll_summary(report_sxw.rml_parse):
 
         return subtotal
 
-    # Most of this function (except at the end) is copied verbatim from
-    # the Pay Slip Details Report
-    #
-    def get_details_by_rule_category(self, obj):
-        payslip_line = self.pool.get('hr.payslip.line')
-        rule_cate_obj = self.pool.get('hr.salary.rule.category')
-
-        def get_recursive_parent(rule_categories):
-            if not rule_categories:
-                return []
-            if rule_categories[0].parent_id:
-                rule_categories.insert(0, rule_categories[0].parent_id)
-                get_recursive_parent(rule_categories)
-            return rule_categories
-
-        res = []
-        result = {}
-        ids = []
+    def get_details_by_slip(self, lines, slip_id):
 
-        # Choose only the categories (or rules) that we want to
-        # show in the report.
-        #
-        reg_line = {
+        reg_line = lines.get(slip_id)
+        reg_line.update({
             'name': '',
             'id_no': '',
-            'salary': 0,
-            'ot': 0,
-            'transportation': 0,
-            'allowances': 0,
-            'taxable_gross': 0,
-            'gross': 0,
-            'fit': 0,
-            'ee_pension': 0,
-            'deductions': 0,
-            'deductions_total': 0,
-            'net': 0,
-            'er_contributions': 0,
-        }
+        })
 
-        # Arrange the Pay Slip Lines by category
+        # Make adjustments to subtract from the parent category's total the
+        # amount of individual rules that we show separately on the sheet.
         #
-        for id in range(len(obj)):
-            ids.append(obj[id].id)
-        if ids:
-            self.cr.execute('''
-                SELECT pl.id, pl.category_id FROM hr_payslip_line as pl
-                LEFT JOIN hr_salary_rule_category AS rc
-                on (pl.category_id = rc.id)
-                WHERE pl.id in %s
-                GROUP BY rc.parent_id, pl.sequence, pl.id, pl.category_id
-                ORDER BY pl.sequence, rc.parent_id''', (tuple(ids),))
-            for x in self.cr.fetchall():
-                result.setdefault(x[1], [])
-                result[x[1]].append(x[0])
-            for key, value in result.iteritems():
-                rule_categories = rule_cate_obj.browse(
-                    self.cr, self.uid, [key])
-                parents = get_recursive_parent(rule_categories)
-                category_total = 0
-                for line in payslip_line.browse(self.cr, self.uid, value):
-                    category_total += line.total
-                level = 0
-                for parent in parents:
-                    res.append({
-                        'rule_category': parent.name,
-                        'name': parent.name,
-                        'code': parent.code,
-                        'level': level,
-                        'total': category_total,
-                    })
-                    level += 1
-                for line in payslip_line.browse(self.cr, self.uid, value):
-                    res.append({
-                        'rule_category': line.name,
-                        'name': line.name,
-                        'code': line.code,
-                        'total': line.total,
-                        'level': level
-                    })
-
-            for r in res:
-                # Level 0 is the category
-                if r['code'] == 'BASIC' and r['level'] == 0:
-                    reg_line['salary'] = r['total']
-                elif r['code'] == 'OT':
-                    reg_line['ot'] = r['total']
-                elif r['code'] == 'TRA' or r['code'] == 'TRVA':
-                    reg_line['transportation'] = r['total']
-                elif r['code'] == 'ALW':
-                    reg_line['allowances'] = r['total']
-                elif r['code'] == 'TXBL':
-                    reg_line['taxable_gross'] = r['total']
-                elif r['code'] == 'GROSS':
-                    reg_line['gross'] = r['total']
-                elif r['code'] == 'FITCALC':
-                    reg_line['fit'] = r['total']
-                elif r['code'] == 'PENFEE':
-                    reg_line['ee_pension'] = r['total']
-                elif r['code'] == 'DED':
-                    reg_line['deductions'] = r['total']
-                elif r['code'] == 'DEDTOTAL':
-                    reg_line['deductions_total'] = r['total']
-                elif r['code'] == 'NET':
-                    reg_line['net'] = r['total']
-                elif r['code'] == 'ER':
-                    reg_line['er_contributions'] = r['total']
-
-            # Make adjustments to subtract from the parent category's total the
-            # amount of individual rules that we show separately on the sheet.
-            #
-            reg_line['allowances'] -= reg_line['transportation']
-            reg_line['deductions'] -= reg_line['ee_pension']
+        reg_line['allowances'] -= reg_line['transportation']
+        reg_line['deductions'] -= reg_line['ee_pension']
 
-            # Increase running totals
-            #
-            self.salary += reg_line['salary']
-            self.ot += reg_line['ot']
-            self.transportation += reg_line['transportation']
-            self.allowances += reg_line['allowances']
-            self.gross += reg_line['gross']
-            self.taxable_gross += reg_line['taxable_gross']
-            self.ded_fit += reg_line['fit']
-            self.ded_pf_ee += reg_line['ee_pension']
-            self.deduct += reg_line['deductions']
-            self.total_deduct += reg_line['deductions_total']
-            self.net += reg_line['net']
-            self.er_contributions += reg_line['er_contributions']
+        # Increase running totals
+        #
+        self.salary += reg_line['salary']
+        self.ot += reg_line['ot']
+        self.transportation += reg_line['transportation']
+        self.allowances += reg_line['allowances']
+        self.gross += reg_line['gross']
+        self.taxable_gross += reg_line['taxable_gross']
+        self.ded_fit += reg_line['fit']
+        self.ded_pf_ee += reg_line['ee_pension']
+        self.deduct += reg_line['deductions']
+        self.total_deduct += reg_line['deductions_total']
+        self.net += reg_line['net']
+        self.er_contributions += reg_line['er_contributions']
 
         return reg_line
 
@@ -329,10 +349,13 @@ class report_payslips(report_sxw.rml_parse):
 
         accrual_obj = self.pool.get('hr.accrual')
 
+        lines = payslip_line_totals(
+            self.cr, [slip.id for slip in payslips], PAYSLIP_COLUMNS,
+            ROOT_COLUMNS)
+
         res = []
         for slip in payslips:
-            tmp, contract_ids = self.get_details_by_rule_category(
-                slip.details_by_salary_rule_category)
+            tmp, contract_ids = self.get_details_by_slip(lines, slip.id)
 
             tmp['name'] = slip.employee_id.name
             tmp['id_no'] = slip.employee_id.f_employee_no
@@ -352,129 +375,18 @@ class report_payslips(report_sxw.rml_parse):
 
         return res
 
-    # Most of this function (except at the end) is copied verbatim from
-    # the Pay Slip Details Report
-    #
-    def get_details_by_rule_category(self, obj):
-        payslip_line = self.pool.get('hr.payslip.line')
-        rule_cate_obj = self.pool.get('hr.salary.rule.category')
-
-        def get_recursive_parent(rule_categories):
-            if not rule_categories:
-                return []
-            if rule_categories[0].parent_id:
-                rule_categories.insert(0, rule_categories[0].parent_id)
-                get_recursive_parent(rule_categories)
-            return rule_categories
+    def get_details_by_slip(self, lines, slip_id):
 
-        res = []
-        result = {}
-        ids = []
-        contract_ids = []
+        reg_line = lines.get(slip_id)
 
-        # Choose only the categories (or rules) that we want to
-        # show in the report.
+        # Make adjustments to subtract from the parent category's total the
+        # amount of individual rules that we show separately on the sheet.
         #
-        reg_line = {
-            'salary': 0,
-            'ot': 0,
-            'transportation': 0,
-            'bonus': 0,
-            'allowances': 0,
-            'taxable_gross': 0,
-            'gross': 0,
-            'fit': 0,
-            'ee_pension': 0,
-            'deductions': 0,
-            'deductions_total': 0,
-            'net': 0,
-            'er_contributions': 0,
-            'LVANNUAL': 0,
-        }
-
-        # Arrange the Pay Slip Lines by category
-        #
-        for id in range(len(obj)):
-            ids.append(obj[id].id)
-        if ids:
-            self.cr.execute('''
-                SELECT pl.id, pl.category_id FROM hr_payslip_line as pl
-                LEFT JOIN hr_salary_rule_category AS rc
-                on (pl.category_id = rc.id)
-                WHERE pl.id in %s
-                GROUP BY rc.parent_id, pl.sequence, pl.id, pl.category_id
-                ORDER BY pl.sequence, rc.parent_id''', (tuple(ids),))
-            for x in self.cr.fetchall():
-                result.setdefault(x[1], [])
-                result[x[1]].append(x[0])
-            for key, value in result.iteritems():
-                rule_categories = rule_cate_obj.browse(
-                    self.cr, self.uid, [key])
-                parents = get_recursive_parent(rule_categories)
-                category_total = 0
-                for line in payslip_line.browse(self.cr, self.uid, value):
-                    category_total += line.total
-                level = 0
-                for parent in parents:
-                    res.append({
-                        'rule_category': parent.name,
-                        'name': parent.name,
-                        'code': parent.code,
-                        'level': level,
-                        'total': category_total,
-                    })
-                    level += 1
-                for line in payslip_line.browse(self.cr, self.uid, value):
-                    res.append({
-                        'rule_category': line.name,
-                        'name': line.name,
-                        'code': line.code,
-                        'total': line.total,
-                        'level': level
-                    })
-
-                    if line.contract_id.id not in contract_ids:
-                        contract_ids.append(line.contract_id.id)
-
-            for r in res:
-                # Level 0 is the category
-                if r['code'] == 'BASIC' and r['level'] == 0:
-                    reg_line['salary'] = r['total']
-                elif r['code'] == 'OT':
-                    reg_line['ot'] = r['total']
-                elif r['code'] == 'TRA' or r['code'] == 'TRVA':
-                    reg_line['transportation'] = r['total']
-                elif r['code'] in ['BONUS', 'PI', 'BUNCH']:
-                    reg_line['bonus'] = r['total']
-                elif r['code'] == 'ALW':
-                    reg_line['allowances'] = r['total']
-                elif r['code'] == 'TXBL':
-                    reg_line['taxable_gross'] = r['total']
-                elif r['code'] == 'GROSS':
-                    reg_line['gross'] = r['total']
-                elif r['code'] == 'FITCALC':
-                    reg_line['fit'] = r['total']
-                elif r['code'] == 'PENFEE':
-                    reg_line['ee_pension'] = r['total']
-                elif r['code'] == 'DED':
-                    reg_line['deductions'] = r['total']
-                elif r['code'] == 'DEDTOTAL':
-                    reg_line['deductions_total'] = r['total']
-                elif r['code'] == 'NET':
-                    reg_line['net'] = r['total']
-                elif r['code'] == 'ER':
-                    reg_line['er_contributions'] = r['total']
-                elif r['code'] == 'LVANNUAL':
-                    reg_line['LVANNUAL'] = r['total']
-
-            # Make adjustments to subtract from the parent category's total the
-            # amount of individual rules that we show separately on the sheet.
-            #
-            reg_line['allowances'] -= reg_line['transportation']
-            reg_line['allowances'] -= reg_line['bonus']
-            reg_line['deductions'] -= reg_line['ee_pension']
+        reg_line['allowances'] -= reg_line['transportation']
+        reg_line['allowances'] -= reg_line['bonus']
+        reg_line['deductions'] -= reg_line['ee_pension']
 
-        return reg_line, contract_ids
+        return reg_line, lines.contract_ids.get(slip_id, [])
 
 report_sxw.report_sxw(
     'report.hr.payroll.register.payslips',
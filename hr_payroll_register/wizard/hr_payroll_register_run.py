@@ -79,6 +79,7 @@ class payroll_register_run(orm.TransientModel):
         localDTEnd = utcDTEnd.astimezone(local_tz)
         date_end = localDTEnd.strftime('%Y-%m-%d')
 
+        slip_ids = []
         for dept in dept_pool.browse(
             cr, uid, data['department_ids'], context=context
         ):
@@ -90,7 +91,6 @@ class payroll_register_run(orm.TransientModel):
             }
             run_id = run_pool.create(cr, uid, run_res, context=context)
 
-            slip_ids = []
             ee_ids = ee_pool.search(
                 cr, uid, [('department_id', '=', dept.id)],
                 order="name", context=context)
@@ -118,6 +118,8 @@ class payroll_register_run(orm.TransientModel):
                 }
                 slip_ids.append(
                     slip_pool.create(cr, uid, res, context=context))
-            slip_pool.compute_sheet(cr, uid, slip_ids, context=context)
+
+        reg_pool.compute_slips(
+            cr, uid, [register_id], slip_ids=slip_ids, context=context)
 
         return {'type': 'ir.actions.act_window_close'}
@@ -32,39 +32,41 @@ class hr_payslip(orm.Model):
         self.compute_lines_ytd(cr, uid, ids, context=context)
 
     def compute_lines_ytd(self, cr, uid, ids, context=None):
-        for payslip in self.browse(cr, uid, ids, context=context):
-            # Create a dict of the required lines that will be used
-            # to sum amounts over the payslips
-            line_dict = {
-                line.salary_rule_id.code: 0 for line in payslip.line_ids}
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not ids:
+            return
 
-            # Get the payslips of the employee for the current year
-            date_from = payslip.date_from[0:4] + "-01-01"
-
-            employee_payslip_ids = self.search(
-                cr, uid, [
-                    ('employee_id', '=', payslip.employee_id.id),
-                    ('date_from', '>=', date_from),
-                    ('date_to', '<=', payslip.date_to),
-                    ('state', '=', 'done'),
-                ], context=context)
-
-            employee_payslips = self.browse(
-                cr, uid, employee_payslip_ids, context=context)
-
-            # Iterate one time over each line of each payslip of the
-            # employee since the beginning of the year and sum required
-            # lines
-            for emp_payslip in employee_payslips:
-                is_refund = emp_payslip.credit_note and -1 or 1
-
-                for line in emp_payslip.line_ids:
-                    if line.salary_rule_id.code in line_dict:
-                        line_dict[line.salary_rule_id.code] += \
-                            line.total * is_refund
-
-            # For each line in the payslip, write the related total ytd
-            for line in payslip.line_ids:
-                amount = line_dict[line.salary_rule_id.code] + line.total
-                self.pool['hr.payslip.line'].write(
-                    cr, uid, [line.id], {'total_ytd': amount}, context=context)
+        # Sum the lines of the done payslips of the employee since the
+        # beginning of the year of each payslip, by salary rule code.
+        # Refunds are deducted. Each line of the payslips gets the total of
+        # its code added to its own total.
+        line_obj = self.pool['hr.payslip.line']
+        cr.execute("""\
+WITH ytd AS (
+  SELECT cur.id AS slip_id, r.code,
+         SUM(CASE WHEN hp.credit_note THEN -pl.total ELSE pl.total END)
+           AS amount
+  FROM hr_payslip cur
+    JOIN hr_payslip hp ON hp.employee_id = cur.employee_id
+      AND hp.state = 'done'
+      AND hp.date_from >= date_trunc('year', cur.date_from)::date
+      AND hp.date_to <= cur.date_to
+    JOIN hr_payslip_line pl ON pl.slip_id = hp.id
+    JOIN hr_salary_rule r ON r.id = pl.salary_rule_id
+  WHERE cur.id IN %s
+  GROUP BY cur.id, r.code)
+UPDATE hr_payslip_line l
+SET total_ytd = ROUND(COALESCE(l.total, 0) + COALESCE(
+  (SELECT ytd.amount
+   FROM ytd
+   WHERE ytd.slip_id = l.slip_id
+     AND ytd.code = r.code), 0), %s)
+FROM hr_salary_rule r
+WHERE r.id = l.salary_rule_id
+  AND l.slip_id IN %s
+RETURNING l.id""", (tuple(ids), line_obj._columns['total_ytd'].digits[1],
+                    tuple(ids)))
+        line_obj.invalidate_cache(
+            cr, uid, ['total_ytd'], [r[0] for r in cr.fetchall()],
+            context=context)
@@ -41,6 +41,7 @@ This policy is ideal for annual leave accruals. If the type of accrual is
         'hr_contract_state',
         'hr_employee_seniority',
         'hr_policy_group',
+        'hr_schedule',
     ],
     'data': [
         'security/ir.model.access.csv',
@@ -19,13 +19,14 @@
 #
 #
 
-from datetime import datetime, date, timedelta
+from calendar import monthrange
+from datetime import datetime, timedelta
 import logging
 
-from openerp import netsvc
 from openerp.osv import fields, orm
 from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OE_DATEFORMAT
 from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT as OE_DATETIMEFORMAT
+from openerp.addons.hr_schedule.bulk import execute_values
 
 _l = logging.getLogger(__name__)
 
@@ -87,47 +88,11 @@ class hr_policy(orm.Model):
 
         return res
 
-    def _calculate_and_deposit(
-        self, cr, uid, line, employee, job_id, dToday=None, context=None
-    ):
-
-        leave_obj = self.pool.get('hr.holidays')
-        accrual_obj = self.pool.get('hr.accrual')
-        accrual_line_obj = self.pool.get('hr.accrual.line')
-        job_obj = self.pool.get('hr.policy.line.accrual.job')
-        month_last_day = {
-            1: 31,
-            2: 28,
-            3: 31,
-            4: 30,
-            5: 31,
-            6: 30,
-            7: 31,
-            8: 31,
-            9: 30,
-            10: 31,
-            11: 30,
-            12: 31,
-        }
-
-        srvc_months, dHire = self.pool.get(
-            'hr.employee').get_months_service_to_date(
-                cr, uid, [employee.id], dToday=dToday,
-                context=context)[employee.id]
-        srvc_months = int(srvc_months)
-        if dToday is None:
-            dToday = date.today()
-
-        if line.type != 'calendar':
-            return
-
-        employed_days = 0
-        dCount = dHire
-        while dCount < dToday:
-            employed_days += 1
-            dCount += timedelta(days=+1)
-        if line.minimum_employed_days > employed_days:
-            return
+    def _is_accrual_day(self, line, dToday, dHire=None):
+        """Return True if the accrual policy line accrues on dToday. If the
+        frequency of the line is based on the hire date, it is taken from
+        dHire.
+        """
 
         if line.frequency_on_hire_date:
             freq_week_day = dHire.weekday()
@@ -135,123 +100,108 @@ class hr_policy(orm.Model):
             freq_annual_month = dHire.month
             freq_annual_day = dHire.day
         else:
-            freq_week_day = line.frequency_week_day
-            freq_month_day = line.frequency_month_day
-            freq_annual_month = line.frequency_annual_month
-            freq_annual_day = line.frequency_annual_day
+            # The selections are stored as strings
+            freq_week_day = int(line.frequency_week_day or 0)
+            freq_month_day = int(line.frequency_month_day or 0)
+            freq_annual_month = int(line.frequency_annual_month or 0)
+            freq_annual_day = int(line.frequency_annual_day or 0)
 
-        premium_amount = 0
         if line.calculation_frequency == 'weekly':
-            if dToday.weekday() != freq_week_day:
-                return
-            freq_amount = float(line.accrual_rate) / 52.0
-            if line.accrual_rate_premium_minimum <= srvc_months:
-                premium_amount = (
-                    max(
-                        0, srvc_months - line.accrual_rate_premium_minimum
-                        + line.accrual_rate_premium_milestone
-                    )
-                ) // (
-                    line.accrual_rate_premium_milestone
-                    * line.accrual_rate_premium
-                ) / 52.0
+            return dToday.weekday() == freq_week_day
+
+        # If the frequency day is past the end of this month (the 31st in a
+        # 30 day month, or the 29th of February on non-leap years) do the
+        # accrual on the last day of the month.
+        #
+        last_day = monthrange(dToday.year, dToday.month)[1]
+        if line.calculation_frequency == 'monthly':
+            return dToday.day == min(freq_month_day, last_day)
+        return (dToday.month == freq_annual_month
+                and dToday.day == min(freq_annual_day, last_day))
+
+    def _get_accrual_amount(self, line, srvc_months):
+        """Return the amount deposited by the accrual policy line for an
+        employee with srvc_months (whole) months of service.
+        """
+
+        if line.calculation_frequency == 'weekly':
+            periods = 52.0
         elif line.calculation_frequency == 'monthly':
-            # When deciding to skip an employee account for actual month
-            # lengths. If the frequency date is 31 and this month only has 30
-            # days, go ahead and do the accrual on the last day of the month
-            # (i.e. the 30th). For February, on non-leap years execute accruals
-            # for the 29th on the 28th.
-            #
-            if dToday.day == month_last_day[
-                dToday.month
-            ] and freq_month_day > dToday.day:
-                if dToday.month != 2:
-                    freq_month_day = dToday.day
-                elif dToday.month == 2 and dToday.day == 28 and (
-                    dToday + timedelta(days=+1)
-                ).day != 29:
-                    freq_month_day = dToday.day
-
-            if dToday.day != freq_month_day:
-                return
-
-            freq_amount = float(line.accrual_rate) / 12.0
-            if line.accrual_rate_premium_minimum <= srvc_months:
-                premium_amount = (
-                    max(
-                        0, srvc_months - line.accrual_rate_premium_minimum
-                        + line.accrual_rate_premium_milestone
-                    )
-                ) // (
-                    line.accrual_rate_premium_milestone
-                    * line.accrual_rate_premium
-                ) / 12.0
-        else:  # annual frequency
-            # On non-leap years execute Feb. 29 accruals on the 28th
-            #
-            if (dToday.month == 2
-                    and dToday.day == 28
-                    and (dToday + timedelta(days=+1)).day != 29
-                    and freq_annual_day > dToday.day):
-                freq_annual_day = dToday.day
+            periods = 12.0
+        else:
+            periods = 1.0
 
-            if (
-                dToday.month != freq_annual_month
-                and dToday.day != freq_annual_day
-            ):
-                return
-
-            freq_amount = line.accrual_rate
-            if line.accrual_rate_premium_minimum <= srvc_months:
-                premium_amount = (
-                    max(
-                        0, srvc_months - line.accrual_rate_premium_minimum
-                        + line.accrual_rate_premium_milestone
-                    )
-                ) // (
-                    line.accrual_rate_premium_milestone
-                    * line.accrual_rate_premium)
+        freq_amount = float(line.accrual_rate) / periods
+        premium_amount = 0
+        if line.accrual_rate_premium_minimum <= srvc_months:
+            premium_amount = (
+                max(
+                    0, srvc_months - line.accrual_rate_premium_minimum
+                    + line.accrual_rate_premium_milestone
+                )
+            ) // (
+                line.accrual_rate_premium_milestone
+                * line.accrual_rate_premium
+            ) / periods
 
         if line.accrual_rate_max == 0:
-            amount = freq_amount + premium_amount
-        else:
-            amount = min(freq_amount + premium_amount, line.accrual_rate_max)
+            return freq_amount + premium_amount
+        return min(freq_amount + premium_amount, line.accrual_rate_max)
 
-        # Deposit to the accrual account
-        #
-        accrual_line = {
-            'date': dToday.strftime(OE_DATEFORMAT),
-            'accrual_id': line.accrual_id.id,
-            'employee_id': employee.id,
-            'amount': amount,
-        }
-        acr_id = accrual_line_obj.create(
-            cr, uid, accrual_line, context=context)
-        accrual_obj.write(
-            cr, uid, line.accrual_id.id, {'line_ids': [(4, acr_id)]})
+    def _deposit_accruals(self, cr, uid, line, accruals, context=None):
+        """Deposit accruals, a list of (job, employee, date, amount) tuples
+        for the accrual policy line, into the line's accrual account. The
+        accrual lines are inserted in bulk, and each employee gets a
+        single validated leave allocation for the sum of their accruals.
+        """
 
-        # Add the leave and trigger validation workflow
-        #
-        leave_allocation = {
-            'name': 'Calendar based accrual (' + line.name + ')',
-            'type': 'add',
-            'employee_id': employee.id,
-            'number_of_days_temp': amount,
-            'holiday_status_id': line.accrual_id.holiday_status_id.id,
-            'from_accrual': True,
-        }
-        holiday_id = leave_obj.create(
-            cr, uid, leave_allocation, context=context)
-        netsvc.LocalService('workflow').trg_validate(
-            uid, 'hr.holidays', holiday_id, 'validate', cr)
+        leave_obj = self.pool.get('hr.holidays')
+        accrual_line_obj = self.pool.get('hr.accrual.line')
 
-        # Add this accrual line and holiday request to the job for this
-        # policy line
+        if not accruals:
+            return
+
+        acr_ids = accrual_line_obj.create_bulk(cr, uid, [
+            {
+                'date': dJob.strftime(OE_DATEFORMAT),
+                'accrual_id': line.accrual_id.id,
+                'employee_id': ee_id,
+                'amount': amount,
+            }
+            for job_id, ee_id, dJob, amount in accruals
+        ], context=context)
+        execute_values(cr, """\
+INSERT INTO hr_policy_job_accrual_line_rel (job_id, accrual_line_id)
+VALUES %s""", [
+            (accruals[i][0], acr_id) for i, acr_id in enumerate(acr_ids)
+        ])
+
+        totals = {}
+        ee_jobs = {}
+        for job_id, ee_id, dJob, amount in accruals:
+            totals[ee_id] = totals.get(ee_id, 0) + amount
+            ee_jobs.setdefault(ee_id, []).append(job_id)
+
+        # Add the leaves and trigger their validation workflow
         #
-        job_obj.write(
-            cr, uid, job_id, {'accrual_line_ids': [
-                (4, acr_id)], 'holiday_ids': [(4, holiday_id)]},
-            context=context)
+        holiday_rel = []
+        holiday_ids = []
+        for ee_id in sorted(totals):
+            holiday_id = leave_obj.create(cr, uid, {
+                'name': 'Calendar based accrual (' + line.name + ')',
+                'type': 'add',
+                'employee_id': ee_id,
+                'number_of_days_temp': totals[ee_id],
+                'holiday_status_id': line.accrual_id.holiday_status_id.id,
+                'from_accrual': True,
+            }, context=context)
+            holiday_ids.append(holiday_id)
+            holiday_rel.extend(
+                (job_id, holiday_id) for job_id in set(ee_jobs[ee_id]))
+        leave_obj.signal_workflow(cr, uid, holiday_ids, 'validate')
+        execute_values(cr, """\
+INSERT INTO hr_policy_job_holiday_rel (job_id, holiday_id)
+VALUES %s""", holiday_rel)
 
     def _get_last_calculation_date(self, cr, uid, accrual_id, context=None):
 
@@ -270,9 +220,14 @@ class hr_policy(orm.Model):
     def try_calculate_accruals(self, cr, uid, context=None):
 
         pg_obj = self.pool.get('hr.policy.group')
+        ee_obj = self.pool.get('hr.employee')
         job_obj = self.pool.get('hr.policy.line.accrual.job')
         dToday = datetime.now().date()
 
+        # Months of service and hire date of the employees, by day. They are
+        # shared by all the policy groups and lines.
+        service = {}
+
         pg_ids = pg_obj.search(cr, uid, [], context=context)
         for pg in pg_obj.browse(cr, uid, pg_ids, context=context):
             accrual_policy = self.get_latest_policy(
@@ -297,12 +252,25 @@ class hr_policy(orm.Model):
                         d += timedelta(days=1)
                         line_jobs[line.id].append(d)
 
+            # The running contracts attached to the policy group, with their
+            # end dates.
+            #
+            contract_ends = []
+            for contract in pg.contract_ids:
+                if contract.state in ['draft', 'done']:
+                    continue
+                dEnd = contract.date_end and datetime.strptime(
+                    contract.date_end, OE_DATEFORMAT).date() or None
+                contract_ends.append((contract.employee_id.id, dEnd))
+
             # For each accrual line in this accrual policy do a run for each
-            # day (beginning
-            # from the last date for which it was run) until today for each
-            # contract attached to the policy group.
+            # day (beginning from the last date for which it was run) until
+            # today for each employee with a contract in the policy group.
+            # The accruals of all the days are then deposited at once.
             #
             for line in accrual_policy.line_ids:
+                accruals = []
+                amounts = {}
                 for dJob in line_jobs[line.id]:
 
                     # Create a Job for the accrual line
@@ -313,26 +281,48 @@ class hr_policy(orm.Model):
                     }
                     job_id = job_obj.create(cr, uid, job_vals, context=context)
 
-                    employee_list = []
-                    for contract in pg.contract_ids:
-                        if (
-                            contract.employee_id.id in employee_list
-                            or contract.state in ['draft', 'done']
-                        ):
+                    if line.type != 'calendar':
+                        continue
+                    if (not line.frequency_on_hire_date
+                            and not self._is_accrual_day(line, dJob)):
+                        continue
+
+                    # An employee may have multiple valid contracts. Don't
+                    # double-count.
+                    employee_ids = sorted(set(
+                        ee_id for ee_id, dEnd in contract_ends
+                        if dEnd is None or dEnd >= dJob))
+
+                    day_service = service.setdefault(dJob, {})
+                    missing_ids = [
+                        ee_id for ee_id in employee_ids
+                        if ee_id not in day_service]
+                    if missing_ids:
+                        day_service.update(ee_obj.get_months_service_to_date(
+                            cr, uid, missing_ids, dToday=dJob,
+                            context=context))
+
+                    for ee_id in employee_ids:
+                        srvc_months, dHire = day_service[ee_id]
+                        if not dHire:
                             continue
-                        if (
-                            contract.date_end
-                            and datetime.strptime(
-                                contract.date_end, OE_DATEFORMAT).date() < dJob
-                        ):
+                        employed_days = max(0, (dJob - dHire).days)
+                        if line.minimum_employed_days > employed_days:
                             continue
-                        self._calculate_and_deposit(
-                            cr, uid, line, contract.employee_id,
-                            job_id, dToday=dJob, context=context)
+                        if (line.frequency_on_hire_date
+                                and not self._is_accrual_day(
+                                    line, dJob, dHire)):
+                            continue
+
+                        srvc_months = int(srvc_months)
+                        if srvc_months not in amounts:
+                            amounts[srvc_months] = self._get_accrual_amount(
+                                line, srvc_months)
+                        accruals.append(
+                            (job_id, ee_id, dJob, amounts[srvc_months]))
 
-                        # An employee may have multiple valid contracts. Don't
-                        # double-count.
-                        employee_list.append(contract.employee_id.id)
+                self._deposit_accruals(
+                    cr, uid, line, accruals, context=context)
 
         return True
 
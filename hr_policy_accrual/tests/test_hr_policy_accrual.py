@@ -0,0 +1,132 @@
+# -*- coding:utf-8 -*-
+#
+#
+#    Copyright (C) 2015 Odoo Community Association (OCA)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from datetime import date
+
+from openerp.tests import common
+
+
+class test_hr_policy_accrual(common.TransactionCase):
+
+    def setUp(self):
+        super(test_hr_policy_accrual, self).setUp()
+        self.policy_model = self.registry('hr.policy.accrual')
+        self.line_model = self.registry('hr.policy.line.accrual')
+        cr, uid = self.cr, self.uid
+
+        self.accrual_id = self.registry('hr.accrual').create(
+            cr, uid, {'name': 'Annual Leave'})
+
+    def get_line(self, frequency, **vals):
+        cr, uid = self.cr, self.uid
+        vals.update({
+            'name': 'Annual Leave',
+            'code': 'AL',
+            'accrual_id': self.accrual_id,
+            'type': 'calendar',
+            'calculation_frequency': frequency,
+            'accrual_rate': 12.0,
+            'accrual_rate_premium': 0.0,
+            'accrual_rate_premium_minimum': 0,
+            'accrual_rate_premium_milestone': 0,
+            'accrual_rate_max': 0.0,
+        })
+        return self.line_model.browse(
+            cr, uid, self.line_model.create(cr, uid, vals))
+
+    def test_accrual_day_selections(self):
+        # The frequency selections are stored as strings
+        line = self.get_line('weekly', frequency_week_day='2')
+        self.assertTrue(
+            self.policy_model._is_accrual_day(line, date(2015, 3, 4)))
+        self.assertFalse(
+            self.policy_model._is_accrual_day(line, date(2015, 3, 5)))
+
+        line = self.get_line('monthly', frequency_month_day='15')
+        self.assertTrue(
+            self.policy_model._is_accrual_day(line, date(2015, 3, 15)))
+        self.assertFalse(
+            self.policy_model._is_accrual_day(line, date(2015, 3, 16)))
+
+    def test_accrual_day_annual(self):
+        # Annual lines accrue on their day of their month only
+        line = self.get_line('annual', frequency_annual_month='3',
+                             frequency_annual_day='15')
+        self.assertTrue(
+            self.policy_model._is_accrual_day(line, date(2015, 3, 15)))
+        self.assertFalse(
+            self.policy_model._is_accrual_day(line, date(2015, 3, 16)))
+        self.assertFalse(
+            self.policy_model._is_accrual_day(line, date(2015, 4, 15)))
+
+    def test_accrual_day_end_of_month(self):
+        # Days past the end of a month accrue on its last day
+        line = self.get_line('monthly', frequency_month_day='31')
+        self.assertTrue(
+            self.policy_model._is_accrual_day(line, date(2015, 4, 30)))
+        self.assertTrue(
+            self.policy_model._is_accrual_day(line, date(2015, 2, 28)))
+        self.assertFalse(
+            self.policy_model._is_accrual_day(line, date(2016, 2, 28)))
+        self.assertTrue(
+            self.policy_model._is_accrual_day(line, date(2016, 2, 29)))
+
+        line = self.get_line('annual', frequency_annual_month='2',
+                             frequency_annual_day='29')
+        self.assertTrue(
+            self.policy_model._is_accrual_day(line, date(2015, 2, 28)))
+        self.assertFalse(
+            self.policy_model._is_accrual_day(line, date(2016, 2, 28)))
+
+    def test_deposit_accruals(self):
+        cr, uid = self.cr, self.uid
+        holiday_model = self.registry('hr.holidays')
+        job_model = self.registry('hr.policy.line.accrual.job')
+        status_id = self.registry('hr.holidays.status').create(
+            cr, uid, {'name': 'Annual Leave'})
+        self.registry('hr.accrual').write(
+            cr, uid, self.accrual_id, {'holiday_status_id': status_id})
+        employee_id = self.registry('hr.employee').create(
+            cr, uid, {'name': 'Employee 1'})
+        line = self.get_line('monthly', frequency_month_day='1')
+        job_ids = [
+            job_model.create(cr, uid, {
+                'name': day,
+                'exec': day + ' 00:00:00',
+                'policy_line_id': line.id,
+            })
+            for day in ('2015-03-01', '2015-04-01')
+        ]
+
+        # The accruals of a run make one allocation per employee
+        self.policy_model._deposit_accruals(cr, uid, line, [
+            (job_ids[0], employee_id, date(2015, 3, 1), 1.0),
+            (job_ids[1], employee_id, date(2015, 4, 1), 1.5),
+        ])
+        holiday_ids = holiday_model.search(
+            cr, uid, [('employee_id', '=', employee_id),
+                      ('type', '=', 'add')])
+        self.assertEqual(len(holiday_ids), 1)
+        holiday = holiday_model.browse(cr, uid, holiday_ids[0])
+        self.assertEqual(holiday.number_of_days_temp, 2.5)
+        self.assertEqual(holiday.state, 'validate')
+        for job in job_model.browse(cr, uid, job_ids):
+            self.assertEqual([h.id for h in job.holiday_ids], holiday_ids)
+            self.assertEqual(len(job.accrual_line_ids), 1)
@@ -22,6 +22,8 @@
 #
 
 from datetime import date
+from openerp import tools
+from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OE_DFORMAT
 from openerp.tools.translate import _
 from openerp.osv import fields, orm
 
@@ -60,82 +62,150 @@ class hr_holidays(orm.Model):
          _('Duplicate year and country!')),
     ]
 
+    @tools.ormcache(skiparg=3)
+    def get_holidays_dates(self, cr, uid, year, country_id=False,
+                           state_id=False):
+        """Return a frozenset of the dates (in server format) of the public
+        holidays of year that apply in a country and state. Holidays
+        without a country apply everywhere, as do lines without states.
+        Results are kept in a process-wide cache cleared whenever public
+        holidays or their lines change.
+        """
+
+        cr.execute("""\
+SELECT l.date
+FROM hr_holidays_public_line l
+  JOIN hr_holidays_public h ON h.id = l.holidays_id
+WHERE h.year = %s
+  AND (h.country_id IS NULL OR h.country_id = %s)
+  AND (NOT EXISTS (SELECT 1
+                   FROM hr_holiday_public_state_rel r
+                   WHERE r.line_id = l.id)
+       OR EXISTS (SELECT 1
+                  FROM hr_holiday_public_state_rel r
+                  WHERE r.line_id = l.id
+                    AND r.state_id = %s))""", (
+            str(year), country_id or None, state_id or None))
+        return frozenset(r[0] for r in cr.fetchall())
+
+    def get_employee_location(self, cr, uid, employee_id, context=None):
+        """Return the (country, state) ids of the employee's address,
+        which select the public holidays that apply to the employee.
+        """
+
+        if not employee_id:
+            return False, False
+        employee = self.pool['hr.employee'].browse(
+            cr, uid, employee_id, context=context)
+        return (employee.address_id.country_id.id or False,
+                employee.address_id.state_id.id or False)
+
     def is_public_holiday(self, cr, uid, dt, employee_id=None, context=None):
-        employee = self.pool['hr.employee'].browse(cr, uid, employee_id)
-
-        holidays_filter = [('year', '=', dt.year)]
-        if not employee or not employee.address_id.country_id:
-            holidays_filter.append(('country_id', '=', False))
-        else:
-            holidays_filter += ['|', ('country_id', '=',
-                                      employee.address_id.country_id.id),
-                                ('country_id', '=', False)]
-
-        ph_ids = self.search(cr, uid, holidays_filter,
-                             context=context)
-
-        if not ph_ids:
-            return False
-
-        states_filter = [('holidays_id', 'in', ph_ids)]
-        if not employee or not employee.address_id.state_id:
-            states_filter.append(('state_ids', '=', False))
-        else:
-            states_filter += ['|',
-                              ('state_ids', '=', False),
-                              ('state_ids.id', '=',
-                               employee.address_id.state_id.id)
-                              ]
-
-        hr_holiday_public_line_obj = self.pool['hr.holidays.public.line']
-        holidays_line_ids = \
-            hr_holiday_public_line_obj.search(cr, uid, states_filter)
-        lines_obj = \
-            hr_holiday_public_line_obj.browse(cr, uid, holidays_line_ids)
-        for line in lines_obj:
-            if date.strftime(dt, "%Y-%m-%d") == line.date:
-                return True
-
-        return False
+        country_id, state_id = self.get_employee_location(
+            cr, uid, employee_id, context=context)
+        return date.strftime(dt, "%Y-%m-%d") in self.get_holidays_dates(
+            cr, uid, dt.year, country_id, state_id)
 
     def get_holidays_list(self, cr, uid, year, employee_id=None,
                           context=None):
 
-        res = []
-        employee = self.pool['hr.employee'].browse(cr, uid, employee_id)
-
-        holidays_filter = [('year', '=', year)]
-        if not employee or not employee.address_id.country_id:
-            holidays_filter.append(('country_id', '=', False))
-        else:
-            holidays_filter += ['|', ('country_id', '=',
-                                      employee.address_id.country_id.id),
-                                ('country_id', '=', False)]
-
-        ph_ids = self.search(cr, uid, holidays_filter, context=context)
-
-        if not ph_ids:
-            return res
-
-        states_filter = [('holidays_id', 'in', ph_ids)]
-        if not employee or not employee.address_id.state_id:
-            states_filter.append(('state_ids', '=', False))
-        else:
-            states_filter += ['|',
-                              ('state_ids', '=', False),
-                              ('state_ids.id', '=',
-                               employee.address_id.state_id.id)
-                              ]
-
-        hr_holiday_public_line_obj = self.pool['hr.holidays.public.line']
-        holidays_line_ids = \
-            hr_holiday_public_line_obj.search(cr, uid, states_filter)
-
-        [res.append(l.date)
-            for l in hr_holiday_public_line_obj.browse(cr,
-                                                       uid,
-                                                       holidays_line_ids,
-                                                       context=context)]
+        country_id, state_id = self.get_employee_location(
+            cr, uid, employee_id, context=context)
+        return sorted(self.get_holidays_dates(
+            cr, uid, year, country_id, state_id))
+
+    def get_employees_locations(self, cr, uid, employee_ids, context=None):
+        """Return a dictionary of the (country, state) ids of the address
+        of each of employee_ids, as get_employee_location() does for one
+        employee.
+        """
+
+        if not employee_ids:
+            return {}
+        cr.execute("""\
+SELECT e.id, p.country_id, p.state_id
+FROM hr_employee e
+  LEFT JOIN res_partner p ON p.id = e.address_id
+WHERE e.id IN %s""", (tuple(employee_ids),))
+        return dict((ee_id, (country_id or False, state_id or False))
+                    for ee_id, country_id, state_id in cr.fetchall())
+
+    def _get_location_holidays_in_range(self, cr, uid, date_from, date_to,
+                                        country_id, state_id):
+        """Return the frozenset of the dates of get_holidays_dates() between
+        date_from and date_to (strings in server format) inclusive.
+        """
+
+        res = set()
+        for year in xrange(int(date_from[:4]), int(date_to[:4]) + 1):
+            res.update(
+                d for d in self.get_holidays_dates(
+                    cr, uid, year, country_id, state_id)
+                if date_from <= d <= date_to)
+        return frozenset(res)
+
+    def get_employees_holidays_in_range(self, cr, uid, employee_ids,
+                                        date_from, date_to, context=None):
+        """Return a dictionary mapping each of employee_ids to the frozenset
+        of public holiday dates (in server format) between date_from and
+        date_to inclusive that apply at the employee's address. The dates
+        may be given as date objects or strings. The dates of each year
+        and location come from get_holidays_dates().
+        """
+
+        if not employee_ids:
+            return {}
+        if not isinstance(date_from, basestring):
+            date_from = date_from.strftime(OE_DFORMAT)
+        if not isinstance(date_to, basestring):
+            date_to = date_to.strftime(OE_DFORMAT)
+
+        locations = self.get_employees_locations(
+            cr, uid, employee_ids, context=context)
+        by_location = {}
+        res = {}
+        for ee_id in employee_ids:
+            location = locations.get(ee_id, (False, False))
+            if location not in by_location:
+                by_location[location] = self._get_location_holidays_in_range(
+                    cr, uid, date_from[:10], date_to[:10], *location)
+            res[ee_id] = by_location[location]
+        return res
+
+    def get_holidays_in_range(self, cr, uid, date_from, date_to,
+                              employee_id=None, context=None):
+        """Return the frozenset of public holiday dates (in server format)
+        between date_from and date_to inclusive. If employee_id is given
+        only the holidays of the employee's location are returned,
+        otherwise those that apply everywhere.
+        """
+
+        if employee_id:
+            return self.get_employees_holidays_in_range(
+                cr, uid, [employee_id], date_from, date_to,
+                context=context)[employee_id]
+
+        if not isinstance(date_from, basestring):
+            date_from = date_from.strftime(OE_DFORMAT)
+        if not isinstance(date_to, basestring):
+            date_to = date_to.strftime(OE_DFORMAT)
+        return self._get_location_holidays_in_range(
+            cr, uid, date_from[:10], date_to[:10], False, False)
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(hr_holidays, self).create(cr, uid, vals, context=context)
+        self.clear_caches()
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(hr_holidays, self).write(
+            cr, uid, ids, vals, context=context)
+        self.clear_caches()
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(hr_holidays, self).unlink(cr, uid, ids, context=context)
+        self.clear_caches()
         return res
 
 
@@ -156,3 +226,21 @@ class hr_holidays_line(orm.Model):
     }
 
     _order = "date, name desc"
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(hr_holidays_line, self).create(
+            cr, uid, vals, context=context)
+        self.pool['hr.holidays.public'].clear_caches()
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(hr_holidays_line, self).write(
+            cr, uid, ids, vals, context=context)
+        self.pool['hr.holidays.public'].clear_caches()
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(hr_holidays_line, self).unlink(
+            cr, uid, ids, context=context)
+        self.pool['hr.holidays.public'].clear_caches()
+        return res
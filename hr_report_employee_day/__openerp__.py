@@ -0,0 +1,54 @@
+# -*- coding:utf-8 -*-
+#
+#
+#    Copyright (C) 2015 Odoo Community Association (OCA)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+{
+    'name': 'Employee Days',
+    'version': '1.0',
+    'category': 'Generic Modules/Human Resources',
+    'description': """
+Daily Headcount and Attendance Facts
+====================================
+
+Keeps one record per employee and day of employment with the department,
+contract, scheduled and worked hours, leave, rest day, public holiday and
+employment status of the employee on that day. The days whose attendances,
+schedules, leaves, public holidays, contracts (including departmental
+transfers) or terminations change are queued and recomputed every few
+minutes, and the days since the last run are added every night, so that
+reports can be computed as aggregates of these records instead of from the
+original data.
+    """,
+    'author': "Odoo Community Association (OCA)",
+    'website': 'http://miketelahun.wordpress.com',
+    'license': 'AGPL-3',
+    'depends': [
+        'hr_public_holidays',
+        'hr_schedule',
+    ],
+    'data': [
+        'security/ir.model.access.csv',
+        'hr_employee_day_data.xml',
+        'hr_employee_day_view.xml',
+        'hr_employee_day_cron.xml',
+    ],
+    'test': [
+    ],
+    'installable': False,
+}
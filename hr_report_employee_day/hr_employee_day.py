@@ -0,0 +1,854 @@
+# -*- coding:utf-8 -*-
+#
+#
+#    Copyright (C) 2015 Odoo Community Association (OCA)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import logging
+from datetime import datetime, timedelta
+
+from openerp import api
+from openerp.osv import fields, orm
+from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OE_DFORMAT
+from openerp.addons.hr_schedule.bulk import execute_values
+
+_logger = logging.getLogger(__name__)
+
+EMPLOYMENT_STATUS = [
+    ('employed', 'Employed'),
+    ('not_employed', 'Between Contracts'),
+    ('terminated', 'Terminated'),
+]
+
+# Number of days added to the employee days with one query, and committed
+# together, by the nightly job
+MATERIALIZE_CHUNK_DAYS = 31
+
+
+class hr_employee_day(orm.Model):
+
+    _name = 'hr.employee.day'
+    _description = 'Employee Day'
+    _log_access = False
+    _order = 'day desc, employee_id'
+    _rec_name = 'day'
+
+    _columns = {
+        'employee_id': fields.many2one(
+            'hr.employee',
+            'Employee',
+            required=True,
+            readonly=True,
+            ondelete='cascade',
+            select=True,
+        ),
+        'day': fields.date(
+            'Day',
+            required=True,
+            readonly=True,
+            select=True,
+        ),
+        'department_id': fields.many2one(
+            'hr.department',
+            'Department',
+            readonly=True,
+            select=True,
+        ),
+        'contract_id': fields.many2one(
+            'hr.contract',
+            'Contract',
+            readonly=True,
+        ),
+        'schedule_id': fields.many2one(
+            'hr.schedule',
+            'Schedule',
+            readonly=True,
+        ),
+        'scheduled_hours': fields.float(
+            'Scheduled Hours',
+            readonly=True,
+        ),
+        'worked_hours': fields.float(
+            'Worked Hours',
+            readonly=True,
+        ),
+        'signed_in': fields.boolean(
+            'Signed In',
+            readonly=True,
+        ),
+        'leave_code': fields.char(
+            'Leave',
+            size=16,
+            readonly=True,
+        ),
+        'rest_day': fields.boolean(
+            'Rest Day',
+            readonly=True,
+        ),
+        'holiday': fields.boolean(
+            'Public Holiday',
+            readonly=True,
+        ),
+        'employment_status': fields.selection(
+            EMPLOYMENT_STATUS,
+            'Employment Status',
+            readonly=True,
+        ),
+    }
+
+    _sql_constraints = [
+        ('employee_day_uniq', 'unique(employee_id, day)',
+         'There may only be one record per employee and day.'),
+    ]
+
+    def _get_tz(self, cr, uid, context=None):
+
+        return self.pool.get('ir.config_parameter').get_param(
+            cr, uid, 'hr_report_employee_day.tz', default='UTC',
+            context=context) or 'UTC'
+
+    def get_days_range(self, cr, uid, context=None):
+        """Return the first and last days of the employee days, or None if
+        there are none yet."""
+
+        cr.execute('SELECT min(day), max(day) FROM hr_employee_day')
+        date_from, date_to = cr.fetchone()
+        return date_from and (date_from, date_to) or None
+
+    def _refresh(self, cr, uid, employee_ids, date_from, date_to,
+                 context=None):
+        """Recompute the days between date_from and date_to (inclusive) of
+        the employees in employee_ids, or of all the employees if it is
+        None. An employee has a record for each day from the start of
+        their first contract up to the effective date of their
+        termination.
+        """
+
+        if employee_ids is not None and not employee_ids:
+            return
+
+        params = {
+            'date_from': date_from,
+            'date_to': date_to,
+            'tz': self._get_tz(cr, uid, context=context),
+        }
+        employee_where = ''
+        if employee_ids is not None:
+            employee_where = 'WHERE e.id IN %(employee_ids)s'
+            params['employee_ids'] = tuple(employee_ids)
+
+        cr.execute("""\
+DELETE FROM hr_employee_day
+WHERE day >= %(date_from)s
+  AND day <= %(date_to)s""" + (
+            employee_ids is not None
+            and '\n  AND employee_id IN %(employee_ids)s' or ''), params)
+
+        # The days are those of the time zone of the records, each day
+        # is also bounded in UTC for the attendances and leaves
+        cr.execute("""\
+WITH employees AS (
+  SELECT e.id, e.department_id, e.saved_department_id,
+         (SELECT min(c.date_start)
+          FROM hr_contract c
+          WHERE c.employee_id = e.id) AS date_hired,
+         (SELECT min(t.name)
+          FROM hr_employee_termination t
+          WHERE t.employee_id = e.id
+            AND t.state <> 'cancel') AS date_terminated
+  FROM hr_employee e
+  """ + employee_where + """
+), days AS (
+  SELECT g::date AS day,
+         (g AT TIME ZONE %(tz)s) AT TIME ZONE 'UTC' AS utc_start,
+         ((g + interval '1 day') AT TIME ZONE %(tz)s)
+           AT TIME ZONE 'UTC' AS utc_end
+  FROM generate_series(%(date_from)s::timestamp, %(date_to)s::timestamp,
+                       interval '1 day') AS g
+), facts AS (
+  SELECT e.id AS employee_id, d.day, e.department_id,
+         e.saved_department_id, e.date_terminated,
+         (SELECT c.id
+          FROM hr_contract c
+          WHERE c.employee_id = e.id
+            AND c.date_start <= d.day
+            AND (c.date_end IS NULL OR c.date_end >= d.day)
+          ORDER BY c.date_start DESC, c.id DESC
+          LIMIT 1) AS contract_id,
+         (SELECT s.id
+          FROM hr_schedule s
+          WHERE s.employee_id = e.id
+            AND s.date_start <= d.day
+            AND s.date_end >= d.day
+          ORDER BY s.id
+          LIMIT 1) AS schedule_id,
+         (SELECT COALESCE(sum(EXTRACT(EPOCH FROM sd.date_end
+                                      - sd.date_start)), 0) / 3600.0
+          FROM hr_schedule_detail sd
+          WHERE sd.employee_id = e.id
+            AND sd.day = d.day) AS scheduled_hours,
+         (SELECT COALESCE(sum(a.worked_hours), 0)
+          FROM hr_attendance a
+          WHERE a.employee_id = e.id
+            AND a.action = 'sign_out'
+            AND a.name >= d.utc_start
+            AND a.name < d.utc_end) AS worked_hours,
+         EXISTS (SELECT 1
+                 FROM hr_attendance a
+                 WHERE a.employee_id = e.id
+                   AND a.action = 'sign_in'
+                   AND a.name >= d.utc_start
+                   AND a.name < d.utc_end) AS signed_in,
+         (SELECT hs.code
+          FROM hr_holidays h
+            JOIN hr_holidays_status hs ON hs.id = h.holiday_status_id
+          WHERE h.employee_id = e.id
+            AND h.type = 'remove'
+            AND h.state IN ('validate', 'validate1')
+            AND h.date_from < d.utc_end
+            AND h.date_to >= d.utc_start
+          ORDER BY h.date_from, h.id
+          LIMIT 1) AS leave_code
+  FROM employees e
+    JOIN days d
+      ON d.day >= e.date_hired
+     AND (e.date_terminated IS NULL OR d.day <= e.date_terminated)
+)
+INSERT INTO hr_employee_day
+  (employee_id, day, department_id, contract_id, schedule_id,
+   scheduled_hours, worked_hours, signed_in, leave_code, rest_day, holiday,
+   employment_status)
+SELECT f.employee_id, f.day,
+       COALESCE(j.department_id, f.department_id, f.saved_department_id),
+       f.contract_id, f.schedule_id, f.scheduled_hours, f.worked_hours,
+       f.signed_in, f.leave_code, false, false,
+       CASE WHEN f.day >= f.date_terminated THEN 'terminated'
+            WHEN f.contract_id IS NOT NULL THEN 'employed'
+            ELSE 'not_employed'
+       END
+FROM facts f
+  LEFT JOIN hr_contract c ON c.id = f.contract_id
+  LEFT JOIN hr_job j ON j.id = c.job_id""", params)
+
+        self._refresh_rest_days(
+            cr, uid, employee_ids, date_from, date_to, context=context)
+        self._refresh_holidays(
+            cr, uid, employee_ids, date_from, date_to, context=context)
+
+    def _refresh_rest_days(self, cr, uid, employee_ids, date_from, date_to,
+                           context=None):
+
+        where = ''
+        params = [date_from, date_to]
+        if employee_ids is not None:
+            where = '\n  AND employee_id IN %s'
+            params.append(tuple(employee_ids))
+        cr.execute("""\
+SELECT id, schedule_id, day
+FROM hr_employee_day
+WHERE day >= %s
+  AND day <= %s
+  AND schedule_id IS NOT NULL""" + where, params)
+        days = []
+        for day_id, sched_id, day in cr.fetchall():
+            dDay = datetime.strptime(day, OE_DFORMAT).date()
+            week_start = (dDay - timedelta(days=dDay.weekday())).strftime(
+                OE_DFORMAT)
+            days.append((day_id, (sched_id, week_start), dDay.weekday()))
+        if not days:
+            return
+
+        rest_days = self.pool.get('hr.schedule').get_rest_days_bulk(
+            cr, uid, set(key for day_id, key, weekday in days),
+            context=context)
+        rest_day_ids = [day_id for day_id, key, weekday in days
+                        if weekday in rest_days[key]]
+        if rest_day_ids:
+            cr.execute("""\
+UPDATE hr_employee_day
+SET rest_day = true
+WHERE id IN %s""", (tuple(rest_day_ids),))
+
+    def _refresh_holidays(self, cr, uid, employee_ids, date_from, date_to,
+                          context=None):
+
+        if employee_ids is None:
+            cr.execute("""\
+SELECT DISTINCT employee_id
+FROM hr_employee_day
+WHERE day >= %s
+  AND day <= %s""", (date_from, date_to))
+            employee_ids = [r[0] for r in cr.fetchall()]
+
+        holidays = self.pool.get(
+            'hr.holidays.public').get_employees_holidays_in_range(
+                cr, uid, employee_ids, date_from, date_to, context=context)
+        keys = [(ee_id, d) for ee_id, dates in holidays.iteritems()
+                for d in dates]
+        execute_values(cr, """\
+UPDATE hr_employee_day
+SET holiday = true
+FROM (VALUES %s)
+  AS v(employee_id, day)
+WHERE hr_employee_day.employee_id = v.employee_id
+  AND hr_employee_day.day = v.day::date""", keys)
+
+    def refresh_ranges(self, cr, uid, ranges, context=None):
+        """Recompute the days of employees whose records changed. ranges
+        is a list of (employee id, first day, last day) tuples; an employee
+        id of None stands for all the employees, and a first or last day
+        of None for the first or last day of the employee days. Only the
+        days already in the employee days are recomputed, the nightly job
+        adds the new ones.
+        """
+
+        days_range = self.get_days_range(cr, uid, context=context)
+        if not days_range:
+            return
+
+        groups = {}
+        for employee_id, date_from, date_to in ranges:
+            date_from = max(date_from or days_range[0], days_range[0])
+            date_to = min(date_to or days_range[1], days_range[1])
+            if date_from > date_to:
+                continue
+            key = (date_from, date_to)
+            if employee_id is None:
+                groups[key] = None
+            elif groups.get(key, set()) is not None:
+                groups.setdefault(key, set()).add(employee_id)
+
+        for (date_from, date_to), employee_ids in sorted(groups.iteritems()):
+            self._refresh(cr, uid, employee_ids, date_from, date_to,
+                          context=context)
+
+    def _is_refresh_sync(self, cr, uid, context=None):
+        """Whether the employee days are recomputed as soon as the records
+        they are computed from change, rather than queued for
+        process_refresh_queue(). The employee_day_refresh_sync key of the
+        context takes precedence over the
+        hr_report_employee_day.refresh_sync parameter.
+        """
+
+        if context and 'employee_day_refresh_sync' in context:
+            return bool(context['employee_day_refresh_sync'])
+        return self.pool.get('ir.config_parameter').get_param(
+            cr, uid, 'hr_report_employee_day.refresh_sync', default='0',
+            context=context) not in ('0', 'False', 'false')
+
+    def queue_refresh(self, cr, uid, ranges, context=None):
+        """Recompute the days of ranges, as given to refresh_ranges(),
+        either at once or, by default, by adding the ranges that are not
+        already queued to the queue drained by process_refresh_queue().
+        """
+
+        ranges = sorted(set(ranges))
+        if not ranges:
+            return
+
+        if self._is_refresh_sync(cr, uid, context=context):
+            self.refresh_ranges(cr, uid, ranges, context=context)
+            return
+
+        execute_values(cr, """\
+INSERT INTO hr_employee_day_queue (employee_id, date_from, date_to)
+SELECT DISTINCT v.employee_id::integer, v.date_from::date, v.date_to::date
+FROM (VALUES %s)
+  AS v(employee_id, date_from, date_to)
+WHERE NOT EXISTS (
+  SELECT 1
+  FROM hr_employee_day_queue q
+  WHERE q.employee_id IS NOT DISTINCT FROM v.employee_id::integer
+    AND q.date_from IS NOT DISTINCT FROM v.date_from::date
+    AND q.date_to IS NOT DISTINCT FROM v.date_to::date)""", ranges)
+
+    def process_refresh_queue(self, cr, uid, context=None):
+        """Method called by cron to recompute the employee days queued by
+        queue_refresh().
+        """
+
+        cr.execute("""\
+DELETE FROM hr_employee_day_queue
+RETURNING employee_id, to_char(date_from, 'YYYY-MM-DD'),
+          to_char(date_to, 'YYYY-MM-DD')""")
+        ranges = sorted(set(cr.fetchall()))
+        if ranges:
+            self.refresh_ranges(cr, uid, ranges, context=context)
+            _logger.info('Recomputed %d ranges of employee days',
+                         len(ranges))
+        return True
+
+    def materialize(self, cr, uid, context=None):
+        """Add the days up to today to the employee days, starting again
+        from the last day already there (or from the start of the first
+        contract), one committed chunk of days at a time. Called from the
+        scheduler.
+        """
+
+        days_range = self.get_days_range(cr, uid, context=context)
+        if days_range:
+            date_from = days_range[1]
+        else:
+            cr.execute('SELECT min(date_start) FROM hr_contract')
+            date_from = cr.fetchone()[0]
+            if not date_from:
+                return True
+
+        dFrom = datetime.strptime(date_from, OE_DFORMAT).date()
+        dToday = datetime.strptime(fields.date.context_today(
+            self, cr, uid, context=context), OE_DFORMAT).date()
+        while dFrom <= dToday:
+            dTo = min(dFrom + timedelta(days=MATERIALIZE_CHUNK_DAYS - 1),
+                      dToday)
+            with api.Environment.manage():
+                new_cr = self.pool.cursor()
+                try:
+                    self._refresh(
+                        new_cr, uid, None, dFrom.strftime(OE_DFORMAT),
+                        dTo.strftime(OE_DFORMAT), context=context)
+                    new_cr.commit()
+                finally:
+                    new_cr.close()
+            _logger.info('Employee days computed up to %s', dTo)
+            dFrom = dTo + timedelta(days=1)
+
+        return True
+
+
+class hr_employee_day_queue(orm.Model):
+
+    _name = 'hr.employee.day.queue'
+    _description = 'Employee Days to Recompute'
+    _log_access = False
+
+    _columns = {
+        'employee_id': fields.many2one(
+            'hr.employee',
+            'Employee',
+            readonly=True,
+            ondelete='cascade',
+        ),
+        'date_from': fields.date(
+            'First Day',
+            readonly=True,
+        ),
+        'date_to': fields.date(
+            'Last Day',
+            readonly=True,
+        ),
+    }
+
+
+def _day_before(day):
+
+    return (datetime.strptime(day[:10], OE_DFORMAT)
+            - timedelta(days=1)).strftime(OE_DFORMAT)
+
+
+def _day_after(day):
+
+    return (datetime.strptime(day[:10], OE_DFORMAT)
+            + timedelta(days=1)).strftime(OE_DFORMAT)
+
+
+class hr_attendance(orm.Model):
+
+    _inherit = 'hr.attendance'
+
+    def _employee_day_ranges(self, cr, uid, ids, context=None):
+        # The time of a punch is in UTC, its day may be the one before or
+        # after in the time zone of the employee days
+        if not ids:
+            return []
+        cr.execute("""\
+SELECT DISTINCT employee_id, to_char(name, 'YYYY-MM-DD')
+FROM hr_attendance
+WHERE id IN %s""", (tuple(ids),))
+        return [(ee_id, _day_before(day), _day_after(day))
+                for ee_id, day in cr.fetchall()]
+
+    def create(self, cr, uid, vals, context=None):
+
+        res = super(hr_attendance, self).create(
+            cr, uid, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, self._employee_day_ranges(cr, uid, [res]),
+            context=context)
+        return res
+
+    def create_bulk(self, cr, uid, vals_list, context=None):
+
+        res = super(hr_attendance, self).create_bulk(
+            cr, uid, vals_list, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, self._employee_day_ranges(cr, uid, res),
+            context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not set(['employee_id', 'name', 'action']) & set(vals):
+            return super(hr_attendance, self).write(
+                cr, uid, ids, vals, context=context)
+
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_attendance, self).write(
+            cr, uid, ids, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges + self._employee_day_ranges(cr, uid, ids),
+            context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_attendance, self).unlink(
+            cr, uid, ids, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges, context=context)
+        return res
+
+
+class hr_schedule(orm.Model):
+
+    _inherit = 'hr.schedule'
+
+    def _employee_day_ranges(self, cr, uid, ids, context=None):
+        if not ids:
+            return []
+        cr.execute("""\
+SELECT employee_id, date_start, date_end
+FROM hr_schedule
+WHERE id IN %s""", (tuple(ids),))
+        return cr.fetchall()
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not set(['employee_id', 'date_start', 'date_end', 'restday_ids1',
+                    'restday_ids2', 'restday_ids3', 'restday_ids4',
+                    'restday_ids5']) & set(vals):
+            return super(hr_schedule, self).write(
+                cr, uid, ids, vals, context=context)
+
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_schedule, self).write(
+            cr, uid, ids, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges + self._employee_day_ranges(cr, uid, ids),
+            context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_schedule, self).unlink(cr, uid, ids, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges, context=context)
+        return res
+
+
+class hr_schedule_detail(orm.Model):
+
+    _inherit = 'hr.schedule.detail'
+
+    def _employee_day_ranges(self, cr, uid, ids, context=None):
+        if not ids:
+            return []
+        cr.execute("""\
+SELECT DISTINCT employee_id, day, day
+FROM hr_schedule_detail
+WHERE id IN %s""", (tuple(ids),))
+        return cr.fetchall()
+
+    def create(self, cr, uid, vals, context=None):
+
+        res = super(hr_schedule_detail, self).create(
+            cr, uid, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, self._employee_day_ranges(cr, uid, [res]),
+            context=context)
+        return res
+
+    def create_bulk(self, cr, uid, vals_list, context=None):
+
+        res = super(hr_schedule_detail, self).create_bulk(
+            cr, uid, vals_list, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, self._employee_day_ranges(cr, uid, res),
+            context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not set(['day', 'date_start', 'date_end']) & set(vals):
+            return super(hr_schedule_detail, self).write(
+                cr, uid, ids, vals, context=context)
+
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_schedule_detail, self).write(
+            cr, uid, ids, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges + self._employee_day_ranges(cr, uid, ids),
+            context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_schedule_detail, self).unlink(
+            cr, uid, ids, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges, context=context)
+        return res
+
+
+class hr_holidays(orm.Model):
+
+    _inherit = 'hr.holidays'
+
+    def _employee_day_ranges(self, cr, uid, ids, context=None):
+        if not ids:
+            return []
+        cr.execute("""\
+SELECT employee_id, to_char(date_from, 'YYYY-MM-DD'),
+       to_char(date_to, 'YYYY-MM-DD')
+FROM hr_holidays
+WHERE id IN %s
+  AND employee_id IS NOT NULL
+  AND date_from IS NOT NULL
+  AND date_to IS NOT NULL""", (tuple(ids),))
+        return [(ee_id, _day_before(date_from), _day_after(date_to))
+                for ee_id, date_from, date_to in cr.fetchall()]
+
+    def create(self, cr, uid, vals, context=None):
+
+        res = super(hr_holidays, self).create(cr, uid, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, self._employee_day_ranges(cr, uid, [res]),
+            context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not set(['date_from', 'date_to', 'state', 'holiday_status_id',
+                    'employee_id']) & set(vals):
+            return super(hr_holidays, self).write(
+                cr, uid, ids, vals, context=context)
+
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_holidays, self).write(
+            cr, uid, ids, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges + self._employee_day_ranges(cr, uid, ids),
+            context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_holidays, self).unlink(cr, uid, ids, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges, context=context)
+        return res
+
+
+class hr_holidays_public_line(orm.Model):
+
+    _inherit = 'hr.holidays.public.line'
+
+    def _employee_day_ranges(self, cr, uid, ids, context=None):
+        # A public holiday may apply to any employee
+        if not ids:
+            return []
+        cr.execute("""\
+SELECT DISTINCT date
+FROM hr_holidays_public_line
+WHERE id IN %s""", (tuple(ids),))
+        return [(None, day, day) for day, in cr.fetchall()]
+
+    def create(self, cr, uid, vals, context=None):
+
+        res = super(hr_holidays_public_line, self).create(
+            cr, uid, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, self._employee_day_ranges(cr, uid, [res]),
+            context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not set(['date', 'holidays_id', 'state_ids']) & set(vals):
+            return super(hr_holidays_public_line, self).write(
+                cr, uid, ids, vals, context=context)
+
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_holidays_public_line, self).write(
+            cr, uid, ids, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges + self._employee_day_ranges(cr, uid, ids),
+            context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_holidays_public_line, self).unlink(
+            cr, uid, ids, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges, context=context)
+        return res
+
+
+class hr_contract(orm.Model):
+
+    _inherit = 'hr.contract'
+
+    def _employee_day_ranges(self, cr, uid, ids, context=None):
+        # The start of the first contract is the first day of employment,
+        # and a transfer to another department starts a new contract
+        if not ids:
+            return []
+        cr.execute("""\
+SELECT employee_id, date_start, NULL
+FROM hr_contract
+WHERE id IN %s""", (tuple(ids),))
+        return cr.fetchall()
+
+    def create(self, cr, uid, vals, context=None):
+
+        res = super(hr_contract, self).create(cr, uid, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, self._employee_day_ranges(cr, uid, [res]),
+            context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not set(['employee_id', 'date_start', 'date_end', 'job_id']) \
+                & set(vals):
+            return super(hr_contract, self).write(
+                cr, uid, ids, vals, context=context)
+
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_contract, self).write(
+            cr, uid, ids, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges + self._employee_day_ranges(cr, uid, ids),
+            context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_contract, self).unlink(cr, uid, ids, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges, context=context)
+        return res
+
+
+class hr_employee(orm.Model):
+
+    _inherit = 'hr.employee'
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        res = super(hr_employee, self).write(
+            cr, uid, ids, vals, context=context)
+        # The department of the employee is that of the days without a
+        # contract for a job in a department
+        if 'department_id' in vals or 'saved_department_id' in vals:
+            if isinstance(ids, (int, long)):
+                ids = [ids]
+            self.pool.get('hr.employee.day').queue_refresh(
+                cr, uid, [(ee_id, None, None) for ee_id in ids],
+                context=context)
+        return res
+
+
+class hr_employee_termination(orm.Model):
+
+    _inherit = 'hr.employee.termination'
+
+    def _employee_day_ranges(self, cr, uid, ids, context=None):
+        # The employee days end on the effective date of the termination
+        if not ids:
+            return []
+        cr.execute("""\
+SELECT employee_id, name, NULL
+FROM hr_employee_termination
+WHERE id IN %s""", (tuple(ids),))
+        return cr.fetchall()
+
+    def create(self, cr, uid, vals, context=None):
+
+        res = super(hr_employee_termination, self).create(
+            cr, uid, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, self._employee_day_ranges(cr, uid, [res]),
+            context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not set(['employee_id', 'name', 'state']) & set(vals):
+            return super(hr_employee_termination, self).write(
+                cr, uid, ids, vals, context=context)
+
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_employee_termination, self).write(
+            cr, uid, ids, vals, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges + self._employee_day_ranges(cr, uid, ids),
+            context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        ranges = self._employee_day_ranges(cr, uid, ids)
+        res = super(hr_employee_termination, self).unlink(
+            cr, uid, ids, context=context)
+        self.pool.get('hr.employee.day').queue_refresh(
+            cr, uid, ranges, context=context)
+        return res
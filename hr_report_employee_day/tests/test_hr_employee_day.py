@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+#
+#
+#    Copyright (C) 2015 Odoo Community Association (OCA)
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from openerp.tests import common
+
+
+class test_hr_employee_day(common.TransactionCase):
+
+    def setUp(self):
+        super(test_hr_employee_day, self).setUp()
+        self.day_model = self.registry('hr.employee.day')
+        self.attendance_model = self.registry('hr.attendance')
+        cr, uid = self.cr, self.uid
+
+        self.employee_id = self.registry('hr.employee').create(
+            cr, uid, {'name': 'Employee 1'})
+        self.registry('hr.contract').create(
+            cr, uid, {
+                'name': 'Contract 1',
+                'employee_id': self.employee_id,
+                'wage': 1000,
+                'date_start': '2015-03-02',
+            })
+
+    def get_days(self):
+        day_ids = self.day_model.search(
+            self.cr, self.uid, [('employee_id', '=', self.employee_id)],
+            order='day')
+        return [
+            (d['day'], d['employment_status'], d['signed_in'],
+             d['worked_hours'])
+            for d in self.day_model.read(
+                self.cr, self.uid, day_ids,
+                ['day', 'employment_status', 'signed_in', 'worked_hours'])
+        ]
+
+    def test_refresh(self):
+        cr, uid = self.cr, self.uid
+        self.day_model._refresh(
+            cr, uid, [self.employee_id], '2015-03-01', '2015-03-03')
+        self.assertEqual(self.get_days(), [
+            ('2015-03-02', 'employed', False, 0.0),
+            ('2015-03-03', 'employed', False, 0.0),
+        ])
+
+        # New punches queue the days they fall on, which are updated when
+        # the queue is drained
+        context = {'employee_day_refresh_sync': False}
+        self.attendance_model.create_bulk(
+            cr, uid, [
+                {'employee_id': self.employee_id, 'action': 'sign_in',
+                 'name': '2015-03-03 07:00:00'},
+                {'employee_id': self.employee_id, 'action': 'sign_out',
+                 'name': '2015-03-03 16:00:00'},
+            ], context=context)
+        self.assertEqual(self.get_days(), [
+            ('2015-03-02', 'employed', False, 0.0),
+            ('2015-03-03', 'employed', False, 0.0),
+        ])
+        self.day_model.process_refresh_queue(cr, uid, context=context)
+        self.assertEqual(self.get_days(), [
+            ('2015-03-02', 'employed', False, 0.0),
+            ('2015-03-03', 'employed', True, 9.0),
+        ])
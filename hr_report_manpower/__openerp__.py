@@ -33,6 +33,7 @@ Daily Man Power Report by Department
     'license': 'AGPL-3',
     'depends': [
         'hr',
+        'hr_public_holidays',
         'report_aeroo',
     ],
     'data': [
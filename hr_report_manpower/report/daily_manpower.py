@@ -18,6 +18,7 @@
 #
 #
 
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
 from pytz import timezone, utc
 
@@ -25,6 +26,229 @@ from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OE_DATEFORMAT
 from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT as OE_DATETIMEFORMAT
 from openerp.report import report_sxw
 
+# Leave types that excuse an employee from work
+LVCODES = (
+    'LVBEREAVEMENT',
+    'LVWEDDING',
+    'LVMMEDICAL',
+    'LVPTO',
+    'LVCIVIC',
+    'LVSICK',
+    'LVSICK50',
+    'LVSICK00',
+    'LVMATERNITY',
+    'LVANNUAL',
+    'LVTRAIN',
+    'LVUTO',
+)
+
+# Report column counting the leaves of each type
+LEAVE_COLUMNS = {
+    'LVANNUAL': 'al',
+    'LVSICK': 'sl',
+    'LVSICK50': 'sl',
+    'LVSICK00': 'sl',
+    'LVMATERNITY': 'ml',
+    'LVBEREAVEMENT': 'ol',
+    'LVWEDDING': 'ol',
+    'LVMMEDICAL': 'ol',
+    'LVPTO': 'ol',
+    'LVCIVIC': 'ol',
+}
+
+# Counters of each department in a manpower snapshot
+COUNTERS = ('present', 'absent', 'restday', 'restday_ot', 'al', 'sl', 'ml',
+            'ol', 'terminated')
+
+
+class manpower_snapshot(object):
+    """Man power of every department on each day between date_from and
+    date_to, classified in one pass over the attendances, schedules,
+    leaves, public holidays and terminations of the whole range, each
+    loaded with a single query.
+
+    employees maps each (day, employee id) to the set of counters the
+    employee adds to on that day; counts maps each (day, department id) to
+    the totals of its counters. An employee counts in both their current
+    department and the one saved when they were deactivated. Days are in
+    the time zone local_tz.
+    """
+
+    def __init__(self, cr, uid, pool, date_from, date_to, local_tz):
+
+        self.employees = {}
+        self.counts = {}
+
+        dFrom = datetime.strptime(date_from, OE_DATEFORMAT)
+        dTo = datetime.strptime(date_to, OE_DATEFORMAT)
+        self.days = [(dFrom + timedelta(days=i)).strftime(OE_DATEFORMAT)
+                     for i in xrange((dTo - dFrom).days + 1)]
+        if not self.days:
+            return
+
+        # The bounds (in UTC) of each day
+        starts = []
+        ends = []
+        for day in self.days:
+            dt = datetime.strptime(day + ' 00:00:00', OE_DATETIMEFORMAT)
+            utcdt = local_tz.localize(dt, is_dst=False).astimezone(utc)
+            starts.append(utcdt.strftime(OE_DATETIMEFORMAT))
+            ends.append((utcdt + timedelta(hours=+24)).strftime(
+                OE_DATETIMEFORMAT))
+
+        def day_indexes(time_from, time_to):
+            # The days overlapping [time_from, time_to]
+            return xrange(bisect_right(ends, time_from),
+                          bisect_right(starts, time_to))
+
+        cr.execute("""\
+SELECT id, department_id, saved_department_id, active
+FROM hr_employee""")
+        departments = {}
+        term_departments = {}
+        for ee_id, dept_id, saved_dept_id, active in cr.fetchall():
+            term_departments[ee_id] = dept_id or saved_dept_id
+            if active:
+                departments[ee_id] = set(
+                    d for d in (dept_id, saved_dept_id) if d)
+
+        # Sign-ins
+        signed_in = set()
+        cr.execute("""\
+SELECT employee_id, name
+FROM hr_attendance
+WHERE action = 'sign_in'
+  AND name >= %s
+  AND name < %s""", (starts[0], ends[-1]))
+        for ee_id, name in cr.fetchall():
+            i = bisect_right(starts, name) - 1
+            if name < ends[i]:
+                signed_in.add((i, ee_id))
+
+        # Approved leaves, by type
+        leaves = {}
+        cr.execute("""\
+SELECT h.employee_id, h.date_from, h.date_to, s.code
+FROM hr_holidays h
+  JOIN hr_holidays_status s ON s.id = h.holiday_status_id
+WHERE h.type = 'remove'
+  AND h.state IN ('validate', 'validate1')
+  AND h.date_from < %s
+  AND h.date_to >= %s""", (ends[-1], starts[0]))
+        for ee_id, leave_from, leave_to, code in cr.fetchall():
+            for i in day_indexes(leave_from, leave_to):
+                leaves.setdefault((i, ee_id), []).append(code)
+
+        # Employment terminations
+        terminated = {}
+        terminations = set()
+        cr.execute("""\
+SELECT employee_id, name, state
+FROM hr_employee_termination
+WHERE name <= %s""", (self.days[-1],))
+        for ee_id, name, state in cr.fetchall():
+            if state != 'cancel' \
+                    and (ee_id not in terminated or name < terminated[ee_id]):
+                terminated[ee_id] = name
+            if name >= self.days[0]:
+                terminations.add((name, ee_id))
+
+        # First day of employment
+        hired = {}
+        contract_obj = pool.get('hr.contract')
+        contract_ids = contract_obj.search(
+            cr, uid, [('employee_id', 'in', departments.keys())])
+        for c in contract_obj.read(cr, uid, contract_ids,
+                                   ['employee_id', 'date_start']):
+            ee_id = c['employee_id'][0]
+            if ee_id not in hired or c['date_start'] < hired[ee_id]:
+                hired[ee_id] = c['date_start']
+
+        holidays = pool.get(
+            'hr.holidays.public').get_employees_holidays_in_range(
+                cr, uid, departments.keys(), self.days[0], self.days[-1])
+
+        # Schedules, and their rest days in the week of each day
+        schedules = {}
+        cr.execute("""\
+SELECT id, employee_id, date_start, date_end
+FROM hr_schedule
+WHERE date_start <= %s
+  AND date_end >= %s
+ORDER BY id""", (self.days[-1], self.days[0]))
+        for sched_id, ee_id, sched_start, sched_end in cr.fetchall():
+            for i in xrange(bisect_left(self.days, sched_start),
+                            bisect_right(self.days, sched_end)):
+                schedules.setdefault((i, ee_id), sched_id)
+        week_starts = [
+            (dFrom + timedelta(days=i - (dFrom.weekday() + i) % 7)).strftime(
+                OE_DATEFORMAT)
+            for i in xrange(len(self.days))]
+        rest_days = pool.get('hr.schedule').get_rest_days_bulk(
+            cr, uid, set((sched_id, week_starts[i])
+                         for (i, ee_id), sched_id in schedules.iteritems()))
+
+        for i, day in enumerate(self.days):
+            weekday = (dFrom.weekday() + i) % 7
+            for ee_id, dept_ids in departments.iteritems():
+                if not dept_ids:
+                    continue
+                key = (i, ee_id)
+                codes = leaves.get(key, [])
+                on_leave = any(code in LVCODES for code in codes)
+                is_terminated = ee_id in terminated \
+                    and terminated[ee_id] <= day
+                sched_id = schedules.get(key)
+                rest_day = sched_id is not None and weekday in rest_days[
+                    (sched_id, week_starts[i])]
+
+                flags = set()
+                if key in signed_in:
+                    if not is_terminated and not on_leave:
+                        flags.add('present')
+                elif not on_leave and not is_terminated and not rest_day \
+                        and day not in holidays[ee_id] \
+                        and ee_id in hired and hired[ee_id] <= day:
+                    flags.add('absent')
+                if rest_day and not codes:
+                    flags.add(key in signed_in and 'restday_ot' or 'restday')
+                if flags:
+                    self.employees[(day, ee_id)] = flags
+
+                for dept_id in dept_ids:
+                    if not flags and not codes:
+                        continue
+                    counts = self._counts(day, dept_id)
+                    for flag in flags:
+                        counts[flag] += 1
+                    for code in codes:
+                        if code in LEAVE_COLUMNS:
+                            counts[LEAVE_COLUMNS[code]] += 1
+
+        for day, ee_id in terminations:
+            dept_id = term_departments.get(ee_id)
+            if dept_id:
+                self.employees.setdefault((day, ee_id), set()).add(
+                    'terminated')
+                self._counts(day, dept_id)['terminated'] += 1
+
+    def _counts(self, day, department_id):
+
+        key = (day, department_id)
+        if key not in self.counts:
+            self.counts[key] = dict.fromkeys(COUNTERS, 0)
+        return self.counts[key]
+
+    def get(self, department_id):
+        """Return the counters of a department summed over all the days."""
+
+        res = dict.fromkeys(COUNTERS, 0)
+        for day in self.days:
+            for counter, value in self.counts.get(
+                    (day, department_id), {}).iteritems():
+                res[counter] += value
+        return res
+
 
 class Parser(report_sxw.rml_parse):
 
@@ -51,22 +275,9 @@ class Parser(report_sxw.rml_parse):
             'get_tot_terminated': self.get_sum_terminated,
         })
 
-        self.LVCODES = [
-            'LVBEREAVEMENT',
-            'LVWEDDING',
-            'LVMMEDICAL',
-            'LVPTO',
-            'LVCIVIC',
-            'LVSICK',
-            'LVSICK50',
-            'LVSICK00',
-            'LVMATERNITY',
-            'LVANNUAL',
-            'LVTRAIN',
-            'LVUTO',
-        ]
-
         self.date = False
+        self.date_end = False
+        self.snapshot = None
         self.no = 0
         self._present = 0
         self._absent = 0
@@ -80,364 +291,85 @@ class Parser(report_sxw.rml_parse):
     def set_context(self, objects, data, ids, report_type=None):
         if data.get('form', False) and data['form'].get('date', False):
             self.date = data['form']['date']
+            self.date_end = data['form'].get('date_end') or self.date
 
         return super(Parser, self).set_context(
             objects, data, ids, report_type=report_type
         )
 
     def get_date(self):
-        return datetime.strptime(self.date, OE_DATEFORMAT).strftime(
+        res = datetime.strptime(self.date, OE_DATEFORMAT).strftime(
             '%B %d, %Y'
         )
+        if self.date_end and self.date_end != self.date:
+            res += ' - ' + datetime.strptime(
+                self.date_end, OE_DATEFORMAT).strftime('%B %d, %Y')
+        return res
 
     def get_no(self):
 
         self.no += 1
         return self.no
 
-    def get_present_employees(self, department_id):
-
-        att_obj = self.pool.get('hr.attendance')
-        user = self.pool.get('res.users').browse(self.cr, self.uid, self.uid)
-        if user and user.tz:
-            local_tz = timezone(user.tz)
-        else:
-            local_tz = timezone('Africa/Addis_Ababa')
-        dt = datetime.strptime(self.date + ' 00:00:00', OE_DATETIMEFORMAT)
-        utcdt = (local_tz.localize(dt, is_dst=False)).astimezone(utc)
-        att_ids = att_obj.search(
-            self.cr, self.uid, [
-                ('name', '>=', utcdt.strftime(OE_DATETIMEFORMAT)),
-                ('name', '<', (utcdt + timedelta(hours=+24)).strftime(
-                    OE_DATETIMEFORMAT)),
-                ('action', '=', 'sign_in'),
-                '|',
-                ('employee_id.department_id.id', '=', department_id),
-                ('employee_id.saved_department_id.id', '=', department_id)
-            ]
-        )
-
-        unique_ids = []
-        term_obj = self.pool.get('hr.employee.termination')
-        data = att_obj.read(self.cr, self.uid, att_ids, ['employee_id'])
-        for d in data:
-            # if this employee's employment was terminated skip it
-            term_ids = term_obj.search(
-                self.cr, self.uid, [('name', '<=', self.date),
-                                    ('employee_id.id', '=', d[
-                                        'employee_id'][0]),
-                                    ('state', 'not in', ['cancel'])])
-            if term_ids:
-                continue
+    def get_counts(self, department_id):
+        """Return the counters of a department, from the man power snapshot
+        of the report dates built on first use."""
 
-            if d['employee_id'][0] not in unique_ids:
-                unique_ids.append(d['employee_id'][0])
-
-        return unique_ids
+        if self.snapshot is None:
+            user = self.pool.get('res.users').browse(
+                self.cr, self.uid, self.uid)
+            if user and user.tz:
+                local_tz = timezone(user.tz)
+            else:
+                local_tz = timezone('Africa/Addis_Ababa')
+            self.snapshot = manpower_snapshot(
+                self.cr, self.uid, self.pool, self.date,
+                self.date_end or self.date, local_tz)
+        return self.snapshot.get(department_id)
 
     def get_present(self, department_id):
 
-        unique_ids = self.get_present_employees(department_id)
-
-        onleave_ids = self.get_employees_on_leave(department_id, self.LVCODES)
-
-        present_ids = [i for i in unique_ids if i not in onleave_ids]
-
-        total = len(present_ids)
+        total = self.get_counts(department_id)['present']
         self._present += total
         return total
 
-    def get_employee_start_date(self, employee_id):
-
-        first_day = False
-        c_obj = self.pool.get('hr.contract')
-        c_ids = c_obj.search(
-            self.cr, self.uid, [('employee_id', '=', employee_id)])
-        for contract in c_obj.browse(self.cr, self.uid, c_ids):
-            if not first_day or contract.date_start < first_day:
-                first_day = contract.date_start
-        return first_day
-
     def get_absent(self, department_id):
 
-        res = 0
-        ee_leave_ids = self.get_employees_on_leave(department_id, self.LVCODES)
-
-        ee_withsched_ids = []
-        att_obj = self.pool.get('hr.attendance')
-        sched_obj = self.pool.get('hr.schedule')
-        term_obj = self.pool.get('hr.employee.termination')
-        user = self.pool.get('res.users').browse(self.cr, self.uid, self.uid)
-        if user and user.tz:
-            local_tz = timezone(user.tz)
-        else:
-            local_tz = timezone('Africa/Addis_Ababa')
-        dt = datetime.strptime(self.date + ' 00:00:00', OE_DATETIMEFORMAT)
-        utcdt = (local_tz.localize(dt, is_dst=False)).astimezone(utc)
-        sched_ids = sched_obj.search(
-            self.cr, self.uid, [
-                ('date_start', '<=', self.date),
-                ('date_end', '>=', self.date),
-                '|',
-                ('employee_id.department_id.id', '=', department_id),
-                ('employee_id.saved_department_id.id', '=', department_id)
-            ]
-        )
-        for sched in sched_obj.browse(self.cr, self.uid, sched_ids):
-
-            if sched.employee_id.id not in ee_withsched_ids:
-                ee_withsched_ids.append(sched.employee_id.id)
-
-            # skip if the employee is on leave
-            if sched.employee_id.id in ee_leave_ids:
-                continue
-
-            # Skip if the employee wasn't hired yet
-            hire_date = self.get_employee_start_date(sched.employee_id.id)
-            if (not hire_date
-                    or (datetime.strptime(hire_date,
-                                          OE_DATEFORMAT).date() > dt.date())):
-                continue
-
-            rest_days = sched_obj.get_rest_days(
-                self.cr, self.uid, sched.employee_id.id, dt)
-
-            # if this is the employee's rest day skip it
-            if dt.weekday() in rest_days:
-                continue
-
-            # if this employee's employment was terminated skip it
-            term_ids = term_obj.search(
-                self.cr, self.uid, [
-                    ('name', '<=', self.date),
-                    ('employee_id.id', '=', sched.employee_id.id),
-                    ('state', 'not in', ['cancel'])
-                ]
-            )
-            if term_ids:
-                continue
-
-            # Did the employee punch in that day?
-            att_ids = att_obj.search(
-                self.cr, self.uid, [(
-                    'name', '>=', utcdt.strftime(OE_DATETIMEFORMAT)),
-                    ('name', '<', (utcdt + timedelta(hours=+24)).strftime(
-                        OE_DATETIMEFORMAT)),
-                    ('action', '=', 'sign_in'),
-                    ('employee_id.id', '=',
-                     sched.employee_id.id),
-                ])
-            if len(att_ids) == 0:
-                res += 1
-
-        # Get employees who don't have a schedule
-        ee_nosched_ids = self.pool.get('hr.employee').search(
-            self.cr, self.uid, [
-                '|',
-                ('department_id.id', '=', department_id),
-                ('saved_department_id.id', '=', department_id),
-                ('id', 'not in', ee_withsched_ids)
-            ]
-        )
-        for ee_id in ee_nosched_ids:
-
-            # skip if the employee is on leave
-            if ee_id in ee_leave_ids:
-                continue
-
-            # Skip if the employee wasn't hired yet
-            hire_date = self.get_employee_start_date(ee_id)
-            if (not hire_date
-                    or (datetime.strptime(hire_date,
-                                          OE_DATEFORMAT).date() > dt.date())):
-                continue
-
-            # if this employee's employment was terminated skip it
-            term_ids = term_obj.search(
-                self.cr, self.uid, [
-                    ('name', '<=', self.date),
-                    ('employee_id.id', '=', ee_id),
-                    ('state', 'not in', ['cancel'])
-                ]
-            )
-            if term_ids:
-                continue
-
-            att_ids = att_obj.search(
-                self.cr, self.uid, [
-                    ('name', '>=', utcdt.strftime(OE_DATETIMEFORMAT)),
-                    ('name', '<', (utcdt + timedelta(hours=+24)).strftime(
-                        OE_DATETIMEFORMAT)),
-                    ('action', '=', 'sign_in'),
-                    ('employee_id.id', '=', ee_id),
-                ]
-            )
-            if len(att_ids) == 0:
-                res += 1
-
+        res = self.get_counts(department_id)['absent']
         self._absent += res
         return res or '-'
 
-    def _on_leave(self, cr, uid, employee_id, d):
-
-        leave_obj = self.pool.get('hr.holidays')
-        user = self.pool.get('res.users').browse(cr, uid, uid)
-        if user and user.tz:
-            local_tz = timezone(user.tz)
-        else:
-            local_tz = timezone('Africa/Addis_Ababa')
-        dtStart = datetime.strptime(
-            d.strftime(OE_DATEFORMAT) + ' 00:00:00', OE_DATETIMEFORMAT)
-        utcdtStart = (local_tz.localize(dtStart, is_dst=False)).astimezone(utc)
-        utcdtNextStart = utcdtStart + timedelta(hours=+24)
-        leave_ids = leave_obj.search(
-            self.cr, self.uid, [
-                ('employee_id', '=', employee_id),
-                ('date_from', '<', utcdtNextStart.strftime(OE_DATETIMEFORMAT)),
-                ('date_to', '>=', utcdtStart.strftime(OE_DATETIMEFORMAT)),
-                ('type', '=', 'remove'),
-                ('state', 'in', ['validate', 'validate1']),
-            ]
-        )
-        return bool(leave_ids)
-
     def get_restday(self, department_id):
 
-        sched_obj = self.pool.get('hr.schedule')
-        user = self.pool.get('res.users').browse(self.cr, self.uid, self.uid)
-        if user and user.tz:
-            local_tz = timezone(user.tz)
-        else:
-            local_tz = timezone('Africa/Addis_Ababa')
-        dt = datetime.strptime(self.date + ' 00:00:00', OE_DATETIMEFORMAT)
-        utcdt = (local_tz.localize(dt, is_dst=False)).astimezone(utc)
-        sched_ids = sched_obj.search(
-            self.cr, self.uid, [
-                ('date_start', '<=', self.date),
-                ('date_end', '>=', self.date),
-                '|',
-                ('employee_id.department_id.id', '=', department_id),
-                ('employee_id.saved_department_id.id', '=', department_id)
-            ]
-        )
-        res = 0
-        otr = 0     # restday OT
-        for sched in sched_obj.browse(self.cr, self.uid, sched_ids):
-
-            # If the employee is on leave, skip it
-            if self._on_leave(
-                    self.cr, self.uid, sched.employee_id.id,
-                    datetime.strptime(self.date, OE_DATEFORMAT).date()):
-                continue
-
-            rest_days = sched_obj.get_rest_days(
-                self.cr, self.uid, sched.employee_id.id, dt)
-            if dt.weekday() in rest_days:
-                # Make sure the employee didn't punch in that day
-                att_ids = self.pool.get('hr.attendance').search(
-                    self.cr, self.uid, [
-                        ('name', '>=', utcdt.strftime(OE_DATETIMEFORMAT)),
-                        ('name', '<', (utcdt + timedelta(hours=+24)).strftime(
-                            OE_DATETIMEFORMAT)),
-                        ('action', '=', 'sign_in'),
-                        ('employee_id.id', '=', sched.employee_id.id),
-                    ]
-                )
-                if len(att_ids) == 0:
-                    res += 1
-                else:
-                    otr += 1
-
+        counts = self.get_counts(department_id)
+        res = counts['restday']
+        otr = counts['restday_ot']     # restday OT
         self._restday += res
         res_str = otr > 0 and str(res) + '(' + str(otr) + ')' or str(res)
         return (res or otr) and res_str or '-'
 
-    def _get_leave_ids(self, department_id, codes):
-
-        if isinstance(codes, str):
-            codes = [codes]
-
-        leave_obj = self.pool.get('hr.holidays')
-        user = self.pool.get('res.users').browse(self.cr, self.uid, self.uid)
-        if user and user.tz:
-            local_tz = timezone(user.tz)
-        else:
-            local_tz = timezone('Africa/Addis_Ababa')
-        dtStart = datetime.strptime(self.date + ' 00:00:00', OE_DATETIMEFORMAT)
-        utcdtStart = (local_tz.localize(dtStart, is_dst=False)).astimezone(utc)
-        utcdtNextStart = utcdtStart + timedelta(hours=+24)
-        leave_ids = leave_obj.search(
-            self.cr, self.uid, [
-                ('holiday_status_id.code', 'in', codes),
-                ('date_from', '<', utcdtNextStart.strftime(OE_DATETIMEFORMAT)),
-                ('date_to', '>=', utcdtStart.strftime(OE_DATETIMEFORMAT)),
-                ('type', '=', 'remove'),
-                ('state', 'in', ['validate', 'validate1']),
-                '|',
-                ('employee_id.department_id.id', '=', department_id),
-                ('employee_id.saved_department_id.id', '=', department_id)
-            ]
-        )
-        return leave_ids
-
-    def get_leave(self, department_id, codes):
-
-        leave_ids = self._get_leave_ids(department_id, codes)
-        res = len(leave_ids)
-        return res
-
-    def get_employees_on_leave(self, department_id, codes):
-
-        leave_ids = self._get_leave_ids(department_id, codes)
-
-        employee_ids = []
-        data = self.pool.get('hr.holidays').read(
-            self.cr, self.uid, leave_ids, ['employee_id'])
-        for d in data:
-            if (d.get('employee_id', False)
-                    and d['employee_id'][0] not in employee_ids):
-                employee_ids.append(d['employee_id'][0])
-
-        return employee_ids
-
     def get_al(self, department_id):
-        res = self.get_leave(department_id, 'LVANNUAL')
+        res = self.get_counts(department_id)['al']
         self._al += res
         return res or '-'
 
     def get_sl(self, department_id):
-        res = self.get_leave(department_id, ['LVSICK', 'LVSICK50', 'LVSICK00'])
+        res = self.get_counts(department_id)['sl']
         self._sl += res
         return res or '-'
 
     def get_ml(self, department_id):
-        res = self.get_leave(department_id, 'LVMATERNITY')
+        res = self.get_counts(department_id)['ml']
         self._ml += res
         return res or '-'
 
     def get_ol(self, department_id):
-        codes = ['LVBEREAVEMENT', 'LVWEDDING',
-                 'LVMMEDICAL', 'LVPTO', 'LVCIVIC']
-        res = self.get_leave(department_id, codes)
+        res = self.get_counts(department_id)['ol']
         self._ol += res
         return res or '-'
 
     def get_terminated(self, department_id):
-        res = 0
-        seen_ids = []
-        term_obj = self.pool.get('hr.employee.termination')
-        term_ids = term_obj.search(
-            self.cr, self.uid, [('name', '=', self.date)])
-        for term in term_obj.browse(self.cr, self.uid, term_ids):
-            if term.employee_id.department_id:
-                dep_id = term.employee_id.department_id.id
-            elif term.employee_id.saved_department_id:
-                dep_id = term.employee_id.saved_department_id.id
-            else:
-                dep_id = False
-            if term.employee_id.id not in seen_ids and dep_id == department_id:
-                res += 1
-                seen_ids.append(term.employee_id.id)
+        res = self.get_counts(department_id)['terminated']
         self._terminated += res
         return res or '-'
 
@@ -31,6 +31,10 @@ class hr_department_manpower(orm.TransientModel):
             'Start',
             required=True,
         ),
+        'date_end': fields.date(
+            'End',
+            help="Leave empty for the report of the start date only.",
+        ),
     }
 
     def print_report(self, cr, uid, ids, context=None):
@@ -20,7 +20,6 @@
 ##############################################################################
 
 from openerp.osv import orm
-from openerp.tools.safe_eval import safe_eval as eval
 from openerp.tools.translate import _
 
 
@@ -43,16 +42,28 @@ class hr_payslip(orm.Model):
 
         returns: fixed amount (a float) or a python object (most likely a dict)
         """
-        rule = self.pool['hr.salary.rule'].browse(
-            cr, uid, rule_id, context=context
-        )
+        variable_obj = self.pool['hr.salary.rule.variable']
 
         # Find the salary rule variable related to that rule for the
         # requested period
-        variable_list = [
-            variable for variable in rule.variable_ids
-            if variable.date_from <= date <= variable.date_to
-        ]
+        variable_list = variable_obj.find_rule_variables(
+            cr, uid, rule_id, date)
+        return self._get_variable_value(
+            cr, uid, rule_id, date, variable_list, localdict=localdict,
+            context=context)
+
+    def _get_variable_value(
+        self, cr, uid, rule_id, date, variable_list, localdict=False,
+        context=None
+    ):
+        """
+        Checks that exactly one variable of a salary rule applies on date and
+        returns its value
+        """
+        if len(variable_list) != 1:
+            rule = self.pool['hr.salary.rule'].browse(
+                cr, uid, rule_id, context=context
+            )
         if not variable_list:
             raise orm.except_orm(
                 _("Warning"),
@@ -68,10 +79,24 @@ The salary rule variable related to %s does not exist for the date %s""") %
                 (len(variable_list), rule.code, date)
             )
 
-        variable = variable_list[0]
-
         # Return the result whether the variable is fix or based on python code
-        if variable.type == 'python':
-            return eval(variable.python_code, localdict or {})
-        else:
-            return variable.fixed_amount
+        return self.pool['hr.salary.rule.variable'].get_variable_value(
+            cr, uid, variable_list[0], localdict=localdict)
+
+    def get_rule_variables(
+        self, cr, uid, ids, rule_dates, localdict=False, context=None
+    ):
+        """
+        Gets the salary rule variables for many (rule_id, date) pairs at
+        once, for instance to warm up the computation of a payroll register
+
+        returns: dict of the value of get_rule_variable() for each pair of
+        rule_dates
+        """
+        variables = self.pool['hr.salary.rule.variable'].find_variables(
+            cr, uid, rule_dates)
+        return dict(
+            ((rule_id, date), self._get_variable_value(
+                cr, uid, rule_id, date, variable_list, localdict=localdict,
+                context=context))
+            for (rule_id, date), variable_list in variables.iteritems())
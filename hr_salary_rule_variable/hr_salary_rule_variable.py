@@ -19,7 +19,11 @@
 #
 ##############################################################################
 
+from bisect import bisect_right
+
+from openerp import tools
 from openerp.osv import fields, orm
+from openerp.tools.safe_eval import safe_eval
 
 
 class hr_salary_rule_variable(orm.Model):
@@ -53,3 +57,95 @@ class hr_salary_rule_variable(orm.Model):
             'Fixed Amount'
         ),
     }
+
+    @tools.ormcache(skiparg=3)
+    def get_rule_intervals(self, cr, uid, rule_id):
+        """Return the variables of a salary rule as three tuples: their
+        start dates, sorted; the matching (date_from, date_to, variable)
+        tuples; and the greatest date_to among each variable and those
+        before it. A variable is a (type, fixed_amount, python_code) tuple.
+
+        Variables without an end date never apply, they are left out.
+        """
+
+        cr.execute("""\
+SELECT date_from, date_to, type, fixed_amount, python_code
+FROM hr_salary_rule_variable
+WHERE salary_rule_id = %s
+  AND date_to IS NOT NULL
+ORDER BY date_from, id""", (rule_id,))
+        starts, intervals, max_to = [], [], []
+        for date_from, date_to, vtype, fixed_amount, python_code in \
+                cr.fetchall():
+            starts.append(date_from)
+            intervals.append((date_from, date_to, (
+                vtype, fixed_amount or 0.0, python_code or False)))
+            max_to.append(max_to and max(max_to[-1], date_to) or date_to)
+        return tuple(starts), tuple(intervals), tuple(max_to)
+
+    def find_rule_variables(self, cr, uid, rule_id, date):
+        """Return the variables of a salary rule that apply on date, as
+        returned by get_rule_intervals()."""
+
+        starts, intervals, max_to = self.get_rule_intervals(cr, uid, rule_id)
+        res = []
+        # Walk back from the last variable starting on or before date for
+        # as long as a variable may still end on or after it
+        i = bisect_right(starts, date) - 1
+        while i >= 0 and max_to[i] >= date:
+            if intervals[i][1] >= date:
+                res.append(intervals[i][2])
+            i -= 1
+        res.reverse()
+        return res
+
+    def find_variables(self, cr, uid, rule_dates):
+        """Return the variables that apply for many (rule id, date) pairs at
+        once, with a single query, as a dict of the lists that
+        find_rule_variables() would return for each pair."""
+
+        res = dict((key, []) for key in rule_dates)
+        if not res:
+            return res
+        keys = list(res)
+        cr.execute("""\
+SELECT r.i, v.type, v.fixed_amount, v.python_code
+FROM (VALUES """ + ', '.join(['%s'] * len(keys)) + """)
+    AS r (i, rule_id, day)
+  JOIN hr_salary_rule_variable v ON v.salary_rule_id = r.rule_id
+    AND v.date_from <= r.day::date
+    AND v.date_to >= r.day::date
+ORDER BY r.i, v.date_from, v.id""", [
+            (i, rule_id, str(date)[:10])
+            for i, (rule_id, date) in enumerate(keys)])
+        for i, vtype, fixed_amount, python_code in cr.fetchall():
+            res[keys[i]].append(
+                (vtype, fixed_amount or 0.0, python_code or False))
+        return res
+
+    def get_variable_value(self, cr, uid, variable, localdict=False):
+        """Return the value of a variable as returned by
+        find_rule_variables()."""
+
+        vtype, fixed_amount, python_code = variable
+        if vtype != 'python':
+            return fixed_amount
+        return safe_eval(python_code, localdict or {})
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(hr_salary_rule_variable, self).create(
+            cr, uid, vals, context=context)
+        self.clear_caches()
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(hr_salary_rule_variable, self).write(
+            cr, uid, ids, vals, context=context)
+        self.clear_caches()
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(hr_salary_rule_variable, self).unlink(
+            cr, uid, ids, context=context)
+        self.clear_caches()
+        return res
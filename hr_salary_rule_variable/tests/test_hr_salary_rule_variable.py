@@ -19,6 +19,7 @@
 #
 ##############################################################################
 
+from openerp.osv import orm
 from openerp.tests import common
 
 
@@ -213,3 +214,32 @@ result = variable[0]
 
             else:
                 self.assertTrue(False)
+
+    def test_get_rule_variables(self):
+        cr, uid, context = self.cr, self.uid, self.context
+
+        res = self.payslip_model.get_rule_variables(
+            cr, uid, [self.payslip_id], [
+                (self.rule_id, '2014-01-15'),
+                (self.rule_2_id, '2014-01-31'),
+                (self.rule_id, '2014-02-01'),
+                (self.rule_2_id, '2014-02-28'),
+            ], context=context)
+
+        self.assertEqual(res[(self.rule_id, '2014-01-15')], 500)
+        self.assertEqual(res[(self.rule_2_id, '2014-01-31')], 75)
+        self.assertEqual(res[(self.rule_id, '2014-02-01')], {'TEST': 200})
+        self.assertEqual(res[(self.rule_2_id, '2014-02-28')], [300])
+
+        # The variables are looked up again once they change
+        self.variable_model.write(
+            cr, uid, [self.variables[1]], {'fixed_amount': 600},
+            context=context)
+        self.assertEqual(self.payslip_model.get_rule_variable(
+            cr, uid, [self.payslip_id], self.rule_id, '2014-01-15',
+            context=context), 600)
+
+        self.assertRaises(
+            orm.except_orm, self.payslip_model.get_rule_variable,
+            cr, uid, [self.payslip_id], self.rule_id, '2014-03-01',
+            context=context)
@@ -0,0 +1,125 @@
+# -*- coding:utf-8 -*-
+#
+#
+#    Copyright (C) 2013 Michael Telahun Makonnen <mmakonnen@gmail.com>.
+#    All Rights Reserved.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+"""Multi-row SQL statements for the modules that create, check or update
+records in bulk, and the workflow bookkeeping of records inserted that
+way."""
+
+from openerp import SUPERUSER_ID
+from openerp.osv import fields
+from openerp.tools.misc import split_every
+
+# Maximum number of rows sent in one multi-row statement
+BATCH_SIZE = 1000
+
+
+def execute_values(cr, query, rows, fetch=False):
+    """Execute query for rows, a list of tuples, in batches of at most
+    BATCH_SIZE rows. The single %s of query is replaced by the VALUES list
+    of each batch, e.g. "INSERT INTO t (a, b) VALUES %s". Returns the rows
+    fetched from all the batches if fetch is True.
+    """
+
+    res = []
+    for chunk in split_every(BATCH_SIZE, rows):
+        cr.execute(query % ', '.join(['%s'] * len(chunk)), chunk)
+        if fetch:
+            res.extend(cr.fetchall())
+    return res
+
+
+def insert_rows(cr, uid, table, columns, rows):
+    """Insert rows, tuples of values for columns, into the table of a
+    model with multi-row INSERT statements. The log access columns are
+    filled in for uid. Returns the ids of the new rows, in the order of
+    rows.
+    """
+
+    now = fields.datetime.now()
+    query = (
+        'INSERT INTO ' + table + ' (' + ', '.join(columns) +
+        ', create_uid, create_date, write_uid, write_date) '
+        'VALUES %s RETURNING id'
+    )
+    return [r[0] for r in execute_values(
+        cr, query, [tuple(row) + (uid, now, uid, now) for row in rows],
+        fetch=True)]
+
+
+def create_workflow_instances(cr, uid, model_name, res_ids):
+    """Create, in bulk, the workflow instances the ORM would have created
+    for records of model_name inserted with plain SQL. The instances are
+    left on the start activity, whose action is expected to have no effect
+    on a freshly inserted record (e.g. write({'state': 'draft'})).
+    """
+
+    if not res_ids:
+        return
+    cr.execute("""\
+SELECT w.id, a.id
+FROM wkf w
+  JOIN wkf_activity a ON a.wkf_id = w.id
+WHERE w.osv = %s
+  AND w.on_create = true
+  AND a.flow_start = true""", (model_name,))
+    for wkf_id, act_id in cr.fetchall():
+        cr.execute("""\
+INSERT INTO wkf_instance (res_type, res_id, uid, wkf_id, state)
+SELECT %s, res_id, %s, %s, 'active'
+FROM unnest(%s) AS res_id
+RETURNING id""", (model_name, uid, wkf_id, list(res_ids)))
+        inst_ids = [r[0] for r in cr.fetchall()]
+        cr.execute("""\
+INSERT INTO wkf_workitem (act_id, inst_id, state)
+SELECT %s, inst_id, 'complete'
+FROM unnest(%s) AS inst_id""", (act_id, inst_ids))
+
+
+def signal_workflow_bulk(cr, uid, model_name, res_ids, signal):
+    """Move, in bulk, the workflow instances of records of model_name
+    through the unconditional transitions triggered by signal, as
+    trg_validate() would have one record at a time. Only the workitems are
+    moved: the caller applies the action of the destination activity (e.g.
+    write({'state': 'locked'})) to the records whose ids are returned.
+    """
+
+    if not res_ids:
+        return []
+    cr.execute("""\
+UPDATE wkf_workitem wi
+SET act_id = t.act_to
+FROM wkf_instance i, wkf_transition t
+WHERE i.id = wi.inst_id
+  AND i.res_type = %s
+  AND i.res_id = ANY(%s)
+  AND i.state = 'active'
+  AND wi.state = 'complete'
+  AND t.act_from = wi.act_id
+  AND t.signal = %s
+  AND t.condition = 'True'
+  AND (t.group_id IS NULL
+       OR %s = %s
+       OR t.group_id IN (SELECT gid
+                         FROM res_groups_users_rel
+                         WHERE uid = %s))
+RETURNING i.res_id""", (model_name, list(res_ids), signal, uid,
+                        SUPERUSER_ID, uid))
+    return [r[0] for r in cr.fetchall()]
@@ -19,19 +19,23 @@
 #
 #
 
+import Queue
+import threading
 import time
 
-
+from bisect import bisect_left
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from pytz import timezone, utc
 
-from openerp import netsvc
+from openerp import api, netsvc, tools
 from openerp.osv import fields, orm
 from openerp.tools import DEFAULT_SERVER_DATETIME_FORMAT as OE_DTFORMAT
 from openerp.tools import DEFAULT_SERVER_DATE_FORMAT as OE_DFORMAT
 from openerp.tools.translate import _
 
+from .bulk import create_workflow_instances, execute_values, insert_rows
+
 import logging
 _logger = logging.getLogger(__name__)
 
@@ -45,6 +49,59 @@ DAYOFWEEK_SELECTION = [
     ('6', 'Sunday'),
 ]
 
+# Default number of employees per committed chunk of create_mass_schedule
+MASS_SCHEDULE_CHUNK_SIZE = 200
+# Number of times a chunk of create_mass_schedule is tried before it is
+# given up on
+MASS_SCHEDULE_MAX_ATTEMPTS = 3
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def _local_day(utcdt, local_tz):
+    """Return the local date of a naive UTC datetime."""
+    return utc.localize(utcdt).astimezone(local_tz).date()
+
+
+def _continue_from(prevutcdtStart, minutes):
+    """Return the first datetime after prevutcdtStart whose time of day
+    is minutes past midnight, keeping the seconds of prevutcdtStart.
+    """
+    delta_seconds = (
+        (minutes - prevutcdtStart.hour * 60 - prevutcdtStart.minute) * 60
+    ) % SECONDS_PER_DAY
+    return prevutcdtStart + timedelta(seconds=+delta_seconds)
+
+
+def _build_leave_index(leaves):
+    """Index a list of (type, date_from, date_to) leaves for
+    _first_overlapping_leave(). Leaves are taken in the default order of
+    hr.holidays (type desc, date_from asc); each type group keeps its
+    intervals sorted by start along with the running maximum of the ends.
+    """
+    index = []
+    for leave_type in sorted(set(lv[0] for lv in leaves), reverse=True):
+        intervals = sorted(
+            [(lv[1], lv[2]) for lv in leaves if lv[0] == leave_type],
+            key=lambda i: i[0])
+        max_ends = []
+        for dtFrom, dtTo in intervals:
+            max_ends.append(max(dtTo, max_ends[-1]) if max_ends else dtTo)
+        index.append((intervals, max_ends))
+    return index
+
+
+def _first_overlapping_leave(index, dtStart, dtEnd):
+    """Return the first leave, in hr.holidays order, that overlaps the
+    interval [dtStart, dtEnd], or None.
+    """
+    for intervals, max_ends in index:
+        # First leave ending at or after dtStart
+        i = bisect_left(max_ends, dtStart)
+        if i < len(intervals) and intervals[i][0] <= dtEnd:
+            return intervals[i]
+    return None
+
 
 class week_days(orm.Model):
 
@@ -323,6 +380,73 @@ WHERE (date_start <= %s and %s <= date_end)
 
         return res
 
+    def get_rest_days_bulk(self, cr, uid, keys, context=None):
+        """Same as get_rest_days_by_id() for many (schedule id, week start)
+        pairs at once. Returns a dictionary of the list of rest days of
+        each pair, read with one query for the rest days and one for the
+        schedule details of all the schedules.
+        """
+
+        res = {}
+        sched_ids = tuple(set(k[0] for k in keys))
+        if not sched_ids:
+            return res
+
+        cr.execute("""\
+SELECT id, date_start
+FROM hr_schedule
+WHERE id IN %s""", (sched_ids,))
+        sched_starts = dict(cr.fetchall())
+
+        restdays = {}
+        cr.execute(' UNION ALL '.join([
+            """\
+SELECT r.sched_id, %d, w.sequence
+FROM schedule_restdays_rel%d r
+  JOIN hr_schedule_weekday w ON w.id = r.weekday_id
+WHERE r.sched_id IN %%(ids)s""" % (week, week + 1)
+            for week in xrange(5)
+        ]), {'ids': sched_ids})
+        for sched_id, week, sequence in cr.fetchall():
+            restdays.setdefault((sched_id, week), []).append(sequence)
+
+        details = {}
+        cr.execute("""\
+SELECT schedule_id, date_start, dayofweek
+FROM hr_schedule_detail
+WHERE schedule_id IN %s
+ORDER BY schedule_id, date_start, dayofweek""", (sched_ids,))
+        for sched_id, date_start, dayofweek in cr.fetchall():
+            details.setdefault(sched_id, []).append((date_start, dayofweek))
+
+        for sched_id, week_start in keys:
+            dtls = details.get(sched_id)
+            if not dtls:
+                res[(sched_id, week_start)] = []
+                continue
+
+            # Explicit rest days of the n-th week of the schedule
+            dSchedStart = datetime.strptime(
+                sched_starts[sched_id], OE_DFORMAT).date()
+            dWeekStart = datetime.strptime(week_start, OE_DFORMAT).date()
+            week = (dWeekStart - dSchedStart).days
+            if week % 7 == 0 and (sched_id, week // 7) in restdays:
+                res[(sched_id, week_start)] = restdays[(sched_id, week // 7)]
+                continue
+
+            # Otherwise the week days without schedule details
+            first_day = dtls[0][0]
+            date_start = first_day[:10] < week_start \
+                and week_start + first_day[10:] or first_day
+            next_week = (datetime.strptime(date_start, OE_DTFORMAT)
+                         + relativedelta(weeks=+1)).strftime(OE_DTFORMAT)
+            scheddays = set(dayofweek for dtl_start, dayofweek in dtls
+                            if week_start <= dtl_start < next_week)
+            days = [d for d in xrange(7) if str(d) not in scheddays]
+            res[(sched_id, week_start)] = len(days) < 7 and days or []
+
+        return res
+
     def onchange_employee_start_date(
             self, cr, uid, ids, employee_id, date_start, context=None):
 
@@ -394,156 +518,267 @@ WHERE (date_start <= %s and %s <= date_end)
 
         return
 
-    def create_details(self, cr, uid, sched_id, context=None):
+    def _parse_worktime(self, worktime):
+        """Return the start hour, start minute and length in seconds of
+        a template working time.
+        """
+
+        hour, sep, minute = worktime.hour_from.partition(':')
+        toHour, toSep, toMin = worktime.hour_to.partition(':')
+        if len(sep) == 0 or len(toSep) == 0:
+            raise orm.except_orm(
+                _('Invalid Time Format'),
+                _('The time should be entered as HH:MM')
+            )
+        fromMinutes = int(hour) * 60 + int(minute)
+        toMinutes = int(toHour) * 60 + int(toMin)
+        return (int(hour), int(minute),
+                ((toMinutes - fromMinutes) * 60) % SECONDS_PER_DAY)
+
+    def _expand_template_week(self, template, local_tz, dWeekStart, cache):
+        """Expand the working times of a template for the week beginning
+        on dWeekStart into a list of slots, cached in cache by (template,
+        timezone, week). Each slot is a tuple of (dayofweek, continuation,
+        UTC start, length in seconds, UTC start in minutes of the day
+        before any continuation adjustment, local day), where UTC start and
+        local day assume that no leave has shifted the previous slot.
+        """
+
+        key = (template.id, local_tz.zone, dWeekStart)
+        if key in cache:
+            return cache[key]
+
+        parsed = cache.setdefault(('worktimes', template.id), [
+            (wt.dayofweek,) + self._parse_worktime(wt)
+            for wt in template.worktime_ids
+        ])
+
+        slots = []
+        prevDayofWeek = False
+        prevutcdtStart = False
+        for dayofweek, hour, minute, seconds in parsed:
+
+            # TODO - Someone affected by DST should fix this
+            #
+            dtStart = datetime(
+                dWeekStart.year, dWeekStart.month, dWeekStart.day,
+                hour, minute)
+            utcdtStart = local_tz.localize(
+                dtStart, is_dst=False).astimezone(utc).replace(tzinfo=None)
+            utcdtStart += timedelta(days=int(dayofweek))
+            rawMinutes = utcdtStart.hour * 60 + utcdtStart.minute
+            dtDaySource = utcdtStart
+
+            # If this worktime is a continuation (i.e - after lunch) set the
+            # start time based on the difference from the previous record
+            #
+            continuation = bool(
+                prevDayofWeek and prevDayofWeek == dayofweek)
+            if continuation:
+                utcdtStart = _continue_from(prevutcdtStart, rawMinutes)
+                dtDaySource = prevutcdtStart
+
+            slots.append((
+                dayofweek, continuation, utcdtStart, seconds, rawMinutes,
+                _local_day(dtDaySource, local_tz),
+            ))
+            prevDayofWeek = dayofweek
+            prevutcdtStart = utcdtStart
+
+        cache[key] = slots
+        return slots
+
+    def _cut_leaves(self, slots, leave_index, local_tz):
+        """Lay the slots of a template week on the employee's calendar
+        and leave empty holes where there are leaves. Returns a list of
+        (dayofweek, day, UTC start, UTC end) tuples.
+        """
+
+        res = []
+        prevSlotStart = False
+        prevutcdtStart = False
+        for (dayofweek, continuation, slotStart, seconds, rawMinutes,
+                dDay) in slots:
+
+            utcdtStart = slotStart
+            if continuation and prevutcdtStart != prevSlotStart:
+                # The previous slot was cut short by a leave
+                utcdtStart = _continue_from(prevutcdtStart, rawMinutes)
+                dDay = _local_day(prevutcdtStart, local_tz)
+            utcdtEnd = utcdtStart + timedelta(seconds=+seconds)
+
+            _skip = False
+            leave = _first_overlapping_leave(
+                leave_index, utcdtStart, utcdtEnd)
+            if leave:
+                utcdtFrom, utcdtTo = leave
+                if utcdtFrom <= utcdtStart and utcdtTo >= utcdtEnd:
+                    _skip = True
+                elif utcdtStart < utcdtFrom <= utcdtEnd:
+                    if utcdtTo == utcdtEnd:
+                        _skip = True
+                    else:
+                        utcdtEnd = utcdtFrom + timedelta(seconds=-1)
+                else:
+                    utcdtStart = utcdtTo + timedelta(seconds=+1)
+
+            if not _skip:
+                res.append((dayofweek, dDay, utcdtStart, utcdtEnd))
+
+            prevSlotStart = slotStart
+            prevutcdtStart = utcdtStart
+
+        return res
+
+    def _get_leave_indexes(self, cr, uid, schedules, context=None):
+        """Return a dictionary keyed by schedule id of the leave indexes
+        (see _build_leave_index()) of the leaves overlapping each schedule,
+        loaded with a single search for all of the schedules.
+        """
 
         leave_obj = self.pool.get('hr.holidays')
-        schedule = self.browse(cr, uid, sched_id, context=context)
-        if schedule.template_id:
-            leaves = []
-            leave_ids = leave_obj.search(
-                cr, uid, [('employee_id', '=', schedule.employee_id.id),
-                          ('date_from', '<=', schedule.date_end),
-                          ('date_to', '>=', schedule.date_start),
-                          ('state', 'in', ['draft', 'validate', 'validate1'])],
-                context=context)
-            for lv in leave_obj.browse(cr, uid, leave_ids, context=context):
-                utcdtFrom = utc.localize(
-                    datetime.strptime(lv.date_from, OE_DTFORMAT), is_dst=False)
-                utcdtTo = utc.localize(
-                    datetime.strptime(lv.date_to, OE_DTFORMAT), is_dst=False)
-                leaves.append((utcdtFrom, utcdtTo))
 
-            user = self.pool.get('res.users').browse(
-                cr, uid, uid, context=context)
-            local_tz = timezone(user.tz)
+        res = dict((s.id, []) for s in schedules)
+        if not schedules:
+            return res
+
+        leave_ids = leave_obj.search(
+            cr, uid, [
+                ('employee_id', 'in', list(
+                    set(s.employee_id.id for s in schedules))),
+                ('date_from', '<=', max(s.date_end for s in schedules)),
+                ('date_to', '>=', min(s.date_start for s in schedules)),
+                ('state', 'in', ['draft', 'validate', 'validate1']),
+            ], context=context)
+        leaves_by_employee = {}
+        for lv in leave_obj.read(
+                cr, uid, leave_ids,
+                ['employee_id', 'type', 'date_from', 'date_to'],
+                context=context):
+            leaves_by_employee.setdefault(
+                lv['employee_id'][0], []).append(lv)
+
+        for sched in schedules:
+            # Same bounds as a search on this schedule alone: the dates are
+            # compared to the datetimes at midnight.
+            strStart = sched.date_start + ' 00:00:00'
+            strEnd = sched.date_end + ' 00:00:00'
+            res[sched.id] = _build_leave_index([
+                (lv['type'],
+                 datetime.strptime(lv['date_from'], OE_DTFORMAT),
+                 datetime.strptime(lv['date_to'], OE_DTFORMAT))
+                for lv in leaves_by_employee.get(sched.employee_id.id, [])
+                if lv['date_from'] <= strEnd and lv['date_to'] >= strStart
+            ])
+
+        return res
+
+    def create_details(self, cr, uid, sched_id, context=None):
+
+        if isinstance(sched_id, (int, long)):
+            sched_id = [sched_id]
+        return self.create_details_batch(cr, uid, sched_id, context=context)
+
+    def create_details_batch(self, cr, uid, ids, context=None):
+        """Create the schedule details of all the schedules in ids from
+        their templates. Each (template, timezone, week) is expanded only
+        once and all the details are inserted together.
+        """
+
+        detail_obj = self.pool.get('hr.schedule.detail')
+
+        schedules = [
+            s for s in self.browse(cr, uid, ids, context=context)
+            if s.template_id
+        ]
+        if not schedules:
+            return True
+
+        user = self.pool.get('res.users').browse(
+            cr, uid, uid, context=context)
+        local_tz = timezone(user.tz)
+        leave_indexes = self._get_leave_indexes(
+            cr, uid, schedules, context=context)
+
+        cache = {}
+        detail_vals = []
+        for schedule in schedules:
             dCount = datetime.strptime(schedule.date_start, '%Y-%m-%d').date()
             dCountEnd = datetime.strptime(schedule.date_end, '%Y-%m-%d').date()
             dWeekStart = dCount
-            dSchedStart = dCount
+            restday_vals = {}
+            week = 0
             while dCount <= dCountEnd:
 
                 # Enter the rest day(s)
                 #
-                if dCount == dSchedStart:
-                    self.add_restdays(
-                        cr, uid, schedule, 'restday_ids1', context=context)
-                elif dCount == dSchedStart + relativedelta(days=+7):
-                    self.add_restdays(
-                        cr, uid, schedule, 'restday_ids2', context=context)
-                elif dCount == dSchedStart + relativedelta(days=+14):
-                    self.add_restdays(
-                        cr, uid, schedule, 'restday_ids3', context=context)
-                elif dCount == dSchedStart + relativedelta(days=+21):
-                    self.add_restdays(
-                        cr, uid, schedule, 'restday_ids4', context=context)
-                elif dCount == dSchedStart + relativedelta(days=+28):
-                    self.add_restdays(
-                        cr, uid, schedule, 'restday_ids5', context=context)
-
-                prevutcdtStart = False
-                prevDayofWeek = False
-                for worktime in schedule.template_id.worktime_ids:
-
-                    hour, sep, minute = worktime.hour_from.partition(':')
-                    toHour, toSep, toMin = worktime.hour_to.partition(':')
-                    if len(sep) == 0 or len(toSep) == 0:
-                        raise orm.except_orm(
-                            _('Invalid Time Format'),
-                            _('The time should be entered as HH:MM')
-                        )
-
-                    # TODO - Someone affected by DST should fix this
-                    #
-                    dtStart = datetime.strptime(dWeekStart.strftime(
-                        '%Y-%m-%d') + ' ' + hour + ':' + minute + ':00',
-                        '%Y-%m-%d %H:%M:%S')
-                    locldtStart = local_tz.localize(dtStart, is_dst=False)
-                    utcdtStart = locldtStart.astimezone(utc)
-                    if worktime.dayofweek != 0:
-                        utcdtStart = utcdtStart + \
-                            relativedelta(days=+int(worktime.dayofweek))
-                    dDay = utcdtStart.astimezone(local_tz).date()
-
-                    # If this worktime is a continuation (i.e - after lunch)
-                    # set the start time based on the difference from the
-                    # previous record
-                    #
-                    if prevDayofWeek and prevDayofWeek == worktime.dayofweek:
-                        prevHour = prevutcdtStart.strftime('%H')
-                        prevMin = prevutcdtStart.strftime('%M')
-                        curHour = utcdtStart.strftime('%H')
-                        curMin = utcdtStart.strftime('%M')
-                        delta_seconds = (
-                            datetime.strptime(curHour + ':' + curMin, '%H:%M')
-                            - datetime.strptime(prevHour + ':' + prevMin,
-                                                '%H:%M')).seconds
-                        utcdtStart = prevutcdtStart + \
-                            timedelta(seconds=+delta_seconds)
-                        dDay = prevutcdtStart.astimezone(local_tz).date()
-
-                    delta_seconds = (datetime.strptime(toHour + ':' + toMin,
-                                                       '%H:%M')
-                                     - datetime.strptime(hour + ':' + minute,
-                                                         '%H:%M')).seconds
-                    utcdtEnd = utcdtStart + timedelta(seconds=+delta_seconds)
-
-                    # Leave empty holes where there are leaves
-                    #
-                    _skip = False
-                    for utcdtFrom, utcdtTo in leaves:
-                        if utcdtFrom <= utcdtStart and utcdtTo >= utcdtEnd:
-                            _skip = True
-                            break
-                        elif utcdtStart < utcdtFrom <= utcdtEnd:
-                            if utcdtTo == utcdtEnd:
-                                _skip = True
-                            else:
-                                utcdtEnd = utcdtFrom + timedelta(seconds=-1)
-                            break
-                        elif utcdtStart <= utcdtTo < utcdtEnd:
-                            if utcdtTo == utcdtEnd:
-                                _skip = True
-                            else:
-                                utcdtStart = utcdtTo + timedelta(seconds=+1)
-                            break
-                    if not _skip:
-                        val = {
-                            'name': schedule.name,
-                            'dayofweek': worktime.dayofweek,
-                            'day': dDay,
-                            'date_start': utcdtStart.strftime(
-                                '%Y-%m-%d %H:%M:%S'),
-                            'date_end': utcdtEnd.strftime(
-                                '%Y-%m-%d %H:%M:%S'),
-                            'schedule_id': sched_id,
-                        }
-                        self.write(cr, uid, sched_id, {
-                                   'detail_ids': [(0, 0, val)]},
-                                   context=context)
-
-                    prevDayofWeek = worktime.dayofweek
-                    prevutcdtStart = utcdtStart
+                week += 1
+                if week <= 5 and schedule.template_id.restday_ids:
+                    restday_vals['restday_ids%d' % week] = [(6, 0, [
+                        rd.id for rd in schedule.template_id.restday_ids
+                    ])]
+
+                slots = self._expand_template_week(
+                    schedule.template_id, local_tz, dWeekStart, cache)
+                for dayofweek, dDay, utcdtStart, utcdtEnd in self._cut_leaves(
+                        slots, leave_indexes[schedule.id], local_tz):
+                    detail_vals.append({
+                        'name': schedule.name,
+                        'dayofweek': dayofweek,
+                        'day': dDay.strftime(OE_DFORMAT),
+                        'date_start': utcdtStart.strftime(OE_DTFORMAT),
+                        'date_end': utcdtEnd.strftime(OE_DTFORMAT),
+                        'schedule_id': schedule.id,
+                        'employee_id': schedule.employee_id.id,
+                        'department_id': schedule.department_id.id,
+                    })
 
                 dCount = dWeekStart + relativedelta(weeks=+1)
                 dWeekStart = dCount
+
+            if restday_vals:
+                self.write(cr, uid, schedule.id, restday_vals,
+                           context=context)
+
+        detail_obj.create_bulk(cr, uid, detail_vals, context=context)
         return True
 
     def create(self, cr, uid, vals, context=None):
 
         my_id = super(hr_schedule, self).create(cr, uid, vals, context=context)
 
-        self.create_details(cr, uid, my_id, context=context)
+        # Callers creating many schedules at once generate the details of
+        # all of them together afterwards with create_details_batch().
+        if not (context and context.get('hr_schedule_no_details')):
+            self.create_details(cr, uid, my_id, context=context)
 
         return my_id
 
-    def create_mass_schedule(self, cr, uid, context=None):
+    def create_mass_schedule(
+            self, cr, uid, chunk_size=None, workers=None, context=None):
         """Creates tentative schedules for all employees based on the
         schedule template attached to their contract. Called from the
         scheduler.
+
+        The employees are processed in chunks of chunk_size, each one
+        committed in its own transaction and tracked by an
+        hr.schedule.generation run, so that a failed or interrupted run
+        resumes with the chunks that were not committed. With more than
+        one worker the chunks are spread over a pool of threads, each
+        with its own database cursor.
         """
 
-        sched_obj = self.pool.get('hr.schedule')
-        ee_obj = self.pool.get('hr.employee')
+        run_obj = self.pool.get('hr.schedule.generation')
+        param_obj = self.pool.get('ir.config_parameter')
+
+        if chunk_size is None:
+            chunk_size = int(param_obj.get_param(
+                cr, uid, 'hr_schedule.mass_schedule_chunk_size',
+                default=MASS_SCHEDULE_CHUNK_SIZE, context=context))
+        if workers is None:
+            workers = int(param_obj.get_param(
+                cr, uid, 'hr_schedule.mass_schedule_workers',
+                default=1, context=context))
 
         # Create a two-week schedule beginning from Monday of next week.
         #
@@ -553,33 +788,26 @@ WHERE (date_start <= %s and %s <= date_end)
         dStart = dt.date()
         dEnd = dStart + relativedelta(weeks=+2, days=-1)
 
-        # Create schedules for each employee in each department
+        # Resume the runs that did not complete before starting this one.
+        # The run and its chunks are committed before any chunk is
+        # processed.
         #
-        dept_ids = self.pool.get('hr.department').search(cr, uid, [],
-                                                         context=context)
-        for dept in self.pool.get('hr.department').browse(cr, uid, dept_ids,
-                                                          context=context):
-            ee_ids = ee_obj.search(cr, uid, [
-                ('department_id', '=', dept.id),
-            ], order="name", context=context)
-            if len(ee_ids) == 0:
-                continue
-
-            for ee in ee_obj.browse(cr, uid, ee_ids, context=context):
-
-                if (not ee.contract_id
-                        or not ee.contract_id.schedule_template_id):
-                    continue
-
-                sched = {
-                    'name': (ee.name + ': ' + dStart.strftime('%Y-%m-%d') +
-                             ' Wk ' + str(dStart.isocalendar()[1])),
-                    'employee_id': ee.id,
-                    'template_id': ee.contract_id.schedule_template_id.id,
-                    'date_start': dStart.strftime('%Y-%m-%d'),
-                    'date_end': dEnd.strftime('%Y-%m-%d'),
-                }
-                sched_obj.create(cr, uid, sched, context=context)
+        with api.Environment.manage():
+            new_cr = self.pool.cursor()
+            try:
+                run_ids = run_obj.search(
+                    new_cr, uid, [('state', 'in', ['running', 'failed'])],
+                    order='date_start, id', context=context)
+                run_id = run_obj._get_run(
+                    new_cr, uid, dStart, dEnd, chunk_size, context=context)
+                if run_id and run_id not in run_ids:
+                    run_ids.append(run_id)
+                new_cr.commit()
+            finally:
+                new_cr.close()
+
+        return run_obj.process_runs(
+            cr, uid, run_ids, workers=workers, context=context)
 
     def deletable(self, cr, uid, sched_id, context=None):
 
@@ -676,6 +904,289 @@ WHERE (date_start <= %s and %s <= date_end)
         return all_locked is False
 
 
+class hr_schedule_generation(orm.Model):
+
+    _name = 'hr.schedule.generation'
+    _description = 'Mass Schedule Generation Run'
+    _order = 'date_start desc, id desc'
+
+    _columns = {
+        'date_start': fields.date(
+            'Start Date',
+            required=True,
+            readonly=True,
+        ),
+        'date_end': fields.date(
+            'End Date',
+            required=True,
+            readonly=True,
+        ),
+        'chunk_size': fields.integer(
+            'Chunk Size',
+            readonly=True,
+        ),
+        'chunk_ids': fields.one2many(
+            'hr.schedule.generation.chunk',
+            'run_id',
+            'Chunks',
+            readonly=True,
+        ),
+        'state': fields.selection(
+            [
+                ('running', 'Running'),
+                ('done', 'Done'),
+                ('failed', 'Failed'),
+                ('error', 'Given Up'),
+            ],
+            'State',
+            required=True,
+            readonly=True,
+        ),
+    }
+    _defaults = {
+        'state': 'running',
+    }
+
+    def _get_run(self, cr, uid, dStart, dEnd, chunk_size, context=None):
+        """Return the id of the run creating schedules from dStart to dEnd,
+        or False if it has already completed or been given up on. A new
+        run is created, with the employees of every department split into
+        chunks of chunk_size, if there is none yet.
+        """
+
+        ee_obj = self.pool.get('hr.employee')
+
+        run_ids = self.search(
+            cr, uid, [
+                ('date_start', '=', dStart.strftime(OE_DFORMAT)),
+                ('date_end', '=', dEnd.strftime(OE_DFORMAT)),
+            ], context=context)
+        if run_ids:
+            run = self.browse(cr, uid, run_ids[0], context=context)
+            return run.state in ('running', 'failed') and run.id
+
+        ee_ids = ee_obj.search(
+            cr, uid, [('department_id', '!=', False)],
+            order='department_id, name', context=context)
+        chunk_size = max(chunk_size, 1)
+        chunks = []
+        for i in xrange(0, len(ee_ids), chunk_size):
+            chunks.append((0, 0, {
+                'sequence': len(chunks) + 1,
+                'employee_ids': [(6, 0, ee_ids[i:i + chunk_size])],
+            }))
+        return self.create(
+            cr, uid, {
+                'date_start': dStart.strftime(OE_DFORMAT),
+                'date_end': dEnd.strftime(OE_DFORMAT),
+                'chunk_size': chunk_size,
+                'chunk_ids': chunks,
+            }, context=context)
+
+    def _run_chunk(self, cr, uid, chunk_id, context=None):
+        """Process one chunk in its own transaction and commit it. On
+        failure the chunk's changes are rolled back and the error is
+        recorded on it. After MASS_SCHEDULE_MAX_ATTEMPTS failures the chunk
+        is given up on.
+        """
+
+        chunk_obj = self.pool.get('hr.schedule.generation.chunk')
+
+        with api.Environment.manage():
+            new_cr = self.pool.cursor()
+            try:
+                chunk_obj.process(new_cr, uid, chunk_id, context=context)
+                new_cr.commit()
+            except Exception as e:
+                new_cr.rollback()
+                _logger.exception(
+                    'Mass scheduling: chunk %s failed', chunk_id)
+                attempts = chunk_obj.read(
+                    new_cr, uid, chunk_id, ['attempts'],
+                    context=context)['attempts'] + 1
+                chunk_obj.write(
+                    new_cr, uid, chunk_id, {
+                        'state': (attempts >= MASS_SCHEDULE_MAX_ATTEMPTS
+                                  and 'error' or 'failed'),
+                        'attempts': attempts,
+                        'message': tools.ustr(e),
+                    }, context=context)
+                new_cr.commit()
+            finally:
+                new_cr.close()
+
+    def _run_chunks(self, cr, uid, chunk_ids, workers, context=None):
+
+        if workers <= 1:
+            for chunk_id in chunk_ids:
+                self._run_chunk(cr, uid, chunk_id, context=context)
+            return
+
+        # Each worker thread takes the next chunk from the queue until it
+        # is empty. The threads only share the queue: every chunk is
+        # processed with a cursor of its own.
+        #
+        queue = Queue.Queue()
+        for chunk_id in chunk_ids:
+            queue.put(chunk_id)
+
+        def worker():
+            while True:
+                try:
+                    chunk_id = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                self._run_chunk(cr, uid, chunk_id, context=context)
+
+        threads = [
+            threading.Thread(target=worker)
+            for i in xrange(min(workers, len(chunk_ids)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def process_runs(self, cr, uid, ids, workers=1, context=None):
+        """Process the chunks of the runs that have not been committed yet,
+        and not been given up on, in order, and update the state of the
+        runs. A run is given up on when all its remaining chunks are.
+        """
+
+        chunk_obj = self.pool.get('hr.schedule.generation.chunk')
+
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+
+        for run_id in ids:
+            chunk_ids = chunk_obj.search(
+                cr, uid, [
+                    ('run_id', '=', run_id),
+                    ('state', 'in', ['pending', 'failed']),
+                ], order='sequence', context=context)
+            self._run_chunks(cr, uid, chunk_ids, workers, context=context)
+
+            with api.Environment.manage():
+                new_cr = self.pool.cursor()
+                try:
+                    states = set(
+                        chunk['state'] for chunk in chunk_obj.read(
+                            new_cr, uid, chunk_obj.search(
+                                new_cr, uid, [
+                                    ('run_id', '=', run_id),
+                                    ('state', '!=', 'done'),
+                                ], context=context),
+                            ['state'], context=context))
+                    if not states:
+                        state = 'done'
+                    elif states == set(['error']):
+                        state = 'error'
+                    else:
+                        state = 'failed'
+                    self.write(
+                        new_cr, uid, run_id, {'state': state},
+                        context=context)
+                    new_cr.commit()
+                finally:
+                    new_cr.close()
+
+        return True
+
+
+class hr_schedule_generation_chunk(orm.Model):
+
+    _name = 'hr.schedule.generation.chunk'
+    _description = 'Mass Schedule Generation Chunk'
+    _order = 'run_id, sequence'
+
+    _columns = {
+        'run_id': fields.many2one(
+            'hr.schedule.generation',
+            'Run',
+            required=True,
+            ondelete='cascade',
+            readonly=True,
+        ),
+        'sequence': fields.integer(
+            'Sequence',
+            required=True,
+            readonly=True,
+        ),
+        'employee_ids': fields.many2many(
+            'hr.employee',
+            'hr_schedule_generation_chunk_employee_rel',
+            'chunk_id',
+            'employee_id',
+            'Employees',
+            readonly=True,
+        ),
+        'schedule_count': fields.integer(
+            'Schedules Created',
+            readonly=True,
+        ),
+        'attempts': fields.integer(
+            'Attempts',
+            readonly=True,
+        ),
+        'message': fields.text(
+            'Error',
+            readonly=True,
+        ),
+        'state': fields.selection(
+            [
+                ('pending', 'Pending'),
+                ('done', 'Done'),
+                ('failed', 'Failed'),
+                ('error', 'Given Up'),
+            ],
+            'State',
+            required=True,
+            readonly=True,
+        ),
+    }
+    _defaults = {
+        'state': 'pending',
+        'attempts': 0,
+    }
+
+    def process(self, cr, uid, chunk_id, context=None):
+        """Create the schedules of the employees of a chunk, and their
+        details in one batch.
+        """
+
+        sched_obj = self.pool.get('hr.schedule')
+
+        chunk = self.browse(cr, uid, chunk_id, context=context)
+        dStart = datetime.strptime(chunk.run_id.date_start, OE_DFORMAT).date()
+
+        ctx = dict(context or {}, hr_schedule_no_details=True)
+        sched_ids = []
+        for ee in chunk.employee_ids:
+
+            if (not ee.contract_id
+                    or not ee.contract_id.schedule_template_id):
+                continue
+
+            sched = {
+                'name': (ee.name + ': ' + dStart.strftime('%Y-%m-%d') +
+                         ' Wk ' + str(dStart.isocalendar()[1])),
+                'employee_id': ee.id,
+                'template_id': ee.contract_id.schedule_template_id.id,
+                'date_start': chunk.run_id.date_start,
+                'date_end': chunk.run_id.date_end,
+            }
+            sched_ids.append(sched_obj.create(cr, uid, sched, context=ctx))
+
+        sched_obj.create_details_batch(cr, uid, sched_ids, context=context)
+        self.write(
+            cr, uid, chunk_id, {
+                'state': 'done',
+                'schedule_count': len(sched_ids),
+                'message': False,
+            }, context=context)
+        return sched_ids
+
+
 class schedule_detail(orm.Model):
     _name = "hr.schedule.detail"
     _description = "Schedule Detail"
@@ -905,38 +1416,11 @@ WHERE (date_start <= %s and %s <= date_end)
     def _recompute_alerts(self, cr, uid, attendances, context=None):
         """Recompute alerts for each record in schedule detail."""
 
-        alert_obj = self.pool.get('hr.schedule.alert')
-
-        # Remove all alerts for the employee(s) for the day and recompute.
+        # Remove all alerts for the employee(s) for the day and recompute,
+        # once for each employee and day.
         #
-        for ee_id, strDay in attendances:
-
-            # Today's records will be checked tomorrow. Future records can't
-            # generate alerts.
-            if strDay >= fields.date.context_today(
-                    self, cr, uid, context=context):
-                continue
-
-            # TODO - Someone who cares about DST should fix this
-            #
-            data = self.pool.get('res.users').read(
-                cr, uid, uid, ['tz'], context=context)
-            dt = datetime.strptime(strDay + ' 00:00:00', '%Y-%m-%d %H:%M:%S')
-            lcldt = timezone(data['tz']).localize(dt, is_dst=False)
-            utcdt = lcldt.astimezone(utc)
-            utcdtNextDay = utcdt + relativedelta(days=+1)
-            strDayStart = utcdt.strftime('%Y-%m-%d %H:%M:%S')
-            strNextDay = utcdtNextDay.strftime('%Y-%m-%d %H:%M:%S')
-
-            alert_ids = alert_obj.search(cr, uid, [
-                ('employee_id', '=', ee_id),
-                '&',
-                ('name', '>=', strDayStart),
-                ('name', '<', strNextDay)
-            ], context=context)
-            alert_obj.unlink(cr, uid, alert_ids, context=context)
-            alert_obj.compute_alerts_by_employee(
-                cr, uid, ee_id, strDay, context=context)
+        self.pool.get('hr.schedule.alert').queue_recompute(
+            cr, uid, attendances, context=context)
 
     def create(self, cr, uid, vals, context=None):
 
@@ -967,6 +1451,50 @@ WHERE (date_start <= %s and %s <= date_end)
 
         return res
 
+    def create_bulk(self, cr, uid, vals_list, context=None):
+        """Insert schedule details in bulk and return their ids. Each
+        dictionary of vals_list must contain the name, dayofweek, day,
+        date_start, date_end, schedule_id, employee_id and department_id of
+        the detail. The details are created in draft state with their
+        workflow instances, and checked for overlaps like create() does. No
+        alert is recomputed: create() only does it for today, and new
+        details never trigger alerts for the current day.
+        """
+
+        if not vals_list:
+            return []
+
+        columns = [
+            'name', 'dayofweek', 'day', 'date_start', 'date_end',
+            'schedule_id', 'employee_id', 'department_id',
+        ]
+        res = insert_rows(cr, uid, 'hr_schedule_detail', columns + ['state'], [
+            tuple(vals.get(c) or None for c in columns) + ('draft',)
+            for vals in vals_list
+        ])
+
+        create_workflow_instances(cr, uid, self._name, res)
+
+        # Same check as the _detail_date constraint, for all the new
+        # details at once
+        #
+        cr.execute("""\
+SELECT d1.id
+FROM hr_schedule_detail d1
+  JOIN hr_schedule_detail d2
+    ON d2.schedule_id = d1.schedule_id
+   AND d2.id <> d1.id
+   AND d1.date_start <= d2.date_end
+   AND d2.date_start <= d1.date_end
+WHERE d1.id IN %s
+LIMIT 1""", (tuple(res),))
+        if cr.fetchall():
+            raise orm.except_orm(
+                _('ValidateError'),
+                self._rec_message(cr, uid, res, context=context))
+
+        return res
+
     def unlink(self, cr, uid, ids, context=None):
 
         if isinstance(ids, (int, long)):
@@ -1183,16 +1711,313 @@ class hr_schedule_alert(orm.Model):
         },
     }
 
+    def _get_employee_departments(self, cr, uid, employee_ids, context=None):
+        """Return a dictionary of department ids keyed by employee id."""
+
+        if not employee_ids:
+            return {}
+        cr.execute("""\
+SELECT id, department_id
+FROM hr_employee
+WHERE id IN %s""", (tuple(employee_ids),))
+        return dict(cr.fetchall())
+
+    def _load_alert_records(
+            self, cr, uid, employee_ids, strStart, strEnd, context=None):
+        """Load the schedule details and attendances of all employees in
+        employee_ids that start in the interval [strStart, strEnd) with
+        one query each, and return two dictionaries of browse records
+        keyed by employee id. The records of each employee are sorted by
+        date.
+        """
+
+        detail_obj = self.pool.get('hr.schedule.detail')
+        atnd_obj = self.pool.get('hr.attendance')
+
+        details = dict((ee_id, []) for ee_id in employee_ids)
+        punches = dict((ee_id, []) for ee_id in employee_ids)
+        if not employee_ids:
+            return details, punches
+
+        cr.execute("""\
+SELECT d.id, s.employee_id
+FROM hr_schedule_detail d
+  JOIN hr_schedule s ON s.id = d.schedule_id
+WHERE d.date_start >= %s
+  AND d.date_start < %s
+  AND s.employee_id IN %s
+ORDER BY d.date_start, d.id""", (strStart, strEnd, tuple(employee_ids)))
+        rows = cr.fetchall()
+        records = detail_obj.browse(
+            cr, uid, [r[0] for r in rows], context=context)
+        for (detail_id, ee_id), detail in zip(rows, records):
+            details[ee_id].append(detail)
+
+        cr.execute("""\
+SELECT id, employee_id
+FROM hr_attendance
+WHERE name >= %s
+  AND name < %s
+  AND employee_id IN %s
+ORDER BY name, id""", (strStart, strEnd, tuple(employee_ids)))
+        rows = cr.fetchall()
+        records = atnd_obj.browse(
+            cr, uid, [r[0] for r in rows], context=context)
+        for (punch_id, ee_id), punch in zip(rows, records):
+            punches[ee_id].append(punch)
+
+        self._normalize_alert_punches(
+            cr, uid, punches, strStart, strEnd, context=context)
+        return details, punches
+
+    def _get_edge_punches(self, cr, employee_ids, strStart, strEnd, last):
+        """Return the first (or last, if last is True) attendance of each
+        employee in employee_ids in the interval [strStart, strEnd), as a
+        dictionary of (id, action) tuples keyed by employee id."""
+
+        if not employee_ids:
+            return {}
+        order = last and 'DESC' or 'ASC'
+        cr.execute("""\
+SELECT DISTINCT ON (employee_id) employee_id, id, action
+FROM hr_attendance
+WHERE employee_id IN %s
+  AND name >= %s
+  AND name < %s
+ORDER BY employee_id, name """ + order + """, id """ + order,
+                   (tuple(employee_ids), strStart, strEnd))
+        return dict((ee_id, (att_id, action))
+                    for ee_id, att_id, action in cr.fetchall())
+
+    def _normalize_alert_punches(
+            self, cr, uid, punches, strStart, strEnd, context=None):
+        """Same as _get_normalized_attendance(), for the attendances of all
+        the employees in punches (as loaded by _load_alert_records()) at
+        once. A leading punch-out is paired with the last punch-in of the
+        day before and a trailing punch-in with the first punch-out of the
+        day after, or dropped if there is none.
+        """
+
+        leading = [ee_id for ee_id, recs in punches.iteritems()
+                   if recs and recs[0].action != 'sign_in']
+        trailing = [ee_id for ee_id, recs in punches.iteritems()
+                    if recs and recs[-1].action != 'sign_out']
+        if not leading and not trailing:
+            return
+
+        dtStart = datetime.strptime(strStart, OE_DTFORMAT)
+        dtEnd = datetime.strptime(strEnd, OE_DTFORMAT)
+        before = self._get_edge_punches(
+            cr, leading, (dtStart - timedelta(days=1)).strftime(OE_DTFORMAT),
+            strStart, True)
+        after = self._get_edge_punches(
+            cr, trailing, strEnd,
+            (dtEnd + timedelta(days=1)).strftime(OE_DTFORMAT), False)
+        extra_ids = [
+            att_id for edges, action in ((before, 'sign_in'),
+                                         (after, 'sign_out'))
+            for att_id, att_action in edges.itervalues()
+            if att_action == action
+        ]
+        extras = dict(
+            (att.id, att) for att in self.pool.get('hr.attendance').browse(
+                cr, uid, extra_ids, context=context))
+
+        for ee_id in set(leading):
+            prev = extras.get(before.get(ee_id, (False,))[0])
+            if prev and prev.action == 'sign_in':
+                punches[ee_id].insert(0, prev)
+            else:
+                del punches[ee_id][0]
+        for ee_id in set(trailing):
+            if not punches[ee_id]:
+                continue
+            nxt = extras.get(after.get(ee_id, (False,))[0])
+            if nxt and nxt.action == 'sign_out':
+                punches[ee_id].append(nxt)
+            else:
+                del punches[ee_id][-1]
+
+    def _existing_alert_keys(
+            self, cr, uid, rule_ids, punch_ids, detail_ids, context=None):
+        """Return the set of (rule, punch, schedule detail, time) keys of
+        the alerts already triggered by any of the records.
+        """
+
+        if not rule_ids or not (punch_ids or detail_ids):
+            return set()
+        cr.execute("""\
+SELECT rule_id, punch_id, sched_detail_id, name
+FROM hr_schedule_alert
+WHERE rule_id IN %s
+  AND (punch_id IN %s OR sched_detail_id IN %s)""", (
+            tuple(rule_ids), tuple(punch_ids) or (0,),
+            tuple(detail_ids) or (0,)))
+        return set(
+            (rule_id, punch_id or False, detail_id or False, name)
+            for rule_id, punch_id, detail_id, name in cr.fetchall()
+        )
+
+    def _create_alerts_bulk(self, cr, uid, alerts, context=None):
+        """Insert alerts in bulk and return their number. Each alert is
+        a tuple of (time, rule, punch, schedule detail, employee). The
+        stored computed columns are filled in directly. No creation message
+        is posted on the alerts (as with mail_create_nolog), but their
+        state is tracked as create() does, by _track_alerts_bulk().
+        """
+
+        if not alerts:
+            return 0
+
+        rule_obj = self.pool.get('hr.schedule.alert.rule')
+        rule_ids = list(set(a[1] for a in alerts))
+        severities = dict(
+            (r['id'], r['severity'])
+            for r in rule_obj.read(
+                cr, uid, rule_ids, ['severity'], context=context)
+        )
+        departments = self._get_employee_departments(
+            cr, uid, list(set(a[4] for a in alerts)), context=context)
+        defaults = self.default_get(
+            cr, uid, ['company_id', 'state'], context=context)
+
+        state = defaults.get('state', 'unresolved')
+        rows = []
+        for strdt, rule_id, punch_id, detail_id, ee_id in alerts:
+            rows.append((
+                strdt, rule_id, punch_id or None, detail_id or None,
+                ee_id, departments.get(ee_id) or None,
+                severities[rule_id], state,
+                defaults.get('company_id') or None,
+            ))
+
+        alert_ids = insert_rows(cr, uid, 'hr_schedule_alert', [
+            'name', 'rule_id', 'punch_id', 'sched_detail_id', 'employee_id',
+            'department_id', 'severity', 'state', 'company_id',
+        ], rows)
+        self._track_alerts_bulk(
+            cr, uid, zip(alert_ids, [row[0] for row in rows]), state,
+            context=context)
+        return len(alert_ids)
+
+    def _track_alerts_bulk(self, cr, uid, alerts, state, context=None):
+        """Do for alerts, a list of (id, name) of alerts inserted in state
+        with plain SQL, what mail.thread does on create(): subscribe the
+        user to them, and post the messages of the subtypes tracking their
+        state. The user, author of the messages, is their only follower
+        and is not notified of them.
+        """
+
+        if context is None:
+            context = {}
+        if not alerts:
+            return
+
+        partner_id = self.pool.get('res.users').read(
+            cr, uid, uid, ['partner_id'], context=context)['partner_id'][0]
+        alert_ids = [alert_id for alert_id, name in alerts]
+
+        if not context.get('mail_create_nosubscribe'):
+            cr.execute("""\
+SELECT id
+FROM mail_message_subtype
+WHERE "default"
+  AND (res_model = %s OR res_model IS NULL)""", (self._name,))
+            subtype_ids = [r[0] for r in cr.fetchall()]
+            follower_ids = [r[0] for r in execute_values(
+                cr, 'INSERT INTO mail_followers (res_model, res_id, '
+                'partner_id) VALUES %s RETURNING id',
+                [(self._name, alert_id, partner_id)
+                 for alert_id in alert_ids],
+                fetch=True)]
+            if subtype_ids:
+                execute_values(
+                    cr, 'INSERT INTO mail_followers_mail_message_subtype_rel '
+                    '(mail_followers_id, mail_message_subtype_id) VALUES %s',
+                    [(follower_id, subtype_id)
+                     for follower_id in follower_ids
+                     for subtype_id in subtype_ids])
+
+        if context.get('mail_notrack'):
+            return
+        imd_obj = self.pool.get('ir.model.data')
+        subtype_obj = self.pool.get('mail.message.subtype')
+        now = fields.datetime.now()
+        for xmlid, method in self._track['state'].iteritems():
+            if not method(self, cr, uid, {'state': state}, context):
+                continue
+            subtype_id = imd_obj.xmlid_to_res_id(cr, uid, xmlid)
+            if not subtype_id:
+                continue
+            subtype = subtype_obj.browse(
+                cr, uid, subtype_id, context=context)
+            body = '<span>%s</span>' % (subtype.description or subtype.name)
+            insert_rows(cr, uid, 'mail_message', [
+                'model', 'res_id', 'record_name', 'type', 'subtype_id',
+                'author_id', 'date', 'body',
+            ], [
+                (self._name, alert_id, name, 'notification', subtype_id,
+                 partner_id, now, body)
+                for alert_id, name in alerts
+            ])
+
+    def compute_alerts_batch(self, cr, uid, details, punches, context=None):
+        """Run the schedule detail and attendance records of each employee
+        against every active rule and create the alerts that have not
+        already been triggered. details and punches are dictionaries of
+        date-sorted browse records keyed by employee id, as returned by
+        _load_alert_records(). Returns the number of alerts created.
+        """
+
+        rule_obj = self.pool.get('hr.schedule.alert.rule')
+
+        rule_ids = rule_obj.search(
+            cr, uid, [('active', '=', True)], context=context)
+        rules = rule_obj.browse(cr, uid, rule_ids, context=context)
+
+        employee_ids = set(
+            [ee_id for ee_id, recs in details.iteritems() if recs] +
+            [ee_id for ee_id, recs in punches.iteritems() if recs]
+        )
+
+        candidates = []
+        for ee_id in sorted(employee_ids):
+            ee_details = details.get(ee_id, [])
+            ee_punches = punches.get(ee_id, [])
+            for rule in rules:
+                res = rule_obj.check_rule(
+                    cr, uid, rule, ee_details, ee_punches, context=context)
+                for strdt, attendance_id in res['punches']:
+                    candidates.append(
+                        (strdt, rule.id, attendance_id, False, ee_id))
+                for strdt, detail_id in res['schedule_details']:
+                    candidates.append(
+                        (strdt, rule.id, False, detail_id, ee_id))
+
+        # Skip alerts that have already been triggered
+        #
+        seen = self._existing_alert_keys(
+            cr, uid, rule_ids,
+            [p.id for recs in punches.itervalues() for p in recs],
+            [d.id for recs in details.itervalues() for d in recs],
+            context=context)
+        alerts = []
+        for alert in candidates:
+            key = (alert[1], alert[2], alert[3], alert[0])
+            if key in seen:
+                continue
+            seen.add(key)
+            alerts.append(alert)
+
+        return self._create_alerts_bulk(cr, uid, alerts, context=context)
+
     def check_for_alerts(self, cr, uid, context=None):
         """Check the schedule detail and attendance records for
         yesterday against the scheduling/attendance alert rules.
         If any rules match create a record in the database.
         """
 
-        dept_obj = self.pool.get('hr.department')
-        detail_obj = self.pool.get('hr.schedule.detail')
-        attendance_obj = self.pool.get('hr.attendance')
-        rule_obj = self.pool.get('hr.schedule.alert.rule')
+        ee_obj = self.pool.get('hr.employee')
 
         # TODO - Someone who cares about DST should fix ths
         #
@@ -1208,86 +2033,15 @@ class hr_schedule_alert(orm.Model):
         strToday = utcdtToday.strftime('%Y-%m-%d %H:%M:%S')
         strYesterday = utcdtYesterday.strftime('%Y-%m-%d %H:%M:%S')
 
-        dept_ids = dept_obj.search(cr, uid, [], context=context)
-        for dept in dept_obj.browse(cr, uid, dept_ids, context=context):
-            for employee in dept.member_ids:
-
-                # Get schedule and attendance records for the employee for the
-                # day
-                #
-                sched_detail_ids = detail_obj.search(
-                    cr, uid, [
-                        ('schedule_id.employee_id', '=', employee.id),
-                        '&',
-                        ('date_start', '>=', strYesterday),
-                        ('date_start', '<', strToday),
-                    ],
-                    order='date_start',
-                    context=context
-                )
-                attendance_ids = attendance_obj.search(
-                    cr, uid, [
-                        ('employee_id', '=', employee.id),
-                        '&',
-                        ('name', '>=', strYesterday),
-                        ('name', '<', strToday),
-                    ],
-                    order='name',
-                    context=context
-                )
-
-                # Run the schedule and attendance records against each active
-                # rule, and create alerts for each result returned.
-                #
-                rule_ids = rule_obj.search(
-                    cr, uid, [('active', '=', True)], context=context)
-                for rule in rule_obj.browse(
-                        cr, uid, rule_ids, context=context):
-                    res = rule_obj.check_rule(
-                        cr, uid, rule, detail_obj.browse(
-                            cr, uid, sched_detail_ids, context=context),
-                        attendance_obj.browse(
-                            cr, uid, attendance_ids, context=context),
-                        context=context
-                    )
-
-                    for strdt, attendance_id in res['punches']:
-                        # skip if it has already been triggered
-                        ids = self.search(
-                            cr, uid, [
-                                ('punch_id', '=', attendance_id),
-                                ('rule_id', '=', rule.id),
-                                ('name', '=', strdt),
-                            ], context=context)
-                        if len(ids) > 0:
-                            continue
-
-                        self.create(
-                            cr, uid, {
-                                'name': strdt,
-                                'rule_id': rule.id,
-                                'punch_id': attendance_id,
-                            }, context=context
-                        )
-
-                    for strdt, detail_id in res['schedule_details']:
-                        # skip if it has already been triggered
-                        ids = self.search(
-                            cr, uid, [
-                                ('sched_detail_id', '=', detail_id),
-                                ('rule_id', '=', rule.id),
-                                ('name', '=', strdt),
-                            ], context=context)
-                        if len(ids) > 0:
-                            continue
-
-                        self.create(
-                            cr, uid, {
-                                'name': strdt,
-                                'rule_id': rule.id,
-                                'sched_detail_id': detail_id,
-                            }, context=context
-                        )
+        # Load the schedule and attendance records of every employee that
+        # belongs to a department in bulk, then evaluate them all at once.
+        #
+        employee_ids = ee_obj.search(
+            cr, uid, [('department_id', '!=', False)], context=context)
+        details, punches = self._load_alert_records(
+            cr, uid, employee_ids, strYesterday, strToday, context=context)
+        self.compute_alerts_batch(
+            cr, uid, details, punches, context=context)
 
     def _get_normalized_attendance(
             self, cr, uid, employee_id, utcdt, att_ids, context=None):
@@ -1334,6 +2088,137 @@ class hr_schedule_alert(orm.Model):
 
         return att_ids
 
+    def _is_recompute_sync(self, cr, uid, context=None):
+        """Whether alerts are recomputed as soon as the records they
+        depend on change, rather than queued for process_alert_queue().
+        The alert_recompute_sync key of the context takes precedence over
+        the hr_schedule.alert_recompute_sync parameter.
+        """
+
+        if context and 'alert_recompute_sync' in context:
+            return bool(context['alert_recompute_sync'])
+        return self.pool.get('ir.config_parameter').get_param(
+            cr, uid, 'hr_schedule.alert_recompute_sync', default='0',
+            context=context) not in ('0', 'False', 'false')
+
+    def _get_alert_tz(self, cr, uid, context=None):
+        """Name of the timezone of the user, in which the days of the keys
+        of queue_recompute() are given."""
+
+        data = self.pool.get('res.users').read(
+            cr, uid, uid, ['tz'], context=context)
+        return data['tz'] or 'UTC'
+
+    def queue_recompute(self, cr, uid, keys, context=None):
+        """Recompute the alerts of each (employee id, day) in keys, either
+        at once or, by default, by adding the keys that are not already
+        queued to the queue drained by process_alert_queue(). The days are
+        those of the timezone of the user, which is queued with them.
+        """
+
+        # Today's records will be checked tomorrow. Future records can't
+        # generate alerts.
+        today = fields.date.context_today(self, cr, uid, context=context)
+        keys = sorted(set(
+            (ee_id, strDay) for ee_id, strDay in keys
+            if ee_id and strDay and strDay < today))
+        if not keys:
+            return
+
+        tz = self._get_alert_tz(cr, uid, context=context)
+        if self._is_recompute_sync(cr, uid, context=context):
+            self.recompute_alerts(cr, uid, keys, tz=tz, context=context)
+            return
+
+        execute_values(cr, """\
+INSERT INTO hr_schedule_alert_queue (employee_id, day, tz)
+SELECT v.employee_id, v.day::date, v.tz
+FROM (VALUES %s)
+  AS v(employee_id, day, tz)
+WHERE NOT EXISTS (SELECT 1
+                  FROM hr_schedule_alert_queue q
+                  WHERE q.employee_id = v.employee_id
+                    AND q.day = v.day::date
+                    AND q.tz = v.tz)""",
+                       [(ee_id, strDay, tz) for ee_id, strDay in keys])
+
+    def recompute_alerts(self, cr, uid, keys, tz=None, context=None):
+        """Remove the alerts of each (employee id, day) in keys and compute
+        them again. The days are those of the timezone tz, by default the
+        timezone of the user. The employees of a day are loaded and run
+        against the alert rules together, by compute_alerts_batch().
+        """
+
+        # TODO - Someone who cares about DST should fix this
+        #
+        local_tz = timezone(
+            tz or self._get_alert_tz(cr, uid, context=context))
+
+        employees_by_day = {}
+        for ee_id, strDay in keys:
+            employees_by_day.setdefault(strDay, set()).add(ee_id)
+
+        for strDay in sorted(employees_by_day):
+            employee_ids = sorted(employees_by_day[strDay])
+            dt = datetime.strptime(strDay + ' 00:00:00', OE_DTFORMAT)
+            utcdt = local_tz.localize(dt, is_dst=False).astimezone(utc)
+            strDayStart = utcdt.strftime(OE_DTFORMAT)
+            strNextDay = (utcdt + relativedelta(days=+1)).strftime(
+                OE_DTFORMAT)
+
+            # A day that cannot be computed is retried one employee at a
+            # time, so that a single bad key does not hold back the others
+            try:
+                with cr.savepoint():
+                    self._recompute_day_alerts(
+                        cr, uid, employee_ids, strDayStart, strNextDay,
+                        context=context)
+            except Exception:
+                for ee_id in employee_ids:
+                    try:
+                        with cr.savepoint():
+                            self._recompute_day_alerts(
+                                cr, uid, [ee_id], strDayStart, strNextDay,
+                                context=context)
+                    except Exception:
+                        _logger.exception(
+                            'Could not recompute the alerts of employee %s '
+                            'on %s', ee_id, strDay)
+
+    def _recompute_day_alerts(
+            self, cr, uid, employee_ids, strDayStart, strNextDay,
+            context=None):
+
+        alert_ids = self.search(cr, uid, [
+            ('employee_id', 'in', employee_ids),
+            ('name', '>=', strDayStart),
+            ('name', '<', strNextDay),
+        ], context=context)
+        if alert_ids:
+            self.unlink(cr, uid, alert_ids, context=context)
+
+        details, punches = self._load_alert_records(
+            cr, uid, employee_ids, strDayStart, strNextDay, context=context)
+        self.compute_alerts_batch(cr, uid, details, punches, context=context)
+
+    def process_alert_queue(self, cr, uid, context=None):
+        """Method called by cron to recompute the alerts of the employees
+        and days queued by queue_recompute(), each of them once.
+        """
+
+        cr.execute("""\
+DELETE FROM hr_schedule_alert_queue
+RETURNING employee_id, to_char(day, 'YYYY-MM-DD'), tz""")
+        keys_by_tz = {}
+        for ee_id, strDay, tz in cr.fetchall():
+            keys_by_tz.setdefault(tz, set()).add((ee_id, strDay))
+        for tz, keys in sorted(keys_by_tz.iteritems()):
+            self.recompute_alerts(
+                cr, uid, sorted(keys), tz=tz, context=context)
+            _logger.info('Recomputed the alerts of %d employee days (%s)',
+                         len(keys), tz)
+        return True
+
     def compute_alerts_by_employee(
             self, cr, uid, employee_id, strDay, context=None):
         """Compute alerts for employee on specified day."""
@@ -1420,6 +2305,37 @@ class hr_schedule_alert(orm.Model):
                             context=context)
 
 
+class hr_schedule_alert_queue(orm.Model):
+
+    _name = 'hr.schedule.alert.queue'
+    _description = 'Attendance Alerts to Recompute'
+    _log_access = False
+    _order = 'day, employee_id'
+
+    _columns = {
+        'employee_id': fields.many2one(
+            'hr.employee',
+            'Employee',
+            required=True,
+            ondelete='cascade',
+            readonly=True,
+        ),
+        'day': fields.date(
+            'Day',
+            required=True,
+            select=True,
+            readonly=True,
+        ),
+        'tz': fields.char(
+            'Timezone',
+            size=64,
+            required=True,
+            readonly=True,
+            help="Timezone in which the day was given.",
+        ),
+    }
+
+
 class hr_schedule_alert_rule(orm.Model):
 
     _name = 'hr.schedule.alert.rule'
@@ -1528,7 +2444,7 @@ class hr_schedule_alert_rule(orm.Model):
                 if punch.action == 'sign_in':
                     dtStart = datetime.strptime(
                         punch.name, '%Y-%m-%d %H:%M:%S')
-                elif punch.action == 'sign_out':
+                elif punch.action == 'sign_out' and dtStart:
                     dtEnd = datetime.strptime(punch.name, '%Y-%m-%d %H:%M:%S')
                     actual_hours += float(
                         (dtEnd - dtStart).seconds / 60) / 60.0
@@ -1848,39 +2764,153 @@ class hr_attendance(orm.Model):
     def _recompute_alerts(self, cr, uid, attendances, context=None):
         """Recompute alerts for each record in attendances."""
 
-        alert_obj = self.pool.get('hr.schedule.alert')
-
-        # Remove all alerts for the employee(s) for the day and recompute.
+        # Remove all alerts for the employee(s) for the day and recompute,
+        # once for each employee and day.
         #
-        for ee_id, strDay in attendances:
+        self.pool.get('hr.schedule.alert').queue_recompute(
+            cr, uid, attendances, context=context)
+
+    def _check_create_bulk(self, cr, uid, vals_list, context=None):
+        """Check the punches in vals_list before create_bulk() inserts
+        them, and raise an exception if any of them may not be created.
+        Modules checking the punches in create() extend this to make the
+        same checks for the whole batch at once.
+        """
 
-            # Today's records will be checked tomorrow. Future records can't
-            # generate alerts.
-            if strDay >= fields.date.context_today(
-                    self, cr, uid, context=context):
-                continue
+        return True
 
-            # TODO - Someone who cares about DST should fix this
-            #
-            data = self.pool.get('res.users').read(
-                cr, uid, uid, ['tz'], context=context)
-            dt = datetime.strptime(strDay + ' 00:00:00', '%Y-%m-%d %H:%M:%S')
-            lcldt = timezone(data['tz']).localize(dt, is_dst=False)
-            utcdt = lcldt.astimezone(utc)
-            utcdtNextDay = utcdt + relativedelta(days=+1)
-            strDayStart = utcdt.strftime('%Y-%m-%d %H:%M:%S')
-            strNextDay = utcdtNextDay.strftime('%Y-%m-%d %H:%M:%S')
-
-            alert_ids = alert_obj.search(
-                cr, uid, [
-                    ('employee_id', '=', ee_id),
-                    '&',
-                    ('name', '>=', strDayStart),
-                    ('name', '<', strNextDay)
-                ], context=context)
-            alert_obj.unlink(cr, uid, alert_ids, context=context)
-            alert_obj.compute_alerts_by_employee(
-                cr, uid, ee_id, strDay, context=context)
+    def create_bulk(self, cr, uid, vals_list, context=None):
+        """Insert attendance records (e.g. punches loaded from time clocks)
+        in bulk and return their ids, in the order of vals_list. The batch
+        is checked with _check_create_bulk(), missing values are taken from
+        the defaults and the stored computed columns, workflow instances
+        and sign-in/sign-out alternation check are all done with set-based
+        queries. The alerts of each employee
+        and day with new punches are queued for recomputation once. The
+        number of punches created per second is logged.
+        """
+
+        if not vals_list:
+            return []
+        start = time.time()
+        self._check_create_bulk(cr, uid, vals_list, context=context)
+
+        magic_columns = ['id', 'create_uid', 'create_date', 'write_uid',
+                         'write_date']
+        columns = [
+            name for name, column in self._columns.iteritems()
+            if getattr(column, '_classic_write', False)
+            and name not in magic_columns
+        ]
+        given = set()
+        for vals in vals_list:
+            given.update(vals)
+        defaults = self.default_get(
+            cr, uid, [c for c in columns if c not in given], context=context)
+        columns = sorted(c for c in columns if c in given or c in defaults)
+
+        res = insert_rows(cr, uid, 'hr_attendance', columns, [
+            tuple(
+                self._columns[c]._symbol_set[1](
+                    vals[c] if c in vals else defaults.get(c))
+                for c in columns
+            )
+            for vals in vals_list
+        ])
+
+        self._set_stored_columns_bulk(cr, uid, res, context=context)
+        create_workflow_instances(cr, uid, self._name, res)
+        self._check_alternation_bulk(cr, uid, res, context=context)
+
+        cr.execute("""\
+SELECT DISTINCT employee_id, to_char(name, 'YYYY-MM-DD')
+FROM hr_attendance
+WHERE id IN %s
+ORDER BY 1, 2""", (tuple(res),))
+        self._recompute_alerts(cr, uid, cr.fetchall(), context=context)
+
+        elapsed = time.time() - start
+        _logger.info(
+            'Created %d attendance records in %.2fs (%.0f punches/s)',
+            len(res), elapsed, elapsed and len(res) / elapsed or 0.0)
+        return res
+
+    def _set_stored_columns_bulk(self, cr, uid, ids, context=None):
+        """Fill the stored computed columns of the attendance records in
+        ids. The day and worked hours of hr_attendance are computed in
+        SQL, any other column with its function."""
+
+        stored = [
+            name for name, column in self._columns.iteritems()
+            if isinstance(column, fields.function) and column.store
+        ]
+        if 'day' in stored:
+            stored.remove('day')
+            cr.execute("""\
+UPDATE hr_attendance
+SET day = to_char(name, 'YYYY-MM-DD')
+WHERE id IN %s""", (tuple(ids),))
+        if 'worked_hours' in stored:
+            stored.remove('worked_hours')
+            # Whole minutes since the last sign-in, within a day
+            cr.execute("""\
+UPDATE hr_attendance a
+SET worked_hours = CASE
+    WHEN a.action = 'sign_in' THEN 0.0
+    ELSE coalesce((
+        SELECT floor(mod(extract(epoch FROM a.name - s.name)::numeric,
+                         86400) / 60) / 60.0
+        FROM hr_attendance s
+        WHERE s.employee_id = a.employee_id
+          AND s.name < a.name
+          AND s.action = 'sign_in'
+        ORDER BY s.name DESC
+        LIMIT 1), 0.0)
+    END
+WHERE a.id IN %s
+  AND a.action IN ('sign_in', 'sign_out')""", (tuple(ids),))
+        if stored:
+            self._store_set_values(cr, uid, ids, stored, context)
+
+    def _check_alternation_bulk(self, cr, uid, ids, context=None):
+        """Same check as the sign-in/sign-out alternation constraint of
+        hr_attendance, for all the attendance records in ids at once."""
+
+        cr.execute("""\
+SELECT n.id
+FROM hr_attendance n
+WHERE n.id IN %s
+  AND (n.action = (SELECT p.action
+                   FROM hr_attendance p
+                   WHERE p.employee_id = n.employee_id
+                     AND p.name < n.name
+                     AND p.action IN ('sign_in', 'sign_out')
+                   ORDER BY p.name DESC
+                   LIMIT 1)
+       OR n.action = (SELECT x.action
+                      FROM hr_attendance x
+                      WHERE x.employee_id = n.employee_id
+                        AND x.name > n.name
+                        AND x.action IN ('sign_in', 'sign_out')
+                      ORDER BY x.name
+                      LIMIT 1)
+       OR (n.action != 'sign_in'
+           AND NOT EXISTS (SELECT 1
+                           FROM hr_attendance o
+                           WHERE o.employee_id = n.employee_id
+                             AND o.name != n.name
+                             AND o.action IN ('sign_in', 'sign_out'))))
+ORDER BY n.name
+LIMIT 1""", (tuple(ids),))
+        row = cr.fetchone()
+        if row:
+            punch = self.browse(cr, uid, row[0], context=context)
+            raise orm.except_orm(
+                _('ValidateError'),
+                _('Error ! Sign in (resp. Sign out) must follow Sign out '
+                  '(resp. Sign in)\n'
+                  'Employee: %s\n'
+                  'Time: %s') % (punch.employee_id.name, punch.name))
 
     def create(self, cr, uid, vals, context=None):
 
@@ -0,0 +1,260 @@
+# -*- coding:utf-8 -*-
+#
+#
+#    Copyright (C) 2013 Michael Telahun Makonnen <mmakonnen@gmail.com>.
+#    All Rights Reserved.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from datetime import date, timedelta
+
+from openerp.osv import orm
+from openerp.tests import common
+
+
+class test_hr_schedule(common.TransactionCase):
+
+    def setUp(self):
+        super(test_hr_schedule, self).setUp()
+        self.user_model = self.registry('res.users')
+        self.employee_model = self.registry('hr.employee')
+        self.schedule_model = self.registry('hr.schedule')
+        self.template_model = self.registry('hr.schedule.template')
+        self.detail_model = self.registry('hr.schedule.detail')
+        self.context = self.user_model.context_get(self.cr, self.uid)
+
+        cr, uid, context = self.cr, self.uid, self.context
+
+        # Schedule details are generated in the timezone of the user
+        self.user_model.write(
+            cr, uid, [uid], {'tz': 'Europe/Paris'}, context=context)
+
+        self.employee_id = self.employee_model.create(
+            cr, uid, {'name': 'Employee 1'}, context=context)
+
+        # Two shifts, before and after lunch, on every day of the week
+        self.template_id = self.template_model.create(
+            cr, uid, {
+                'name': 'Template 1',
+                'worktime_ids': [
+                    (0, 0, {
+                        'name': '%d-%s' % (day, hour_from),
+                        'dayofweek': str(day),
+                        'hour_from': hour_from,
+                        'hour_to': hour_to,
+                    })
+                    for day in range(7)
+                    for hour_from, hour_to in [
+                        ('08:00', '12:00'),
+                        ('13:00', '17:00'),
+                    ]
+                ],
+            }, context=context)
+
+    def get_details(self, date_start, date_end):
+        cr, uid, context = self.cr, self.uid, self.context
+        sched_id = self.schedule_model.create(
+            cr, uid, {
+                'name': 'Schedule',
+                'employee_id': self.employee_id,
+                'template_id': self.template_id,
+                'date_start': date_start,
+                'date_end': date_end,
+            }, context=context)
+        detail_ids = self.detail_model.search(
+            cr, uid, [('schedule_id', '=', sched_id)], order='date_start',
+            context=context)
+        return [
+            (d['dayofweek'], d['day'], d['date_start'], d['date_end'])
+            for d in self.detail_model.read(
+                cr, uid, detail_ids,
+                ['dayofweek', 'day', 'date_start', 'date_end'],
+                context=context)
+        ]
+
+    def expected_week(self, week_start, utc_offset):
+        """Expected details of a week: the UTC offset in effect on the
+        first day of the week is applied to the whole week.
+        """
+        res = []
+        for day in range(7):
+            d = week_start + timedelta(days=day)
+            for hour_from, hour_to in [(8, 12), (13, 17)]:
+                res.append((
+                    str(day),
+                    d.strftime('%Y-%m-%d'),
+                    '%s %02d:00:00' % (d, hour_from - utc_offset),
+                    '%s %02d:00:00' % (d, hour_to - utc_offset),
+                ))
+        return res
+
+    def test_details_dst_start(self):
+        # Daylight saving time starts on Sunday 2015-03-29
+        self.assertEqual(
+            self.get_details('2015-03-23', '2015-04-05'),
+            self.expected_week(date(2015, 3, 23), 1) +
+            self.expected_week(date(2015, 3, 30), 2))
+
+    def test_details_dst_end(self):
+        # Daylight saving time ends on Sunday 2015-10-25
+        self.assertEqual(
+            self.get_details('2015-10-19', '2015-11-01'),
+            self.expected_week(date(2015, 10, 19), 2) +
+            self.expected_week(date(2015, 10, 26), 1))
+
+    def test_attendance_create_bulk(self):
+        cr, uid, context = self.cr, self.uid, self.context
+        attendance_model = self.registry('hr.attendance')
+        ids = attendance_model.create_bulk(
+            cr, uid, [
+                {'employee_id': self.employee_id, 'action': action,
+                 'name': name}
+                for action, name in [
+                    ('sign_in', '2015-03-02 07:00:00'),
+                    ('sign_out', '2015-03-02 11:30:00'),
+                    ('sign_in', '2015-03-03 07:00:00'),
+                    ('sign_out', '2015-03-03 16:15:00'),
+                ]
+            ], context=context)
+        self.assertEqual(len(ids), 4)
+        punches = attendance_model.read(
+            cr, uid, ids, ['day', 'worked_hours'], context=context)
+        self.assertEqual(
+            [(p['day'], p['worked_hours']) for p in punches],
+            [('2015-03-02', 0.0), ('2015-03-02', 4.5),
+             ('2015-03-03', 0.0), ('2015-03-03', 9.25)])
+
+        # Two sign-ins in a row
+        with self.assertRaises(orm.except_orm):
+            attendance_model.create_bulk(
+                cr, uid, [
+                    {'employee_id': self.employee_id, 'action': 'sign_in',
+                     'name': '2015-03-04 07:00:00'},
+                    {'employee_id': self.employee_id, 'action': 'sign_in',
+                     'name': '2015-03-04 08:00:00'},
+                ], context=context)
+
+    def test_alert_queue(self):
+        cr, uid, context = self.cr, self.uid, self.context
+        alert_model = self.registry('hr.schedule.alert')
+        keys = [(self.employee_id, '2015-03-02')] * 3
+        context = dict(context, alert_recompute_sync=False)
+        alert_model.queue_recompute(cr, uid, keys, context=context)
+        alert_model.queue_recompute(cr, uid, keys, context=context)
+        cr.execute('SELECT count(*) FROM hr_schedule_alert_queue '
+                   'WHERE employee_id = %s', (self.employee_id,))
+        self.assertEqual(cr.fetchone()[0], 1)
+
+        alert_model.process_alert_queue(cr, uid, context=context)
+        cr.execute('SELECT count(*) FROM hr_schedule_alert_queue')
+        self.assertEqual(cr.fetchone()[0], 0)
+
+    def test_alert_night_shift(self):
+        cr, uid, context = self.cr, self.uid, self.context
+        alert_model = self.registry('hr.schedule.alert')
+        context = dict(context, alert_recompute_sync=False)
+        ids = self.registry('hr.attendance').create_bulk(
+            cr, uid, [
+                {'employee_id': self.employee_id, 'action': action,
+                 'name': name}
+                for action, name in [
+                    ('sign_in', '2015-03-02 21:00:00'),
+                    ('sign_out', '2015-03-03 05:00:00'),
+                ]
+            ], context=context)
+
+        # The punches of each day are completed with the other half of the
+        # night shift (the days start at 23:00 UTC in Paris)
+        for strStart, strEnd in [
+                ('2015-03-01 23:00:00', '2015-03-02 23:00:00'),
+                ('2015-03-02 23:00:00', '2015-03-03 23:00:00')]:
+            details, punches = alert_model._load_alert_records(
+                cr, uid, [self.employee_id], strStart, strEnd,
+                context=context)
+            self.assertEqual(
+                [p.id for p in punches[self.employee_id]], ids)
+
+        alert_model.recompute_alerts(
+            cr, uid, [(self.employee_id, '2015-03-02'),
+                      (self.employee_id, '2015-03-03')],
+            context=context)
+        self.assertFalse(alert_model.search(cr, uid, [
+            ('employee_id', '=', self.employee_id),
+            ('rule_id.code', 'in', ['MISSPUNCH', 'UNSCHEDOT']),
+        ], context=context))
+
+    def test_alert_tracking(self):
+        cr, uid, context = self.cr, self.uid, self.context
+        alert_model = self.registry('hr.schedule.alert')
+        context = dict(context, alert_recompute_sync=False)
+        self.registry('hr.attendance').create_bulk(
+            cr, uid, [
+                {'employee_id': self.employee_id, 'action': action,
+                 'name': name}
+                for action, name in [
+                    ('sign_in', '2015-03-02 08:00:00'),
+                    ('sign_out', '2015-03-02 12:00:00'),
+                ]
+            ], context=context)
+
+        # The attendance is not scheduled
+        alert_model.recompute_alerts(
+            cr, uid, [(self.employee_id, '2015-03-02')], context=context)
+        alert_ids = alert_model.search(cr, uid, [
+            ('employee_id', '=', self.employee_id),
+            ('rule_id.code', '=', 'UNSCHEDATT'),
+        ], context=context)
+        self.assertTrue(alert_ids)
+
+        subtype_id = self.registry('ir.model.data').xmlid_to_res_id(
+            cr, uid, 'hr_schedule.mt_alert_unresolved')
+        for alert in alert_model.browse(cr, uid, alert_ids, context=context):
+            self.assertEqual(
+                [m.subtype_id.id for m in alert.message_ids], [subtype_id])
+            self.assertIn(
+                self.registry('res.users').browse(
+                    cr, uid, uid, context=context).partner_id,
+                alert.message_follower_ids)
+
+    def test_rest_days_bulk(self):
+        cr, uid, context = self.cr, self.uid, self.context
+        self.get_details('2015-03-02', '2015-03-15')
+        sched_id = self.schedule_model.search(
+            cr, uid, [('employee_id', '=', self.employee_id)],
+            context=context)[0]
+
+        # Explicit rest day in the first week, none scheduled on the last
+        # Sunday of the second one
+        sunday_id = self.registry('hr.schedule.weekday').create(
+            cr, uid, {'name': 'Sunday', 'sequence': 6}, context=context)
+        self.schedule_model.write(
+            cr, uid, [sched_id], {'restday_ids1': [(6, 0, [sunday_id])]},
+            context=context)
+        self.detail_model.unlink(
+            cr, uid, self.detail_model.search(
+                cr, uid, [('schedule_id', '=', sched_id),
+                          ('day', '=', '2015-03-15')], context=context),
+            context=context)
+
+        keys = [(sched_id, '2015-03-02'), (sched_id, '2015-03-09')]
+        self.assertEqual(
+            self.schedule_model.get_rest_days_bulk(
+                cr, uid, keys, context=context),
+            dict((key, self.schedule_model.get_rest_days_by_id(
+                cr, uid, key[0], key[1], context=context)) for key in keys))
+        self.assertEqual(
+            self.schedule_model.get_rest_days_bulk(
+                cr, uid, keys, context=context)[keys[1]], [6])
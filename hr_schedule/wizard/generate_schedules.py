@@ -74,6 +74,8 @@ class hr_schedule_generate(orm.TransientModel):
         dStart = datetime.strptime(data['date_start'], '%Y-%m-%d').date()
         dEnd = dStart + relativedelta(weeks=+data['no_weeks'], days=-1)
 
+        # Generate the details of all the schedules in one batch
+        ctx = dict(context or {}, hr_schedule_no_details=True)
         sched_ids = []
         if len(data['employee_ids']) > 0:
             for ee in ee_obj.browse(
@@ -90,7 +92,9 @@ class hr_schedule_generate(orm.TransientModel):
                     'date_end': dEnd.strftime('%Y-%m-%d'),
                 }
                 sched_ids.append(
-                    sched_obj.create(cr, uid, sched, context=context))
+                    sched_obj.create(cr, uid, sched, context=ctx))
+            sched_obj.create_details_batch(
+                cr, uid, sched_ids, context=context)
 
         return {
             'view_type': 'form',